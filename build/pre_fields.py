@@ -10,10 +10,20 @@
 
 ## Inputs
 #  bdb\insert\ispy2.jsp page definition of original web app
-#  pre_fields.py    Start of the generated code, used literally.
+#  pre_fields_preamble.py    Start of the generated code, used literally.
+#  pre_fields_coda.py        End of the generated code, used literally.
+#  the deviation reasons     From the database, only when the code is generated.
 #
 ## Outputs
-#  tqt.py   or name of your choice.  The generated application.
+#  src/ispy2_mri/ispy2_gui.py   The generated application.
+#  src/ispy2_mri/formtable.py   The fields of the form, from which the application builds it.
+#  pre_fields_manifest.json     Hashes of the inputs the application was generated from.
+#
+## Usage
+#  py pre_fields.py [--dsn DSN]          regenerate if any input file changed, reading the reasons from DSN
+#  py pre_fields.py --force               regenerate regardless, e.g., after the reasons in the database changed
+#  py pre_fields.py --check               exit 1 if the application is out of date; change nothing
+#  The hatch build runs the first form; see hatch_build.py.
 
 ## To Do
 # Uniform handling of reading values from file, including errors
@@ -113,8 +123,8 @@
 
 # The initial parsing of the source jsp file is a little delicate, since we encounter row and
 # field definitions before they are complete.  So some things we'd like to do immediately, like
-# replacing the parsed values, have to wait til later, often until the Python code is generated in
-# `make_Qt()`.  `Fixer` is a helper class that applies most of these tweaks.
+# replacing the parsed values, have to wait til later, often until the form table is generated in
+# `make_spec()`.  `Fixer` is a helper class that applies most of these tweaks.
 
 # Note also that looking up values in the database during pre-processing, or simply setting them
 # by fiat (or from the values in the jsp), is not the same as looking them up at run time in the
@@ -135,16 +145,29 @@
 # they just have the key information needed to generate the actual code.  And the mirroring classes
 # do not appear in the final application.  `pre_fields_preamble.py` has the run-time widget definitions.
 
+# The fields themselves are not generated as code, but as a table in `formtable.py`: one
+# `formspec.Section` per row of the form, listing its `formspec.Field`s.  `BreastForm._build_fields()`
+# creates the widgets from that at run time, each widget class through its `from_spec()`.  The table
+# does not need Qt, and so other tools can use it too.
+
 
+import argparse
 from collections import Counter
 from dataclasses import dataclass
+import hashlib
 from html.parser import HTMLParser
+import json
 from pathlib import Path
-import pyodbc
 import re
 import sys
 
 MYDIR = Path(__file__).parent
+TARGET = MYDIR.parent / "src" / "ispy2_mri" / "ispy2_gui.py"
+TABLE = TARGET.with_name("formtable.py")
+DSN = "breastdb-new"  # as db.DSN
+MANIFEST = MYDIR / "pre_fields_manifest.json"
+# the files that affect the output; the deviation reasons in the database do too
+INPUTS = ("ispy2.jsp", "pre_fields_preamble.py", "pre_fields_coda.py", "pre_fields.py")
 
 class Fixer:
     """Perform various special handling to modify default behavior.
@@ -153,15 +176,13 @@ class Fixer:
 
     Note that section is called from the parser before the section's 
     fields have been scanned, while the other methods are called
-    as the output program is produced, e.g., my make_Qt.
+    as the form table is produced, e.g., by make_spec.
     """
     skipDatesRE = re.compile(r"^(mri|(report_(received|returned)))_(month|day|year)$")
 
-    def __init__(self, DSN: str):
-        "set up database connection to named ODBC dataset"
-        self.DSN = DSN
-        self.conn = pyodbc.connect(f"DSN={self.DSN}")  #passwordless login
-        self.curs = self.conn.cursor()
+    def __init__(self, reasons):
+        "reasons are (id, deviation) for all deviation reasons, by position, as from fetch_reasons()"
+        self.reasons = reasons
 
     def section(self, section: "Section"):
         "modify a Section if appropriate"
@@ -183,8 +204,7 @@ class Fixer:
 
     def _section_deviation(self, section: "Section"):
         "handle deviation section"
-        for r in self.curs.execute('SELECT id, deviation FROM dbo.ispy2_deviation_reason\
-                   ORDER BY position ASC'):
+        for r in self.reasons:
             rid = int(r[0])
             if rid in (7, 8, 11, 12):
                 # skip
@@ -220,10 +240,10 @@ class Fixer:
                 return False
             case "FOV":
                 # removes fov1 and fov2 from top level
-                section.inputs = [CustomField("fov", "BFOV()")]
+                section.inputs = [CustomField("fov", "BFOV")]
                 return False
             case "Breast":
-                section.replaceInput(CustomField("breast", "BLRBox()"))
+                section.replaceInput(CustomField("breast", "BLRBox"))
                 return False
         return section.des2[0] in ("Special Handling necessary (header reading, other)",
                                    "Problems loading on AEGIS" )
@@ -255,13 +275,13 @@ class Fixer:
                         #"site",
                         #"pe_threshold",
                         "fov1", "fov2"):
-            fld.setConstruct("BIntEdit()")
+            fld.setConstruct("BIntEdit")
             return False
         if fld._name == "scan_duration":
-            fld.setConstruct("BNumEdit(p=5, s=2)")
+            fld.setConstruct("BNumEdit", p=5, s=2)
             return False
         if fld._name in ("pe_threshold", "bg_grey_threshold"):
-            fld.setConstruct("BPctEdit()")
+            fld.setConstruct("BPctEdit")
             return False
         if fld._name == "comments":
             # 4 rows in the jsp specification, but space is tight.
@@ -273,7 +293,16 @@ class Fixer:
             fld._name in ("deviation", "deviation_other_reason")
 
 
-Fix = Fixer('breastdb-new')  # global fixer
+Fix = None  # global Fixer, set by generate()
+
+def field_spec(name: str, widget: str, **kw) -> str:
+    """Source code for a formspec.Field.
+    kw are its other attributes; those that are None or empty are omitted.
+    """
+    args = [repr(name), repr(widget)]
+    args.extend(f"{k}={v!r}" for k, v in kw.items() if v is not None and v != {})
+    return f"Field({', '.join(args)})"
+
 
 class Section:
     """
@@ -314,29 +343,17 @@ class Section:
     def __str__(self):
         return " | ".join(self.des2) + ": " + ("; ".join(str(x) for x in self.inputs))
     
-    def make_Qt(self, ostr, leader = ""):
+    def make_spec(self, ostr, leader = ""):
+        "write the formspec.Section for this section to ostr"
         if Fix.section_drop(self):
             return
-        des = '\\n'.join(self.des2)  # literal \n
-        vnames = [f.make_Qt(ostr, leader) for f in self.inputs if not Fix.field_drop(f)]
-        if len(vnames) > 1:
-            ostr.write(f'{leader}group = QGroupBox()\n')
-            ostr.write(f'{leader}box = FlowLayout()\n')
-            iRow = 0
-            iCol = 0
-            for nm in vnames:
-                ostr.write(f'{leader}box.addWidget(self.{nm})\n')
-                if iCol >= 3:
-                    iCol = 0
-                    iRow += 1
-                else:
-                    iCol += 1
-            ostr.write(f'{leader}group.setLayout(box)\n')
-        else:
-            ostr.write(f'{leader}group = self.{vnames[0]}\n')
-        ostr.write(f'{leader}self.outer.addRow("{des}", group)\n')
-        if Fix.section_automatic(self):
-            ostr.write(f'{leader}self._mark_automatic(self.outer, group)\n')
+        specs = [f.spec() for f in self.inputs if not Fix.field_drop(f)]
+        label = "\n".join(self.des2)
+        ostr.write(f"{leader}Section({label!r}, (\n")
+        for spec in specs:
+            ostr.write(f"{leader}    {spec},\n")
+        automatic = ", automatic=True" if Fix.section_automatic(self) else ""
+        ostr.write(f"{leader}){automatic}),\n")
     
 class AbstractField:
     "some widget on the jsp web page representing a single variable"
@@ -390,25 +407,23 @@ class TextField(AbstractField):
                 self._size = int(v)
             else:
                 assert False
-        self._ctor = "BLineEdit()"
+        self._widget = "BLineEdit"
+        self._options = {}
 
-    def setConstruct(self, txt: str):
-        "change type of final widget.  Include () in string"
-        self._ctor = txt
+    def setConstruct(self, widget: str, **options):
+        "change type of final widget to the class named widget, constructed with keyword arguments options"
+        self._widget = widget
+        self._options = options
     
     def __str__(self):
         return f"Text({self._name})"
     
-    def make_Qt(self, ostr, leader):
+    def spec(self):
         """
-        Output Qt code for this input field to ostr with indicated leader.
-        Defines it as a variable and return value of that variable.
-        I.e., return self._name
+        Return the formspec.Field for this input field, as source code.
+        The form will have it as the attribute self._name.
         """
-        ostr.write(f"{leader}self.{self._name} = {self._ctor}\n")
-        #ostr.write(f"{leader}self.{self._name}.setPlaceholderText('{self._name}')\n")
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+        return field_spec(self._name, self._widget, options=self._options)
     
 class TextArea(AbstractField):
     "a box of text"
@@ -430,12 +445,8 @@ class TextArea(AbstractField):
     def __str__(self):
         return f"TextArea({self._name}, {self._rows}x{self._cols})"
     
-    def make_Qt(self, ostr, leader):
-        me = f"self.{self._name}"
-        ostr.write(f"{leader}{me} = BTextEdit(self, {self._rows}, {self._cols})\n")
-        #ostr.write(f"{leader}{me}.setPlaceholderText('{str(self)}')\n")
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BTextEdit", options={"rows": self._rows, "cols": self._cols})
     
 class CheckField(AbstractField):
     "checkbox"
@@ -457,13 +468,8 @@ class CheckField(AbstractField):
         "suppress printing of label for checkbox"
         self._showLabel = False
     
-    def make_Qt(self, ostr, leader):
-        if self._showLabel:
-            ostr.write(f'{leader}self.{self._name} = BCheckBox("{self._name}", self)\n')
-        else:
-            ostr.write(f'{leader}self.{self._name} = BCheckBox(self)\n')
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BCheckBox", text=self._name if self._showLabel else None)
     
 class CustomCheck(AbstractField):
     """Checkbox that is not defined by parsing JSP.
@@ -482,13 +488,8 @@ class CustomCheck(AbstractField):
         else:
             return f"CustCheck({self._name}, {self._des}, {self._val})"
     
-    def make_Qt(self, ostr, leader):
-        ostr.write(f'{leader}self.{self._name} = BCheckBox("{self._des}", self')
-        if self._val is not None:
-            ostr.write(f', {self._val}')
-        ostr.write(')\n')
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BCheckBox", text=self._des, reason=self._val)
 
 class SelectField(AbstractField):
     "drop-down selection box"
@@ -513,28 +514,17 @@ class SelectField(AbstractField):
     def __str__(self):
         return f"Select({self._name}: {', '.join(self._choices)})"
     
-    def optionString(self):
-        """
-        allowed options as string suitable for interpolation in python code.
-        E.g. if the choice are "a" or "b", return
-        '["a", "b"]`
-        """
-        # trying to do next 2 lines in a single line causes a hang
-        altstrings = [f'"{v}"' for v in self._choices]
-        altstrings = ", ".join(altstrings)
-        return "["+altstrings+"]"
+    def choices(self) -> tuple:
+        "allowed options"
+        return tuple(self._choices)
 
-    def make_Qt(self, ostr, leader):
-        ostr.write(f'{leader}self.{self._name} = BComboBox()\n')
-        ostr.write(f'{leader}self.{self._name}.addItems({self.optionString()})\n')
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BComboBox", choices=self.choices())
 
 ## Some Input Fields that are not derived from parsing the jsp file
 ## They are therefor not AbstractFields, but must behave enough like
 ## them to be usable.
-##  They must have a _name attribute and implement make_Qt(),
-## including returning name, and str()
+##  They must have a _name attribute and implement spec() and str()
 
 class DateField:
     """Simple one line set of dropdowns for date
@@ -548,11 +538,8 @@ class DateField:
     def __str__(self):
         return f"Date({self._name})"
     
-    def make_Qt(self, ostr, leader):
-        fname = self._name
-        ostr.write(f'{leader}self.{fname} = BSmallDateWidget()\n')
-        ostr.write(f"{leader}self._fields['{fname}'] = self.{fname}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BSmallDateWidget")
     
 class DynamicComboField:
     """
@@ -571,11 +558,8 @@ class DynamicComboField:
     def __str__(self):
         return f"DynCombo({self._name}, {self._dynamic})"
     
-    def make_Qt(self, ostr, leader):
-        ostr.write(f'{leader}self.{self._name} = BSiteComboBox(data=self.{self._dynamic})\n')
-        #ostr.write(f'{leader}self.{self._name}.addItems(self.{self._dynamic})\n')
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BSiteComboBox", data=self._dynamic)
     
 class AutoTimingField:
     """
@@ -612,25 +596,22 @@ class AutoTimingField:
     def __str__(self):
         return f"AutoTiming({self._seq})"
 
-    def make_Qt(self, ostr, leader):
-        ostr.write(f'{leader}self.{self._name} = BAutoTimingWidget({self.seq}, {self._specs[-1].optionString()})\n')
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, "BAutoTimingWidget", choices=self._specs[-1].choices(),
+                          options={"i": self.seq})
     
 class CustomField:
     "Allows arbtrary run-time widgets to be selected"
-    def __init__(self, name:str, ctor:str):
-        "a field named name will be constructed by calling ctor"
+    def __init__(self, name:str, widget:str):
+        "a field named name will be constructed by calling the class named widget with no arguments"
         self._name = name
-        self._ctor = ctor
+        self._widget = widget
 
     def __str__(self):
-        return self._ctor
+        return f"{self._widget}()"
     
-    def make_Qt(self, ostr, leader):
-        ostr.write(f'{leader}self.{self._name} = {self._ctor}\n')
-        ostr.write(f"{leader}self._fields['{self._name}'] = self.{self._name}\n")
-        return self._name
+    def spec(self):
+        return field_spec(self._name, self._widget)
     
 class JSPParser(HTMLParser):
     """
@@ -695,10 +676,18 @@ class JSPParser(HTMLParser):
         "Convert self into Qt code and output to ostr, a stream like object"
         leader = self._qpreamble(ostr)
         #self._qsamples(ostr, leader)  # for development
-        for s in self.sections:
-            s.make_Qt(ostr, leader)
+        # the fields are in the table make_spec() writes
+        self._qline(ostr, leader, "self._build_fields(formspec.sections())")
         self._qcoda(ostr)
 
+    def make_spec(self, ostr):
+        "Write the formtable module, the fields of the form as formspec.Sections, to ostr"
+        ostr.write(TABLE_HEADER)
+        ostr.write("SECTIONS = (\n")
+        for s in self.sections:
+            s.make_spec(ostr, "    ")
+        ostr.write(")\n")
+
     def _qline(self, ostr, leader:str, line:str):
         "write line to ostr, adding leader at start and \n at end"
         ostr.write(f"{leader}{line}\n")
@@ -726,6 +715,18 @@ class JSPParser(HTMLParser):
         return self._include(ostr, leader, MYDIR / "pre_fields_coda.py")
 
 
+TABLE_HEADER = '''# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""The fields of the form, by row.  Generated by build/pre_fields.py from ispy2.jsp; do not edit.
+See formspec.py.
+"""
+from ispy2_mri.formspec import Field, Section
+
+'''
+
+
 def parse_jsp(sourceFile):
     """
     Parse the jsp page on which the current web input form is defined
@@ -744,8 +745,90 @@ def parse_jsp(sourceFile):
             print(f"{i}: {des}")
     return parser
 
-parser = parse_jsp(MYDIR / "ispy2.jsp")
-target = Path(__file__).parents[1] / "src" / "ispy2_mri" / "ispy2_gui.py"
-with target.open("wt") as fout:
-    parser.make_Qt(fout)
+def content_hash(path) -> str:
+    "sha256 of the file, ignoring the difference between CRLF and LF line ends"
+    return hashlib.sha256(Path(path).read_bytes().replace(b"\r\n", b"\n")).hexdigest()
+
+
+def input_hashes() -> dict:
+    return {name: content_hash(MYDIR / name) for name in INPUTS}
+
+
+def fetch_reasons(dsn: str) -> list:
+    "(id, deviation) for all deviation reasons, by position, from the database"
+    # the package's database code; it does not need the generated file
+    sys.path.insert(0, str(MYDIR.parent / "src"))
+    from ispy2_mri import db
+    backend = db.open_backend(dsn)
+    try:
+        return [(int(r[0]), r[1]) for r in backend.select_deviation()]
+    finally:
+        backend.close()
+
+
+def output_hashes() -> dict:
+    return {path.name: content_hash(path) for path in (TARGET, TABLE)}
+
+
+def up_to_date() -> bool:
+    "True if the outputs were generated from the current inputs, and not changed since"
+    try:
+        with MANIFEST.open("rt", encoding="utf-8") as fin:
+            m = json.load(fin)
+        return m["inputs"] == input_hashes() and m["outputs"] == output_hashes()
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _write(path: Path, make):
+    "write path with make(stream), replacing it only once complete"
+    tmp = path.with_suffix(".tmp")
+    # the application has always been generated on MS-Windows; keep its line ends everywhere
+    with tmp.open("wt", newline="\r\n") as fout:
+        make(fout)
+    tmp.replace(path)
+
+
+def generate(outdir=None, force=False, dsn: str = DSN) -> bool:
+    """Write ispy2_gui.py and formtable.py to outdir, unless they are up to date.
+    Return True if they were written.  Only then is the database, dsn, needed.
+    The manifest is only consulted, and updated, for the default outdir, that of TARGET.
+    """
+    global Fix
+    record = outdir is None or Path(outdir) == TARGET.parent
+    if record and not force and up_to_date():
+        return False
+    outdir = TARGET.parent if outdir is None else Path(outdir)
+    Fix = Fixer(fetch_reasons(dsn))
+    parser = parse_jsp(MYDIR / "ispy2.jsp")
+    _write(outdir / TARGET.name, parser.make_Qt)
+    # make_Qt() does not consult Fix, which is not idempotent, and so the sections are still as parsed
+    _write(outdir / TABLE.name, parser.make_spec)
+    if record:
+        with MANIFEST.open("wt", encoding="utf-8", newline="\r\n") as fout:
+            json.dump({"inputs": input_hashes(), "outputs": output_hashes()}, fout, indent=1)
+            fout.write("\n")
+    return True
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate src/ispy2_mri/ispy2_gui.py from ispy2.jsp")
+    ap.add_argument("--dsn", default=DSN,
+                    help="database to read the deviation reasons from (default %(default)s; sqlite:PATH works too)")
+    ap.add_argument("--force", action="store_true", help="regenerate even if nothing changed")
+    ap.add_argument("--check", action="store_true", help="only report whether the output is up to date")
+    args = ap.parse_args(argv)
+    if args.check:
+        ok = up_to_date()
+        print(f"{TARGET.name} is {'up to date' if ok else 'out of date'}")
+        return 0 if ok else 1
+    if generate(force=args.force, dsn=args.dsn):
+        print(f"Generated {TARGET} and {TABLE.name}")
+    else:
+        print(f"{TARGET.name} is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
  
\ No newline at end of file
@@ -1,24 +1,66 @@
 		self.visit_number.setEditable(True)
 		self.submit = QPushButton('Save')
-		self.getFile()  # must be after all input widgets created
 		self.submit.clicked.connect(self.save)
-
-		self.outer.addRow('', self.submit)
+		self.busy = QProgressBar()
+		self.busy.setRange(0, 0)  # no steps, just shows saved exams are being sent
+		self.busy.setVisible(False)
+		box = QHBoxLayout()
+		box.addWidget(self.submit)
+		box.addWidget(self.busy)
+		self.outer.addRow('', box)
 
 
 def launch():
 	app = QApplication(sys.argv)
-	form = BreastForm()
+	ap = argparse.ArgumentParser(prog="ispy2-mri", description="Log receipt of MRI exams into the database")
+	ap.add_argument("--inbox", help="folder to watch for new parameter files (default: the last one chosen)")
+	ap.add_argument("--dsn", default=db.DSN,
+		help="ODBC data source, or sqlite:PATH for a local stand-in (default %(default)s)")
+	ap.add_argument("--timing", nargs="?", const=timing.default_path(), metavar="PATH",
+		help=f"append timings of database calls and file reads to PATH as JSONL (default {timing.default_path()})")
+	ap.add_argument("--profile", metavar="PATH",
+		help="profile the session, in the GUI thread, and write pstats to PATH on exit")
+	args = ap.parse_args(app.arguments()[1:])
+	if args.timing:
+		timing.enable(args.timing)
+	profiler = None
+	if args.profile:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+	with timing.span("BreastForm()"):
+		form = BreastForm(dsn=args.dsn)
+	form.setInbox(Path(args.inbox) if args.inbox else inbox_setting())
+	worklist = Worklist(form.inbox, lambda: form.site.matcher)
+	form.sitesChanged.connect(worklist.rematch)
+	worklist.fileChosen.connect(form.loadFile)
+	worklist.inboxChanged.connect(form.setInbox)
+	form.saved.connect(worklist.markDone)
 	sa = QScrollArea()
 	sa.setWidgetResizable(True)
 	sa.setWidget(form)
+	window = QSplitter()
+	window.addWidget(worklist)
+	window.addWidget(sa)
+	window.setStretchFactor(1, 1)
 	# fSize captured immediately after form creation is not full size
-	fSize = form.size()+QSize(0, 3)  # extra vertical to avoid scrollbars
+	fSize = form.size()+QSize(worklist.sizeHint().width(), 3)  # extra vertical to avoid scrollbars
 	saSize = fSize.boundedTo(form.screen().availableSize())
-	sa.resize(saSize)
-	sa.show()
+	window.resize(saSize)
+	window.show()
+	if form.inbox is None:
+		# once the form is on screen; the connection continues meanwhile
+		QTimer.singleShot(0, form.getFile)
 
-	sys.exit(app.exec())
+	rc = app.exec()
+	# let any replay of the journal in progress finish
+	QThreadPool.globalInstance().waitForDone()
+	if profiler is not None:
+		profiler.disable()
+		profiler.dump_stats(args.profile)
+		log.warning(f"Profile written to {args.profile}; see python -m pstats")
+	timing.disable()
+	sys.exit(rc)
 
 if __name__ == '__main__':
 	launch()
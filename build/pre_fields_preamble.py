@@ -2,14 +2,20 @@
 # based on https://doc.qt.io/qtforpython-6/tutorials/basictutorial/dialog.html
 # error handling based on https://timlehr.com/2018/01/python-exception-hooks-with-qt-message-box/
 from PySide6.QtWidgets import *
-from PySide6.QtCore import Slot, QSize
-from datetime import date, datetime
+from PySide6.QtCore import Signal, Slot, QSize, Qt, QThreadPool, QTimer
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import argparse
 import logging
+import os
 import sys
 import traceback
-import pyodbc
 from pathlib import Path
+from ispy2_mri import (connection, db, examindex, fileindex, formspec, journal, records, scanparams, sitecache,
+	sitematch, timing, validation, workers)
+from ispy2_mri.scanparams import UnexpectedInputError
 from ispy2_mri.flowlayout import FlowLayout
+from ispy2_mri.worklist import Worklist, inbox_setting
 import re
 
 # set up logging to the terminal
@@ -28,10 +34,6 @@ def show_exception_box(log_msg):
 	else:
 		log.critical(log_msg)
 
-class UnexpectedInputError(Exception):
-	def __init__(self, obj=None):
-		super().__init__(obj)
-
 class BreastWidget:
 	"""
 	Abstract class for Mixins with QWidgets of various kinds
@@ -52,6 +54,13 @@ class BreastWidget:
 		"""
 		super().__init__()
 
+	@classmethod
+	def from_spec(cls, field, form):
+		"""Return a new widget for field, a formspec.Field, on BreastForm form.
+		Override if the constructor needs more than field.options.
+		"""
+		return cls(**field.options)
+
 	def todb(self):
 		"return value appropriate for insertion into database"
 		pass
@@ -88,7 +97,9 @@ class BreastWidget:
 		"""
 		Remove any error conditions from this widget.
 		"""
-		self.setStyleSheet("")
+		# setting a style sheet, even to the one it has, restyles the widget; clear() calls this a lot
+		if self.styleSheet():
+			self.setStyleSheet("")
 
 	
 class BSmallDateWidget(QWidget, BreastWidget):
@@ -136,6 +147,11 @@ class BSmallDateWidget(QWidget, BreastWidget):
 		"set self from a Date or DateTime"
 		if date is None:
 			return self.setNoDate()
+		if self._yrwidg.findText(str(date.year)) < 0:
+			# e.g., a record from the database older than the list
+			i = next((k for k in range(1, self._yrwidg.count()) if self._yrwidg.itemData(k) > date.year),
+				self._yrwidg.count())
+			self._yrwidg.insertItem(i, str(date.year), date.year)
 		self._mowidg.setCurrentText(str(date.month))
 		self._dawidg.setCurrentText(str(date.day))
 		self._yrwidg.setCurrentText(str(date.year))
@@ -176,10 +192,8 @@ class BSmallDateWidget(QWidget, BreastWidget):
 		if len(txt.strip()) == 0:
 			self.setNoDate()
 		else:
-			# this is what I was using for text files.  It makes a lot of assumptions.
-			# It also loses the time info, which of course can't be displayed in the 
-			# widget anyway.
-			self.setDate(datetime.strptime(txt.split(sep=" ", maxsplit=1)[0], '%m/%d/%Y'))
+			# the time info is lost, but of course can't be displayed in the widget anyway.
+			self.setDate(scanparams.parse_date(txt))
 
 
 	
@@ -201,6 +215,10 @@ class BTextEdit(QTextEdit, BreastWidget):
 		self.myrows = rows
 		self.mycols = cols
 
+	@classmethod
+	def from_spec(cls, field, form):
+		return cls(form, **field.options)
+
 	def sizeHint(self):
 		return self.myPreferredSize
 	
@@ -208,7 +226,7 @@ class BTextEdit(QTextEdit, BreastWidget):
 		return self.toPlainText()
 	
 	def fromdb(self, v):
-		self.setPlainText(v)
+		self.setPlainText(v or "")
 
 class BLineEdit(QLineEdit, BreastWidget):
 	def __init__(self, parent=None):
@@ -219,7 +237,8 @@ class BLineEdit(QLineEdit, BreastWidget):
 		return self.displayText()
 
 	def fromdb(self, v):
-		self.setText(v)
+		"v may be a number, or None for blank"
+		self.setText("" if v is None else str(v))
 
 	def setMaxLength(self, n: int, char="m") -> None:
 		"""
@@ -256,18 +275,11 @@ class BPctEdit(BLineEdit):
 	def fromtext(self, v: str):
 		"""set a percent value into widget, removing %
 		"""
-		v = v.strip()
-		if v[-1] == "%":
-			v = v[:-1]
-		super().fromtext(v)
+		super().fromtext(scanparams.strip_pct(v))
 
 class BIntEdit(BLineEdit):
 	def todb(self):
-		txt = super().todb().strip()
-		if txt is None or len(txt)==0:
-			return None
-		# weirdly, some of these have fractions
-		return round(float(txt))
+		return scanparams.to_int(super().todb())
 	
 class BNumEdit(BLineEdit):
 	"for values that are numeric(p, s)"
@@ -278,16 +290,20 @@ class BNumEdit(BLineEdit):
 		self._scale = s
 
 	def todb(self):
-		txt = super().todb().strip()
-		if txt is None or len(txt)==0:
-			return None
-		return float(txt)
+		return scanparams.to_num(super().todb())
 
 class BComboBox(QComboBox, BreastWidget):
 	def __init__(self, parent=None):
 		QComboBox.__init__(self, parent)
 		self.currentIndexChanged.connect(self.noteIndexChanged)
 
+	@classmethod
+	def from_spec(cls, field, form):
+		w = cls(**field.options)
+		if field.choices:
+			w.addItems(list(field.choices))
+		return w
+
 	def todb(self):
 		return self.currentText()
 	
@@ -310,7 +326,8 @@ class BComboBox(QComboBox, BreastWidget):
 		return i
 	
 	def fromdb(self, v):
-		self.setVal(v)
+		"a value not on the list is shown as an error, as for fromtext()"
+		self.fromtext("" if v is None else str(v))
 
 	def fromtext(self, v: str):
 		if v:
@@ -333,7 +350,8 @@ class BComboBox(QComboBox, BreastWidget):
 		raise UnexpectedInputError(v)
 	
 	def setOK(self):
-		self.setToolTip("")
+		if self.toolTip():
+			self.setToolTip("")
 		super().setOK()
 		# leave placeholder text, which should be invisible	
 
@@ -350,9 +368,11 @@ class BComboBox(QComboBox, BreastWidget):
 
 	def clear(self):
 		self.setEditText("")
-		self.setCurrentIndex(-1)
 		self.setOK()
+		# With no selection, an empty placeholder makes Qt select the first item.
+		# So clear the placeholder before the selection.
 		self.setPlaceholderText("")
+		self.setCurrentIndex(-1)
 
 class BLRBox(BComboBox):
 	"""
@@ -365,12 +385,9 @@ class BLRBox(BComboBox):
 		self.addItems(["", "L", "R"])
 
 	def setVal(self, v:str):
-		x = v.strip().lower()
-		match x:
-			case 'l' | 'left':
-				return super().setVal("L")
-			case 'r' | 'right':
-				return super().setVal('R')
+		lr = scanparams.parse_lr(v)
+		if lr:
+			return super().setVal(lr)
 		self.setCurrentIndex(-1)
 		return -1
 
@@ -387,20 +404,60 @@ class BSiteComboBox(BComboBox):
 	Because of all this, new sites, and free-form site names, are a problem.
 	The free-form names often don't match the ones we have, and new sites
 	require a name and a number.  For now we leave adding sites alone.
+	Names from files are matched approximately, through self.matcher; see sitematch.py.
+	When the user picks a site for a name from a file, the name becomes an alias for it.
 	"""
-	def __init__(self, parent=None, data=None):
+	def __init__(self, parent=None, data=None, aliases=None):
 		"""
 		Data should be an iterable, indexable collection of data records.
 		Each has (internl_id, site_id, site_name).
 		This collection should be persistent for the life of the interface, i.e., don't
 		use the database cursor directly.
+		aliases, if given, is the sitematch.AliasTable to consult and to teach.
 		"""
 		super().__init__(parent)
-		for rec in data:
+		self._unmatched = None  # site name from file that matched nothing
+		self._fromFile = None  # site name from file, matched or not
+		self._aliases = aliases
+		self._addSites(data)
+		self.setCurrentIndex(-1)
+		self.activated.connect(self._picked)
+
+	@classmethod
+	def from_spec(cls, field, form):
+		return cls(data=getattr(form, field.data), aliases=form.siteAliases, **field.options)
+
+	def _addSites(self, data):
+		self._siteRecs = list(data)
+		self.matcher = sitematch.SiteMatcher(self._siteRecs, self._aliases)
+		for rec in self._siteRecs:
 			label = f"{rec[1]:6d} | {rec[2]}"
 			self.addItem(label, rec)
 		self.addItem("Other (put site info in comment)", None)
-		self.setCurrentIndex(-1)
+
+	def setSites(self, data):
+		"""Replace the list of sites with data, in place.
+		Keeps the current selection if that site is still on the list.
+		If there is no selection, but the last site name from a file didn't match,
+		try it against the new list.
+		"""
+		iOther = len(self._siteRecs)
+		wasOther = self.currentIndex() == iOther
+		site = self.todb()
+		# QComboBox.clear() only removes the items; ours clears the selection
+		QComboBox.clear(self)
+		self._addSites(data)
+		i = -1
+		if wasOther:
+			i = len(self._siteRecs)
+		elif site is not None:
+			i = next((j for j, r in enumerate(self._siteRecs) if r[1] == site), -1)
+		self.setCurrentIndex(i)
+		if i < 0 and self._unmatched:
+			try:
+				self.fromtext(self._unmatched)
+			except UnexpectedInputError:
+				pass
 
 	def todb(self):
 		"must be something that was on the list"
@@ -413,9 +470,13 @@ class BSiteComboBox(BComboBox):
 
 	def fromdb(self, v):
 		"v will be the site id"
+		if v is None:
+			self.clear()
+			return
 		for i in range(self.count()):
 			r = self.itemData(i)
-			if r[1] == v:
+			# None for Other
+			if r is not None and r[1] == v:
 				self.setCurrentIndex(i)
 				return
 		self.setError(v)
@@ -423,15 +484,37 @@ class BSiteComboBox(BComboBox):
 	
 	def fromtext(self, v: str):
 		"v is a site name.  It probably won't be an exact match"
-		for i in range(self.count()):
-			r = self.itemData(i)
-			if r and r[2] == v:
-				self.setCurrentIndex(i)
-				return
+		self._fromFile = v
+		m = self.matcher.best(v)
+		if m is not None:
+			# items are in the same order as the site records
+			self._unmatched = None
+			self.setCurrentIndex(self._siteRecs.index(m.rec))
+			if m.how != "exact":
+				self.setToolTip(f"{v} in the file; matched by {m.how} ({m.score:.0%})")
+			return
+		self._unmatched = v
 		self.setCurrentIndex(-1)
-		self.setError(v)
-		self.setToolTip(f"Unrecognized site. Please select from drop-down.")
-		raise UnexpectedInputError(v)
+		closest = self.matcher.candidates(v, 1)
+		hint = f" Closest is {closest[0].rec[2]} ({closest[0].score:.0%})." if closest else ""
+		try:
+			self.setError(v)
+		finally:
+			# setError() raises, after setting a tooltip of its own
+			self.setToolTip(f"Unrecognized site {v}.{hint} Please select from drop-down.")
+
+	@Slot(int)
+	def _picked(self, i: int):
+		"the user chose item i; remember it for the name from the file"
+		self.setOK()
+		if self._fromFile and self._aliases is not None and 0 <= i < len(self._siteRecs):
+			self._aliases.learn(self._fromFile, self._siteRecs[i][1])
+		self._unmatched = None
+
+	def clear(self):
+		self._unmatched = None
+		self._fromFile = None
+		super().clear()
 
 class BCheckBox(QCheckBox, BreastWidget):
 	def __init__(self, parent=None, asText=True, val=None):
@@ -441,6 +524,14 @@ class BCheckBox(QCheckBox, BreastWidget):
 		# next connection clears errors on user selection
 		self.clicked.connect(self.setOK)
 
+	@classmethod
+	def from_spec(cls, field, form):
+		if field.text is None:
+			return cls(form)
+		# As the form has always done it: the text goes to QCheckBox as its label,
+		# and so the form lands in asText, which only needs to be true.
+		return cls(field.text, form, field.reason)
+
 	def val(self):
 		return self._val
 
@@ -458,7 +549,9 @@ class BCheckBox(QCheckBox, BreastWidget):
 				return False
 			
 	def fromdb(self, v):
-		if isinstance(v, bool):
+		if v is None:
+			self.setChecked(False)
+		elif isinstance(v, bool):
 			self.setChecked(v)
 		elif isinstance(v, str) and len(v)>0:
 			if v[0].upper() == 'Y':
@@ -468,17 +561,13 @@ class BCheckBox(QCheckBox, BreastWidget):
 		# otherwise do nothing. maybe throw error
 
 	def fromtext(self, v:str):
-		v = v.lower()
-		match v:
-			case 'n' | 'no'| 'none':
-				self.setChecked(False) # probably the default
-				self.setOK()
-			case 'y' | 'yes':
-				self.setChecked(True)
-				self.setOK()
-			case _:
-				self.setChecked(False)
-				raise UnexpectedInputError(f"Unrecognized value {v} for checkbox")
+		try:
+			checked = scanparams.parse_yn(v)
+		except UnexpectedInputError:
+			self.setChecked(False)
+			raise
+		self.setChecked(checked)
+		self.setOK()
 
 	def clear(self):
 		self.setChecked(False)
@@ -489,7 +578,8 @@ class BCheckBox(QCheckBox, BreastWidget):
 
 	@Slot()
 	def setOK(self):
-		self.setToolTip("")
+		if self.toolTip():
+			self.setToolTip("")
 		super().setOK()
 
 class BAutoTimingWidget(QWidget, BreastWidget):
@@ -521,6 +611,10 @@ class BAutoTimingWidget(QWidget, BreastWidget):
 		QWidget.setTabOrder(self._minwidg, self._secwidg)
 		QWidget.setTabOrder(self._secwidg, self._optionwidg)
 
+	@classmethod
+	def from_spec(cls, field, form):
+		return cls(options=list(field.choices), **field.options)
+
 	def _makemin(self):
 		w = BLineEdit(self)
 		w.setPlaceholderText("Minutes")
@@ -565,18 +659,15 @@ class BAutoTimingWidget(QWidget, BreastWidget):
 		return [w.todb() for w in self._mydata()]
 	
 	def fromdb(self, v):
-		raise NotImplementedError("No single database entry corresponds to auto_timing")
+		"v is the 3 database values, as from todb()"
+		for x, w in zip(v, self._mydata()):
+			w.fromdb(x)
 
-	timingRE = re.compile(r"(\d*):(\d+)\s+\((\d)\)")
 	def fromtext(self, v: str):
-		m = self.timingRE.match(v)
-		if m:
-			for x, w in zip(m.groups(), self._mydata()):
-				w.fromtext(x)
-		else:
-			# really should do more
-			# eg set placeholder in first field, change colors....
-			raise UnexpectedInputError(v)
+		# on failure really should do more
+		# eg set placeholder in first field, change colors....
+		for x, w in zip(scanparams.parse_timing(v), self._mydata()):
+			w.fromtext(x)
 		
 class BFOV(QWidget, BreastWidget):
 	"""
@@ -605,71 +696,165 @@ class BFOV(QWidget, BreastWidget):
 		return [self.fov1.todb(), self.fov2.todb()]
 	
 	def fromdb(self, v):
-		raise NotImplementedError("No single database entry corresponds to fov")
+		"v is the 2 database values, as from todb()"
+		self.fov1.fromdb(v[0])
+		self.fov2.fromdb(v[1])
 	
-	FOVRE = re.compile(r"([0-9.]+)\s+x\s+([0-9.]+)")
 	def fromtext(self, v: str):
 		"set value like '32.0 x 32.0' into fov fields"
-		m = self.FOVRE.match(v)
-		if m:
-			self.fov1.fromtext(m.group(1))
-			self.fov2.fromtext(m.group(2))
-		else:
-			raise UnexpectedInputError(f"{v} value unparseable for FOV")
+		fov1, fov2 = scanparams.parse_fov(v)
+		self.fov1.fromtext(fov1)
+		self.fov2.fromtext(fov2)
+
+# widget classes by name, as in formspec.Field.widget
+WIDGETS = {c.__name__: c for c in (BSmallDateWidget, BTextEdit, BLineEdit, BPctEdit, BIntEdit, BNumEdit,
+	BComboBox, BLRBox, BSiteComboBox, BCheckBox, BAutoTimingWidget, BFOV)}
 
 class BreastForm(QDialog):
+	# parameter file, or None, whose values were just written to the database
+	saved = Signal(object)
+	# the site list changed; see site.matcher
+	sitesChanged = Signal()
+	# fields on which the files for an exam disagree
+	CONFLICT_STYLE = "* {background-color: orange}"
 
 	def getFile(self) -> str :
 		"prompt user for file with scan parameters. Return path and set parameterFile, or return None"
-		(fname, filter) = QFileDialog.getOpenFileName(self, "Scan Parameters File", ".", "Scan Files (*.txt)")
+		(fname, filter) = QFileDialog.getOpenFileName(self, "Scan Parameters File", str(self.inbox or "."),
+												"Scan Files (*.txt)")
 		if fname:
-			self.clear()
-			self.parameterFile = Path(fname)
-			self.fileButton.setText(self.parameterFile.name)
-			self.readFile(self.parameterFile)
+			self.loadFile(fname)
 			return fname
 		return None
 
-	paramRE = re.compile(r'^\s*(?P<var>[^:]+)\s*:\s*(?P<val>.*\S)\s*$')
+	@Slot(object, object)
+	def loadFile(self, path, params=None):
+		"""Clear the form and fill it from the parameter file at path.
+		params, if given, is the already parsed {header: value} from the file.
+		"""
+		# a file is a new exam
+		self._setRecord(None)
+		self._allowSave(True)
+		self.parameterFile = Path(path)
+		self.fileButton.setText(self.parameterFile.name)
+		with self._bulk():
+			self.clear()
+			if params is None:
+				params = self.readFile(self.parameterFile)
+			else:
+				self.setParameters(params)
+		self._params = params
+		self._partners = []
+		self.pairFile()
+		# so a file for the exam that arrived since is found too
+		self.indexFiles([self.parameterFile.parent])
+
+	def pairFile(self):
+		"read the other files for the exam in parameterFile, as fileIndex has them, in the background; see filesPaired()"
+		self._pairings += 1
+		self._pairer = workers.start(self._readPartners, self._pairings, self.parameterFile, self._params,
+			result=self.filesPaired)
+
+	def _readPartners(self, n, path, params):
+		"Runs on a worker thread.  Return (n, path, [(other path, {header: value})])"
+		return n, path, fileindex.read_partners(self.fileIndex, path, params)
+
+	@Slot(object)
+	def filesPaired(self, result):
+		"""Merge in the other files for the exam, as _readPartners() parsed them,
+		filling in fields parameterFile lacks, and highlight the fields on which they disagree.
+		"""
+		n, path, others = result
+		if n != self._pairings or path != self.parameterFile:
+			# superseded, or another file or record was loaded meanwhile
+			return
+		if [p for p, _ in others] == self._partners:
+			return
+		self._partners = [p for p, _ in others]
+		files = [(Path(os.path.abspath(path)), self._params), *others]
+		merged, conflicts = fileindex.merge(files, self.site.matcher)
+		self._clearConflicts()
+		self.setParameters({header: v for header, v in merged.items() if header not in self._params})
+		for header, values in conflicts.items():
+			self._markConflict(getattr(self, scanparams.GUIDE[header]),
+				"\n".join(f"{p.name}: {v}" for p, v in values))
+		self.fileButton.setText(" + ".join(p.name for p, _ in files))
+		if conflicts:
+			self.fileButton.setToolTip(f"The files disagree on {', '.join(conflicts)}")
+
+	def _markConflict(self, w, text: str):
+		if w not in self._conflicts:
+			self._conflicts[w] = w.toolTip()
+		w.setStyleSheet(self.CONFLICT_STYLE)
+		w.setToolTip(f"The files disagree:\n{text}")
+
+	def _clearConflicts(self):
+		for w, tip in self._conflicts.items():
+			w.setStyleSheet("")
+			w.setToolTip(tip)
+		self._conflicts.clear()
+		self.fileButton.setToolTip("")
+
+	def indexFiles(self, folders):
+		"update fileIndex for folders in the background, then look again for files to pair with parameterFile"
+		if self._indexer is not None and not self._indexer.done:
+			return
+		self._indexer = workers.start(self.fileIndex.update, folders, result=self.filesIndexed)
+
+	@Slot(object)
+	def filesIndexed(self, n):
+		if self.parameterFile is not None:
+			self.pairFile()
+
+	@Slot(object)
+	def setInbox(self, folder):
+		"new parameter files arrive in folder"
+		self.inbox = Path(folder) if folder else None
+		if self.inbox is not None:
+			self.indexFiles([self.inbox])
+
 	def readFile(self, path):
 		"""
 		parse the file in path and populate the appropriate fields
+		Returns {header: value} from the file.
 		"""
-		r = {}
-		# guide keys are line headers in text file
-		# values are names of fields as strings
-		guide = {
-			'I-SPY ID': "ispy2_id",
-		   	'Date': "mri_date",
-			'Visit ID': "visit_number",
-			'Institution': "site",
-			'Breast': "breast", # currently needs to be v.lower()
-			'Tumor Volume': "tumor_volume_submitted",
-			'Early Post Timing': "auto_timing1",
-			'Late Post Timing': "auto_timing2",
-			'PE Threshold': "pe_threshold",
-			'Scan Duration': "scan_duration",
-			'Gray Threshold': "bg_grey_threshold",
-			'MOCO': "moco",
-			'FOV': "fov"
-			}
-		with path.open("rt") as fin:
-			for line in fin:
-				m = self.paramRE.match(line)
-				if m:
-					v = m.group('val')
-					header = m.group('var')
-					r[header] = v
-					varname = guide[header]
-					try:
-						getattr(self, varname).fromtext(v)
-					except UnexpectedInputError as e:
-						pass
-				elif line.strip():
-					raise UnexpectedInputError(f"Can't handle mystery line: {line}")
-		#print(r)
+		with timing.span("readFile", path=str(path)):
+			with path.open("rt") as fin:
+				r = scanparams.read_parameters(fin)
+			self.setParameters(r)
 		return r
+
+	def setParameters(self, params: dict):
+		"populate the fields from {header: value}, as read from a parameter file"
+		for header, v in params.items():
+			try:
+				getattr(self, scanparams.GUIDE[header]).fromtext(v)
+			except UnexpectedInputError as e:
+				pass
 	
+	def _build_fields(self, sections):
+		"""Add a row to the form for each formspec.Section in sections.
+		Each field's widget becomes an attribute of self named for the field.
+		"""
+		for section in sections:
+			widgets = []
+			for f in section.fields:
+				w = WIDGETS[f.widget].from_spec(f, self)
+				setattr(self, f.name, w)
+				self._fields[f.name] = w
+				widgets.append(w)
+			if len(widgets) > 1:
+				group = QGroupBox()
+				box = FlowLayout()
+				for w in widgets:
+					box.addWidget(w)
+				group.setLayout(box)
+			else:
+				group = widgets[0]
+			self.outer.addRow(section.label, group)
+			if section.automatic:
+				self._mark_automatic(self.outer, group)
+
 	def _mark_automatic(self, form, widget):
 		"""
 		Mark row in layout as being something that can be filled in from file.
@@ -681,12 +866,24 @@ class BreastForm(QDialog):
 		# show everything
 		#form.setRowVisible(i, False)
 
+	# database columns whose values come from a field of another name
+	_COLUMN_FIELDS = {
+		"mri_code": "mri_date",
+		"report_returned_date": "report_returned", "report_returned_code": "report_returned",
+		"report_received_date": "report_received", "report_received_code": "report_received",
+		"fov1": "fov", "fov2": "fov",
+		**{f"auto_timing{seq}_{part}": f"auto_timing{seq}" for seq in (1, 2) for part in ("min", "sec", "option")},
+	}
+
 	def is_sane(self):
 		"""Check that the values appear complete and correct, ready for insertion in db.
 		Return True if they are, else False.
 		May pop up dialogs to describe problems, or even to correct them.
 		"""
 		bad = [k for (k, v) in self._fields.items() if not v.isValid()]
+		# what the database columns will take; see validation.py
+		values = dict(zip(scanparams.DB_COLUMNS, self.db_values()))
+		bad.extend(f"{self._COLUMN_FIELDS.get(p.column, p.column)} ({p})" for p in validation.check(values))
 		if bad:
 			QMessageBox.warning(self, "You must fix fields before saving", 
 			   "Errors in "+", ".join(bad))
@@ -710,6 +907,48 @@ class BreastForm(QDialog):
 	def all_values(self):
 		"return a dictionary of {field name, value}"
 		return {fld: widg.todb() for fld, widg in self._fields.items()}
+
+	def snapshot(self) -> dict:
+		"""{field name: value} of every field, as todb() gives it; apply_record() puts it back.
+		Reading changes nothing, so there is nothing to suppress.
+		"""
+		return self.all_values()
+
+	def apply_record(self, record: dict) -> list:
+		"""Set every field from record, {field name: value} as fromdb() takes it, e.g., from snapshot(),
+		in one pass; fields record lacks are cleared.  See _bulk().
+		Return the names of the fields that did not accept their values; they are shown as errors.
+		"""
+		rejected = []
+		with self._bulk():
+			self._clearConflicts()
+			for name, w in self._fields.items():
+				w.clear()
+				if name not in record:
+					continue
+				try:
+					w.fromdb(record[name])
+				except UnexpectedInputError:
+					rejected.append(name)
+		return rejected
+
+	@contextmanager
+	def _bulk(self):
+		"""While setting many fields, block the combo boxes' signals; nothing else is suppressed.
+		Otherwise each change of selection restyles its box through noteIndexChanged(), and each
+		restyle re-polishes the widget.  At the end, boxes left with a selection lose any
+		error styling, once, as noteIndexChanged() would have done.
+		"""
+		if self._combos is None:
+			self._combos = self.findChildren(BComboBox)
+		blocked = [w.blockSignals(True) for w in self._combos]
+		try:
+			yield
+		finally:
+			for w, was in zip(self._combos, blocked):
+				w.blockSignals(was)
+				if w.currentIndex() >= 0 and w.styleSheet():
+					w.setOK()
 	
 	def db_values(self):
 		"""return generator with values in correct order for db query
@@ -780,9 +1019,7 @@ class BreastForm(QDialog):
 	
 	def _datecode(self, wdgt:BSmallDateWidget)->str:
 		"Return an appropriate code for the date"
-		if wdgt.todb():
-			return 'mdy'
-		return 'uk'
+		return scanparams.date_code(wdgt.todb())
 	
 	def _db_special(self, field:str):
 		"""
@@ -803,6 +1040,9 @@ class BreastForm(QDialog):
 				yield self._datecode(self.report_returned)
 			case 'mri_code':
 				yield self._datecode(self.mri_date)
+			case 'id':
+				# None inserts a new record, as rb_insert_ispy2's output
+				yield self.recordId
 			case _:
 				# none of special cases matched
 				if field in self._fields:
@@ -828,16 +1068,19 @@ class BreastForm(QDialog):
 		"""return a string with all checked ids for discrepancies
 		This is the format expected the insert_ispy2_deviation stored procedure.
 		"""
-		r = ", ".join(str(w.val()) for w in self._discrep_widgets())
-		if r:
-			return r
-		else:
-			# The empty string will cause a syntax error on server side
-			return "null"
+		ids = [w.val() for w in self._discrep_widgets()]
+		if self._stored is not None:
+			# insert_ispy2_deviation drops any not listed, so keep those without a check box
+			shown = {w.val() for nm, w in self._fields.items() if nm.startswith("discrep")}
+			ids.extend(i for i in self._stored.deviations if i not in shown)
+		return scanparams.discrep_string(ids)
 	
 	def write(self):
 		"""
-		Write my values into the database.  Return True on success.
+		Queue my values for the database.  Return True if they were queued.
+		They go into the local journal at once, and replay() sends them on from a
+		worker thread, so saving works, and the form stays responsive, even when
+		the database can't be reached.
 		This uses database transactions to assure that either all tables are updated or none.
 		It is not clear to me what happens when the submit button on
 		insert\ispy2.jsp is pressed.  It probably does a submit_page, but there are 2 different
@@ -886,39 +1129,356 @@ class BreastForm(QDialog):
    @id numeric(5, 0) = NULL  OUTPUT
 		"""
 
-		# ignore this test for now
-		if False and not self.is_sane():
+		if not self.is_sane():
+			return False
+		vals = tuple(self.db_values())
+		key = examindex.key_of(vals)
+		# an edited record may keep its own key
+		if key in self.exams and (self.recordId is None or self.exams.get(key) != self.recordId) \
+				and not self._confirmDuplicate(key):
 			return False
-		vals = self.db_values()
-		self.curs.execute(
-			"{call rb_insert_ispy2(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)}",
-			# when vals is a generator must use *; otherwise it's considered a single argument
-			*vals
-		)
-		self.curs.nextset()  # otherwise get Previous SQL was not a query
-		ispy2_tbl_id = self.curs.fetchone().ispy2_tbl_id
-		discrepvals = self.discrep_values()
-		# even empty could mean reseting some existing values
-		self.curs.execute(
-			"{call insert_ispy2_deviation(?,?)}", (ispy2_tbl_id, discrepvals)
-		)
-		self.curs.commit()
-		QMessageBox.information(None, "Successful write to database",
-						  f"""The new record is id={ispy2_tbl_id} in the ispy2 table.
-Additional values may have been changed in the ispy2_deviations table.""")
+		discrep = self.discrep_values()
+		# so only the reasons that changed are sent
+		loaded = ()
+		if self.recordId is not None:
+			loaded = self._stored.deviations
+			old = self._stored.key()
+			if old != key and old in self.exams and self.exams.get(old) == self.recordId:
+				self.exams.discard(old)
+			self.records.discard(self.recordId)
+		source = self.parameterFile or (f"id={self.recordId}" if self.recordId is not None else None)
+		# so a second click, e.g., of a double click, can't save the exam again, or the blank form
+		self._allowSave(False)
+		seq = self.journal.append(vals, discrep, source, loaded)
+		self.exams.add(key, self.recordId)
+		log.info(f"Saved {source} as journal entry {seq}")
+		self.saved.emit(self.parameterFile)
 		self.clear()
+		self._setRecord(None)
+		self.parameterFile = None
 		self.fileButton.setText("Select File")
+		self.replay()
 		return True
-	
+
+	def _allowSave(self, allow: bool):
+		"enable Save; or, once an exam is saved, disable it until the form has another"
+		self.submit.setEnabled(allow)
+		self.submit.setToolTip("" if allow else "Saved.  Load a file or record, or click New, to save another exam")
+
+	def _confirmDuplicate(self, key) -> bool:
+		"the exam with key is already recorded.  Return True if the user wants to save it anyway"
+		ispy2_tbl_id = self.exams.get(key)
+		where = (f"is in the database as id={ispy2_tbl_id}" if ispy2_tbl_id is not None
+			else "was saved on this computer and is waiting to be sent to the database")
+		mri_date = f"{date.fromordinal(key[2]):%Y-%m-%d}" if key[2] else "unknown"
+		answer = QMessageBox.question(self, "Exam already recorded",
+			f"""The exam for I-SPY ID {key[0]}, visit {self.visit_number.todb() or "unknown"}, MRI date {mri_date}
+{where}.
+Save it again anyway?""",
+			QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+		return answer == QMessageBox.StandardButton.Yes
+
+	@Slot()
+	def replay(self):
+		"""Send the journal's pending writes to the database in the background.
+		Without a connection, start opening one; connected() calls this again.
+		"""
+		self.replayTimer.stop()
+		self._showDbStatus()
+		if not self.journal.counts().get("pending"):
+			return
+		if self.backend is None:
+			if self._connector is None or self._connector.done:
+				self.openConnection()
+			return
+		if self._replayer is not None and not self._replayer.done:
+			# replayed() will call again for anything it missed
+			return
+		self.busy.setVisible(True)
+		self._replayer = workers.start(self.connection.run, lambda backend: journal.replay(self.journal, backend),
+			result=self.replayed, error=self.replayFailed)
+
+	@Slot(object)
+	def replayed(self, result):
+		sent, rejected = result
+		self.busy.setVisible(False)
+		self._failures = 0
+		for q, ispy2_tbl_id in sent:
+			log.info(f"Journal entry {q.seq} from {q.source} is id={ispy2_tbl_id} in the ispy2 table")
+			self.exams.add(examindex.key_of(q.vals), ispy2_tbl_id)
+		if sent:
+			q, ispy2_tbl_id = sent[-1]
+			self._lastSent = f"id={ispy2_tbl_id}" + (f" from {Path(q.source).name}" if q.source else "")
+		for q, msg in rejected:
+			QMessageBox.warning(self, "Database refused an exam",
+				f"""The exam saved from {q.source or "the form"} was not written:
+{msg}
+It is kept as entry {q.seq} in {self.journal.path}.""")
+		self.replay()
+
+	@Slot(object)
+	def replayFailed(self, exc_info):
+		"most likely the connection was lost.  The writes stay in the journal"
+		self.busy.setVisible(False)
+		log.warning(f"Could not send saved exams to {self.DSN}: {exc_info[1]}")
+		self.connectionLost(exc_info)
+
+	@Slot(object)
+	def connectionLost(self, exc_info):
+		"""the connection failed, and so did a fresh one; see connection.py.
+		Close it, and try again later
+		"""
+		self._connected = False
+		self.connection.close()
+		self._retryLater(exc_info[1])
+
+	@property
+	def backend(self):
+		"the db.Backend of the connection once connected() has set it up, else None"
+		return self.connection.backend if self._connected else None
+
+	@Slot()
+	def keepAlive(self):
+		"check the connection, if it has been idle, in the background, so it is ready when wanted"
+		if self.backend is None or (self._pinger is not None and not self._pinger.done):
+			return
+		self._pinger = workers.start(self.connection.keep_alive, error=self.connectionLost)
+
+	def _retryLater(self, error):
+		"try the database again after a delay that grows with each failure"
+		self._failures += 1
+		self._dbError = error
+		self.dbRetry.setVisible(True)
+		delay = journal.backoff_delay(self._failures)
+		self._retryAt = datetime.now() + timedelta(seconds=delay)
+		self.replayTimer.start(delay * 1000)
+		self._showDbStatus()
+
 	@Slot()
 	def save(self):
 		self.write()
 
+	@Slot()
+	def lookUp(self):
+		"""Open the record the user asked for: #N or id=N is the ispy2 table id,
+		anything else an I-SPY ID, or failing that a table id.
+		"""
+		text = self.recordEdit.text().strip()
+		if not text:
+			return
+		m = re.fullmatch(r"(?:#|id\s*=\s*)(\d+)", text)
+		if m:
+			self.openRecord(int(m.group(1)))
+			return
+		found = [(key, i) for key, i in self.exams.find(text) if i is not None]
+		if not found:
+			if text.isdigit():
+				self.openRecord(int(text))
+			else:
+				QMessageBox.information(self, "No such exam", f"No exam for I-SPY ID {text} is in the database.")
+			return
+		ispy2_tbl_id = found[0][1] if len(found) == 1 else self._chooseRecord(found)
+		if ispy2_tbl_id is not None:
+			self.openRecord(ispy2_tbl_id)
+
+	def _chooseRecord(self, found):
+		"found is [(exam key, ispy2_tbl_id)] for one patient.  Return the id the user picks, or None"
+		labels = [f"Visit {key[1] or '?'}, MRI date {f'{date.fromordinal(key[2]):%Y-%m-%d}' if key[2] else 'unknown'}"
+			f" (id={i})" for key, i in found]
+		label, ok = QInputDialog.getItem(self, "Choose the exam", f"Exams for I-SPY ID {found[0][0][0]}",
+			labels, len(labels) - 1, False)
+		return found[labels.index(label)][1] if ok else None
+
+	def openRecord(self, ispy2_tbl_id: int, remember=True):
+		"""Show the record with ispy2_tbl_id to edit; at once if it is in self.records.
+		Unless remember is false, it becomes the latest in the history for back() and forward().
+		"""
+		exam = self.records.get(ispy2_tbl_id)
+		if exam is not None:
+			self.showRecord(exam, remember)
+			return
+		if self.backend is None:
+			QMessageBox.information(self, "Not connected", f"Can't fetch id={ispy2_tbl_id} until connected to {self.DSN}.")
+			return
+		self.recordStatus.setText(f"Fetching id={ispy2_tbl_id}...")
+		self._fetcher = workers.start(self._fetchRecord, ispy2_tbl_id, remember,
+			result=self.recordFetched, error=self.fetchFailed)
+
+	def _fetchRecord(self, ispy2_tbl_id, remember):
+		"Runs on a worker thread.  Return (ispy2_tbl_id, StoredExam or None, remember)"
+		return ispy2_tbl_id, self.connection.run(self.records.fetch, ispy2_tbl_id), remember
+
+	@Slot(object)
+	def recordFetched(self, result):
+		ispy2_tbl_id, exam, remember = result
+		if exam is None:
+			self._setRecord(self._stored)
+			QMessageBox.information(self, "No such record", f"There is no record id={ispy2_tbl_id} in the database.")
+			return
+		self.showRecord(exam, remember)
+
+	@Slot(object)
+	def fetchFailed(self, exc_info):
+		self._setRecord(self._stored)
+		QMessageBox.warning(self, "Could not fetch the record", str(exc_info[1]))
+		if self.backend is None or self.backend.is_connection_error(exc_info[1]):
+			self.connectionLost(exc_info)
+
+	def showRecord(self, exam, remember=True):
+		"fill the form from exam, a records.StoredExam, to edit it"
+		self.parameterFile = None
+		self.fileButton.setText("Select File")
+		# fields that don't take their values show them as errors
+		self.apply_record(self._recordValues(exam))
+		self._allowSave(True)
+		if remember:
+			del self._history[self._historyPos + 1:]
+			if not self._history or self._history[-1] != exam.id:
+				self._history.append(exam.id)
+			self._historyPos = len(self._history) - 1
+		self._setRecord(exam)
+
+	def _recordValues(self, exam) -> dict:
+		"{field name: value} for apply_record() from exam, a records.StoredExam"
+		v = exam.values
+		record = {}
+		for name, w in self._fields.items():
+			match name:
+				case 'auto_timing1' | 'auto_timing2':
+					x = [v.get(f"{name}_{part}") for part in ("min", "sec", "option")]
+				case 'fov':
+					x = [v.get("fov1"), v.get("fov2")]
+				case 'report_received' | 'report_returned':
+					x = v.get(f"{name}_date")
+				case _ if name.startswith("discrep"):
+					x = w.val() in exam.deviations
+				case _:
+					x = v.get(name)
+			record[name] = x
+		return record
+
+	def _setRecord(self, exam):
+		"make exam, a records.StoredExam, or None for a new exam, the one being edited"
+		self._stored = exam
+		self.recordId = exam.id if exam is not None else None
+		if exam is None:
+			self.recordStatus.setText("New exam")
+		else:
+			self.recordStatus.setText(f"Editing {exam.describe()}; Save updates it")
+		self.backButton.setEnabled(self._historyPos > 0)
+		self.forwardButton.setEnabled(self._historyPos < len(self._history) - 1)
+
+	@Slot()
+	def newRecord(self):
+		"stop editing; the form is blank for a new exam"
+		self.clear()
+		self._setRecord(None)
+		self._allowSave(True)
+
+	@Slot()
+	def back(self):
+		if self._historyPos > 0:
+			self._historyPos -= 1
+			self.openRecord(self._history[self._historyPos], remember=False)
+
+	@Slot()
+	def forward(self):
+		if self._historyPos < len(self._history) - 1:
+			self._historyPos += 1
+			self.openRecord(self._history[self._historyPos], remember=False)
+
 	def clear(self):
 		"blank all fields"
+		self._clearConflicts()
 		for w in self._fields.values():
 			w.clear()
 
+	@Slot()
+	def openConnection(self):
+		"Start connecting to the database in the background"
+		self.replayTimer.stop()
+		self._connected = False
+		self.dbRetry.setVisible(False)
+		# Save stays enabled: the journal keeps what is saved meanwhile
+		self._setDbStatus(f"Connecting to {self.DSN}...  Exams saved meanwhile wait on this computer.")
+		self._connector = workers.start(self._connect,
+			result=self.connected, error=self.connectFailed)
+
+	def _connect(self):
+		"""Runs on a worker thread.  Open self.connection, and return the site records.
+		Fetching the sites here takes that round trip off the GUI thread as well,
+		as does loading the keys of the exams already recorded into self.exams.
+		"""
+		self.connection.connect()
+		try:
+			return self.connection.run(self._prepare)
+		except Exception:
+			self.connection.close()
+			raise
+
+	def _prepare(self, backend):
+		"Runs on a worker thread, for _connect()"
+		siteRecs = sitecache.normalize(backend.select_sites())
+		try:
+			n = self.exams.load(backend)
+			log.info(f"{n} exams already recorded")
+		except Exception as e:
+			if backend.is_connection_error(e):
+				raise
+			# not fatal; duplicates of exams saved before are not caught
+			log.warning(f"Could not load the exams already recorded: {e}")
+			backend.rollback()
+		return siteRecs
+
+	@Slot(object)
+	def connected(self, siteRecs):
+		self._connected = True
+		self._failures = 0
+		self._dbError = None
+		self.sitesFetched(siteRecs)
+		self.replay()
+
+	@Slot(object)
+	def connectFailed(self, exc_info):
+		"not fatal; saves wait in the journal, and the user may retry"
+		log.warning(f"Could not connect to {self.DSN}: {exc_info[1]}")
+		self._retryLater(exc_info[1])
+
+	def _showDbStatus(self):
+		"show the state of the connection and of the journal"
+		n = self.journal.counts()
+		waiting = f"{n['pending']} saved exam(s) kept on this computer until sent" if n.get("pending") else ""
+		if n.get("rejected"):
+			waiting += f"{'; ' if waiting else ''}{n['rejected']} refused by the database"
+		if self.backend is not None:
+			msg = f"Connected to {self.DSN}"
+			if waiting:
+				msg += f"; {waiting}"
+			elif self._lastSent:
+				msg += f"; last saved {self._lastSent}"
+			self._setDbStatus(msg, "green")
+		elif self._dbError is not None:
+			msg = f"Not connected: {self._dbError}"
+			if self.replayTimer.isActive():
+				msg += f"\nWill try again at {self._retryAt:%H:%M:%S}"
+			if waiting:
+				msg += f"\n{waiting}"
+			self._setDbStatus(msg, "red")
+
+	def _setDbStatus(self, msg: str, color: str = None):
+		self.dbStatus.setText(msg)
+		self.dbStatus.setStyleSheet(f"color: {color}" if color else "")
+
+	@Slot(object)
+	def sitesFetched(self, siteRecs):
+		"update cache, and the drop-down if sites have changed"
+		sitecache.save(self.DSN, siteRecs)
+		if siteRecs != self.siteRecs:
+			log.info("Site list changed in database")
+			self.siteRecs = siteRecs
+			self.site.setSites(siteRecs)
+			self.sitesChanged.emit()
+
 	def exception_hook(self, exc_type, exc_value, exc_traceback):
 		"""Function handling uncaught exceptions.
 		It is triggered each time an uncaught exception occurs. 
@@ -930,7 +1490,12 @@ Additional values may have been changed in the ispy2_deviations table.""")
 			exc_info = (exc_type, exc_value, exc_traceback)
 			log_msg = '\n'.join([''.join(traceback.format_tb(exc_traceback)),
 					'{0}: {1}'.format(exc_type.__name__, exc_value)])
-			self.curs.rollback()  # cancel transaction and release lock
+			if self.backend is not None:
+				try:
+					self.backend.rollback()  # cancel transaction and release lock
+				except Exception as e:
+					# the connection is gone, and the transaction with it
+					log.info(f"Error rolling back: {e}")
 			show_exception_box(log_msg)
 			QApplication.instance().exit(1)
 
@@ -939,26 +1504,93 @@ Additional values may have been changed in the ispy2_deviations table.""")
 			# trigger message box show
 			#self._exception_caught.emit(log_msg)
 
-	def __init__(self, parent=None):
+	def __init__(self, parent=None, dsn=db.DSN):
+		"dsn names the database, as for db.open_backend()"
 		super(BreastForm, self).__init__(parent)
 		self._automatics = []  # layout row indices for material to obtain from parameterFile
 		self._fields = {}  # keys are field names, values are BreastWidgets
+		self._combos = None  # all the BComboBoxes, within fields too; see _bulk()
+		self.parameterFile = None  # file the current values came from
+		self.inbox = None  # folder where new parameter files arrive
+		# the other files for each exam; see pairFile()
+		self.fileIndex = fileindex.FileIndex(fileindex.index_path())
+		self._indexer = None  # worker updating fileIndex
+		self._pairer = None  # worker reading the files to pair with parameterFile
+		self._pairings = 0  # pairFile() calls; only the latest one's result is used
+		self._params = {}  # {header: value} from parameterFile
+		self._partners = []  # the other files for its exam, merged into the form
+		self._conflicts = {}  # widget: its own tooltip, for the fields on which those files disagree
 		sys.excepthook = self.exception_hook  # establish error handling
 		self.outer = QFormLayout(self)
 		self.setLayout(self.outer)
-		self.DSN = 'breastdb-new'
-		self.conn = pyodbc.connect(f"DSN={self.DSN}")  #passwordless login
-		# self.conn.autocommit == False by default, which we want
-		self.curs = self.conn.cursor()
-			
-		self.siteRecs = []
-		rs = self.curs.execute("{call select_ispy2_sites}")
-		r = rs.fetchone()
-		while r:
-			self.siteRecs.append((r.id, r.site, r.name))
-			r = rs.fetchone()
+		self.DSN = dsn
+		# the connection is opened in the background; see openConnection().
+		# It reopens itself if it has died, and is used by one worker at a time
+		self.connection = connection.Connection(self.DSN)
+		self._connected = False  # see connected()
+		self._connector = None  # worker opening the connection
+		self._dbError = None  # why we are not connected
+		self._failures = 0  # connection attempts that failed in a row
+		# saves go to the journal, and are sent on to the database from there
+		self.journal = journal.Journal(journal.journal_path(self.DSN))
+		# exams already recorded, to warn about saving one twice; filled in by _connect()
+		self.exams = examindex.ExamIndex()
+		for q in self.journal.pending():
+			self.exams.add(examindex.key_of(q.vals))
+		self._replayer = None  # worker sending journal entries
+		self._pinger = None  # worker checking an idle connection; see keepAlive()
+		# records read back to edit
+		self.records = records.RecordCache()
+		self.recordId = None  # ispy2_tbl_id of the record being edited, None for a new exam
+		self._stored = None  # that record as read, a records.StoredExam
+		self._fetcher = None  # worker fetching a record
+		self._history = []  # ids of the records viewed, for back() and forward()
+		self._historyPos = -1
+		self._lastSent = ""
+		self.replayTimer = QTimer(self)
+		self.replayTimer.setSingleShot(True)
+		self.replayTimer.timeout.connect(self.replay)
+		self.keepAliveTimer = QTimer(self)
+		self.keepAliveTimer.timeout.connect(self.keepAlive)
+		self.keepAliveTimer.start(connection.KEEP_ALIVE * 1000)
+		self.siteRecs, saved = sitecache.load(self.DSN)
+		self.siteAliases = sitematch.AliasTable(sitematch.alias_path(self.DSN))
+		log.info(f"Using sites cached {saved}")
+
+		self.dbStatus = QLabel()
+		self.dbRetry = QPushButton("Retry")
+		self.dbRetry.clicked.connect(self.openConnection)
+		box = QHBoxLayout()
+		box.addWidget(self.dbStatus)
+		box.addWidget(self.dbRetry)
+		box.addStretch()
+		self.outer.addRow("Database", box)
+		self.openConnection()
 
 		self.fileButton = QPushButton("Select File")
 		self.fileButton.clicked.connect(self.getFile)
 		self.outer.addRow("Scan Parameters", self.fileButton)
+
+		self.backButton = QPushButton("<")
+		self.backButton.setToolTip("Previous record viewed")
+		self.backButton.clicked.connect(self.back)
+		self.forwardButton = QPushButton(">")
+		self.forwardButton.setToolTip("Next record viewed")
+		self.forwardButton.clicked.connect(self.forward)
+		self.recordEdit = QLineEdit()
+		self.recordEdit.setPlaceholderText("I-SPY ID or #id")
+		self.recordEdit.setToolTip("I-SPY ID, or # and the ispy2 table id, of a record to correct")
+		self.recordEdit.returnPressed.connect(self.lookUp)
+		openButton = QPushButton("Open")
+		openButton.clicked.connect(self.lookUp)
+		newButton = QPushButton("New")
+		newButton.setToolTip("Clear the form for a new exam")
+		newButton.clicked.connect(self.newRecord)
+		self.recordStatus = QLabel()
+		box = QHBoxLayout()
+		for w in (self.backButton, self.forwardButton, self.recordEdit, openButton, newButton, self.recordStatus):
+			box.addWidget(w)
+		box.addStretch()
+		self.outer.addRow("Record", box)
+		self._setRecord(None)
 		## end of material from pre_fields_preamble.py
@@ -0,0 +1,22 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Regenerate src/ispy2_mri/ispy2_gui.py, if its inputs changed, before hatch builds.
+
+Only regenerating needs the database, for the deviation reasons; see pre_fields.py.
+"""
+import importlib.util
+from pathlib import Path
+
+from hatchling.builders.hooks.plugin.interface import BuildHookInterface
+
+
+class CustomBuildHook(BuildHookInterface):
+    def initialize(self, version, build_data):
+        path = Path(self.root) / "build" / "pre_fields.py"
+        spec = importlib.util.spec_from_file_location("pre_fields", path)
+        pre_fields = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(pre_fields)
+        if pre_fields.generate():
+            self.app.display_info(f"Regenerated {pre_fields.TARGET}")
@@ -2,4 +2,25 @@
 #
 # SPDX-License-Identifier: GPL-3.0-only
 
-from ispy2_mri.ispy2_gui import *
+"""Log receipt of I-SPY2 MRI exams into breastdb.
+
+The names of the GUI, e.g., launch and BreastForm, are available here as before,
+but ispy2_gui, and with it Qt, is only imported when one of them is first used.
+Tools that only need the parsing or database modules do not load Qt,
+and pyodbc is only loaded when a connection to the real database is opened.
+"""
+import importlib
+import importlib.util
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # from ispy2_mri import db asks for the attribute before importing the submodule
+    if importlib.util.find_spec(f"{__name__}.{name}") is not None:
+        return importlib.import_module(f"{__name__}.{name}")
+    from ispy2_mri import ispy2_gui
+    try:
+        return getattr(ispy2_gui, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
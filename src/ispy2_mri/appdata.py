@@ -0,0 +1,27 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Where the program keeps files of its own, such as caches."""
+import os
+from pathlib import Path
+import re
+
+
+def app_dir() -> Path:
+    """Return the directory for the program's local files, creating it if necessary.
+    The environment variable ISPY2_MRI_HOME overrides the default, which is
+    ispy2_mri under LOCALAPPDATA on MS-Windows and under ~/.cache elsewhere.
+    """
+    d = os.environ.get("ISPY2_MRI_HOME")
+    if d:
+        d = Path(d)
+    else:
+        d = Path(os.environ.get("LOCALAPPDATA") or Path.home() / ".cache") / "ispy2_mri"
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def safe_name(s: str) -> str:
+    "s, e.g., a database spec like sqlite:C:/tmp/x.db, made usable as part of a file name"
+    return re.sub(r"[^\w.-]+", "_", s)
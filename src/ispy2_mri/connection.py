@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""A connection to the database that reopens itself when it has died.
+
+The form keeps one connection open all day.  Overnight the server, or
+something on the network between, may drop it without telling us, and the
+first call in the morning fails.  Connection.run(fn, *args) calls
+fn(backend, *args) with the current db.Backend, and:
+  - if the connection has been idle for CHECK_AFTER seconds, first checks
+    it with Backend.ping(), one cheap round trip, and reopens it if dead;
+  - if fn still fails with a connection error, reopens the connection and
+    calls fn once more.  fn must leave nothing half done when it raises,
+    as journal.replay() does by rolling back.
+keep_alive(), called on a timer, pings a connection that has been idle, so
+it is less likely to be dropped, and reopens one that was, in the
+background, before anyone needs it.
+
+A call that fails on a fresh connection too is raised; then the database
+itself is unreachable, and the caller should wait before trying again.
+"""
+import logging
+import threading
+import time
+
+from ispy2_mri import db, timing
+
+log = logging.getLogger(__name__)
+
+CHECK_AFTER = 60  # seconds idle before a connection is checked before use
+KEEP_ALIVE = 300  # seconds between keep_alive() calls by the form
+
+
+class Connection:
+    """The db.Backend for spec, as for db.open_backend(), opened by connect().
+    Methods may be called from any thread; the backend is used by one at a time.
+    """
+
+    def __init__(self, spec: str = db.DSN, check_after: float = CHECK_AFTER):
+        self.spec = spec
+        self.check_after = check_after
+        self.backend = None  # None until connect(), and after close()
+        self.reconnects = 0  # times a dead connection was replaced
+        self._used = 0.0  # time.monotonic() of the last successful call
+        self._lock = threading.RLock()
+
+    def connect(self) -> db.Backend:
+        "open a new connection, replacing any there is.  Return its backend"
+        with self._lock:
+            self._discard()
+            self.backend = db.open_backend(self.spec)
+            self._used = time.monotonic()
+            return self.backend
+
+    def close(self):
+        with self._lock:
+            self._discard()
+
+    def _discard(self):
+        backend, self.backend = self.backend, None
+        if backend is not None:
+            try:
+                backend.close()
+            except Exception as e:  # noqa: BLE001 it is most likely dead already
+                log.info(f"Error closing connection: {e}")
+
+    def _reconnect(self, why) -> db.Backend:
+        log.warning(f"Connection to {self.spec} lost ({why}); reconnecting")
+        with timing.span("reconnect"):
+            backend = self.connect()
+        self.reconnects += 1
+        return backend
+
+    def idle(self) -> float:
+        "seconds since the connection was last used"
+        return time.monotonic() - self._used
+
+    def _alive(self, backend) -> bool:
+        "False if ping() fails with a connection error; other errors are raised"
+        try:
+            backend.ping()
+        except Exception as e:  # noqa: BLE001 pyodbc raises several unrelated classes
+            if not backend.is_connection_error(e):
+                raise
+            return False
+        self._used = time.monotonic()
+        return True
+
+    def run(self, fn, *args):
+        """fn(backend, *args) on a working connection; see the module documentation.
+        Raises RuntimeError if connect() has not been called.
+        """
+        with self._lock:
+            backend = self.backend
+            if backend is None:
+                raise RuntimeError(f"Not connected to {self.spec}")
+            if self.idle() >= self.check_after and not self._alive(backend):
+                backend = self._reconnect(f"idle {self.idle():.0f} s")
+            try:
+                result = fn(backend, *args)
+            except Exception as e:  # noqa: BLE001 pyodbc raises several unrelated classes
+                if not backend.is_connection_error(e):
+                    raise
+                backend = self._reconnect(e)
+                result = fn(backend, *args)
+            self._used = time.monotonic()
+            return result
+
+    def keep_alive(self) -> bool:
+        """Ping the connection if it has been idle, and reopen it if that fails.
+        Return True if it was reopened.  Does nothing if another thread is using it.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self.backend is None or self.idle() < self.check_after or self._alive(self.backend):
+                return False
+            self._reconnect(f"idle {self.idle():.0f} s")
+            return True
+        finally:
+            self._lock.release()
@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Reading consolidated parameter exports, which hold many exams in one file.
+
+An export is parameter files (see scanparams.py) one after another.  An exam
+ends at a delimiter line of dashes, equals signs or asterisks (at least 3),
+or a form feed, or where a second I-SPY ID line starts the next one.
+A file with a single exam is an ordinary parameter file, so any parameter
+file can be read this way.
+
+iter_records() is a generator.  It yields each exam as soon as its last line
+is read and holds nothing else, so memory stays flat however long the file,
+and the caller can parse and write the first exam while the rest is still
+on disk.  Files of MMAP_MIN bytes or more are memory-mapped for sequential
+reading, leaving the paging to the operating system.
+
+A line that can't be read spoils only its own exam: the Record carries the
+error, with the line number, and reading goes on with the next exam.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+import locale
+import mmap
+import os
+from pathlib import Path
+
+from ispy2_mri.scanparams import (DELIMITER_RE, FIRST_HEADER, GUIDE, PARAM_RE, ScanParameters,
+                                  UnexpectedInputError)
+
+MMAP_MIN = 1 << 20  # bytes
+
+
+@dataclass(slots=True)
+class Record:
+    "one exam from a file"
+    path: Path
+    index: int  # position in the file, from 0
+    line: int  # line number of its first line, from 1
+    params: dict  # {header: value}, as from scanparams.read_parameters()
+    error: str = ""  # the first line that couldn't be read, if any; params has the others
+    single: bool = False  # the only exam in the file, i.e., an ordinary parameter file
+
+    @property
+    def where(self):
+        "path for an ordinary parameter file, else 'path:line'"
+        return self.path if self.single else f"{self.path}:{self.line}"
+
+    def parse(self, siteRecs=()) -> ScanParameters:
+        "the exam's values.  Raises UnexpectedInputError if a line couldn't be read"
+        if self.error:
+            raise UnexpectedInputError(self.error)
+        return ScanParameters.from_text(self.params, siteRecs)
+
+
+@contextmanager
+def _lines(path: Path):
+    "iterable of the lines of path, as bytes; memory-mapped if the file is large"
+    with path.open("rb") as fin:
+        if os.fstat(fin.fileno()).st_size < MMAP_MIN:
+            yield fin
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                # read ahead, and let pages already read go
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield iter(mm.readline, b"")
+
+
+def iter_records(path, encoding=None):
+    """Generate a Record for each exam in the file at path, in order.
+    An empty file gives one empty Record, as parse_file() would give an empty ScanParameters.
+    encoding defaults to the one open() uses.
+    Raises OSError if the file can't be read.
+    """
+    path = Path(path)
+    encoding = encoding or locale.getpreferredencoding(False)
+    index = 0
+    start = 0  # line the current exam started on; 0 before it has any
+    params = {}
+    error = ""
+    with _lines(path) as lines:
+        for n, raw in enumerate(lines, 1):
+            line = raw.decode(encoding, errors="replace")
+            m = PARAM_RE.match(line)
+            header = m.group('var') if m else None
+            delimiter = m is None and DELIMITER_RE.match(line) is not None
+            if delimiter or header == FIRST_HEADER and header in params:
+                if start:
+                    yield Record(path, index, start, params, error)
+                    index += 1
+                    params = {}
+                    error = ""
+                    start = 0
+                if delimiter:
+                    continue
+            if m is None:
+                if line.strip():
+                    start = start or n
+                    error = error or f"line {n}: Can't handle mystery line: {line.strip()}"
+                continue
+            start = start or n
+            if header in GUIDE:
+                params[header] = m.group('val')
+            else:
+                error = error or f"line {n}: Unknown parameter {header}"
+    if start or index == 0:
+        # index == 0: nothing came before, so this is all there is
+        yield Record(path, index, start or 1, params, error, single=index == 0)
@@ -0,0 +1,217 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Database calls shared by the interactive form, the batch tools and the build.
+
+Backend has one method for each breastdb stored procedure we use, and a few plain queries.
+open_backend() picks the implementation from a spec:
+    breastdb-new        the ODBC data source of that name, i.e., the real database
+    odbc:breastdb-new   the same
+    sqlite:PATH         a local SQLite file standing in for it; see sqlitedb.py
+Nothing here needs Qt.
+"""
+from datetime import timedelta
+
+DSN = 'breastdb-new'
+ARRAYSIZE = 2000  # rows per fetchmany() for bulk reads
+
+
+class Backend:
+    """Interface to the database.  Subclasses implement all methods but insert_exam.
+    Writes are not committed until commit() is called.
+    """
+    name = ""  # for messages
+
+    def select_sites(self) -> list:
+        "select_ispy2_sites: return list of (internal_id, site_id, site_name) for all sites"
+        raise NotImplementedError
+
+    def insert_ispy2(self, vals) -> int:
+        """rb_insert_ispy2: vals are its 38 arguments, in order; it may be a generator.
+        Return the ispy2_tbl_id of the new record.
+        The last, id, must be None: the web app only ever inserts with it, and what the
+        procedure does with an existing id is not documented.  See new_record().
+        """
+        raise NotImplementedError
+
+    def update_ispy2(self, vals) -> int:
+        """Overwrite the record whose ispy2_tbl_id is the last of vals with the rest,
+        the arguments of rb_insert_ispy2 in order; it may be a generator.  Return that id.
+        Raises ValueError if there is no such record.
+        There is no stored procedure for this; it is a plain UPDATE of the columns rb_insert_ispy2 sets.
+        """
+        raise NotImplementedError
+
+    def insert_deviation(self, ispy2_tbl_id: int, deviation_string: str = "null"):
+        """insert_ispy2_deviation: make the deviation reasons for ispy2_tbl_id those
+        in deviation_string, a comma separated list of reason ids.
+        'null' leaves them unchanged.
+        """
+        raise NotImplementedError
+
+    def update_deviations(self, ispy2_tbl_id: int, add=(), remove=()):
+        """Give the record ispy2_tbl_id the deviation reasons with ids in add, and take away those in remove,
+        in one batch.  There is no stored procedure for this; see deviation_statements().
+        """
+        raise NotImplementedError
+
+    def select_ispy2(self, ispy2_tbl_id: int):
+        "select_ispy2: return {column: value} for the record, or None if there is none"
+        raise NotImplementedError
+
+    def select_deviation(self, ispy2_tbl_id: int = None) -> list:
+        """select_ispy2_deviation: return list of (id, deviation, has_reason) for all reasons, by position.
+        has_reason is None unless the record ispy2_tbl_id has the reason.
+        """
+        raise NotImplementedError
+
+    def select_exam_keys(self) -> list:
+        """return list of (ispy2_tbl_id, ispy2_id, visit_number, mri_date) for all records in the ispy2 table.
+        There is no stored procedure for this; it is a plain query.
+        """
+        raise NotImplementedError
+
+    def select_exams(self, first=None, last=None, site=None, arraysize=ARRAYSIZE) -> tuple:
+        """Return (columns, batches) for the records in the ispy2 table with their deviation reasons.
+        columns are the names of the ispy2 columns, then deviation_id and deviation.
+        batches is an iterator of lists of up to arraysize rows, read with fetchmany(), ordered by id.
+        An exam has one row for each of its deviation reasons, in order of position,
+        or one row with None for those if it has none.
+        first and last limit mri_date, inclusive, and site is the site id the form saves;
+        None means no limit.
+        There is no stored procedure for this; it is a plain query.  See exams_query().
+        """
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def ping(self):
+        """The cheapest round trip to the database, to check the connection is alive.
+        Raises as the other calls would if it is not.  By default, select_sites().
+        """
+        self.select_sites()
+
+    def is_connection_error(self, e: Exception) -> bool:
+        """True if e means the database could not be reached or the connection was lost,
+        as opposed to the database rejecting the request.
+        """
+        return False
+
+    def insert_exam(self, vals, discrepvals: str, loaded=None) -> int:
+        """Insert one exam and its deviations, or, if the id in vals is not None, update that record.
+        Return the ispy2_tbl_id.
+        discrepvals is the comma separated string insert_ispy2_deviation expects.
+        loaded is the ids of the reasons the record had when it was read, () for a new one.
+        Then only the changes are sent, with update_deviations(), if there are any,
+        and 'null' means no reasons.  If loaded is None the whole string goes to
+        insert_ispy2_deviation, which leaves the reasons alone for 'null'.
+        Does not commit.
+        """
+        vals = tuple(vals)
+        if vals[-1] is None:
+            ispy2_tbl_id = self.insert_ispy2(vals)
+        else:
+            ispy2_tbl_id = self.update_ispy2(vals)
+        if loaded is None:
+            # even empty could mean reseting some existing values
+            self.insert_deviation(ispy2_tbl_id, discrepvals)
+        else:
+            add, remove = deviation_delta(loaded, parse_deviation_string(discrepvals) or ())
+            if add or remove:
+                self.update_deviations(ispy2_tbl_id, add, remove)
+        return ispy2_tbl_id
+
+
+def new_record(vals) -> tuple:
+    "vals, the arguments of rb_insert_ispy2, as a tuple.  Raises ValueError if their id is not None"
+    vals = tuple(vals)
+    if vals[-1] is not None:
+        raise ValueError(f"rb_insert_ispy2 is only known to insert; use update_ispy2() for id={vals[-1]}")
+    return vals
+
+
+def parse_deviation_string(deviation_string: str):
+    """Return the reason ids in deviation_string as a list of int, or None for 'null'.
+    Raises ValueError for anything the server would choke on.
+    """
+    if deviation_string.strip().lower() == "null":
+        return None
+    # the server pastes the string into the SQL as is, so an empty piece is a syntax error there
+    return [int(piece) for piece in deviation_string.split(",")]
+
+
+def deviation_delta(loaded, wanted) -> tuple:
+    "(add, remove): sorted lists of the reason ids to add and remove to go from those in loaded to those in wanted"
+    loaded = set(loaded)
+    wanted = set(wanted)
+    return sorted(wanted - loaded), sorted(loaded - wanted)
+
+
+def deviation_statements(ispy2_tbl_id: int, add=(), remove=(), prefix: str = "") -> list:
+    """list of (sql, parameters) for Backend.update_deviations(): a DELETE if there is
+    anything to remove, and one INSERT of all the rows to add, if any.
+    prefix qualifies the table name, e.g., 'dbo.'.
+    """
+    statements = []
+    if remove:
+        statements.append((f"DELETE FROM {prefix}ispy2_deviation WHERE ispy2_tbl_id = ?"
+                           f" AND ispy2_deviation_reason_id IN ({', '.join('?' * len(remove))})",
+                           [ispy2_tbl_id, *remove]))
+    if add:
+        statements.append((f"INSERT INTO {prefix}ispy2_deviation (ispy2_tbl_id, ispy2_deviation_reason_id)"
+                           f" VALUES {', '.join(['(?, ?)'] * len(add))}",
+                           [v for rid in add for v in (ispy2_tbl_id, rid)]))
+    return statements
+
+
+def exams_query(prefix: str = "", first=None, last=None, site=None) -> tuple:
+    """(sql, parameters) for Backend.select_exams().
+    prefix qualifies the table names, e.g., 'dbo.'.
+    """
+    where = []
+    params = []
+    if first is not None:
+        where.append("i.mri_date >= ?")
+        params.append(first)
+    if last is not None:
+        # mri_date may have a time of day
+        where.append("i.mri_date < ?")
+        params.append(last + timedelta(days=1))
+    if site is not None:
+        where.append("i.site = ?")
+        params.append(site)
+    sql = f"""SELECT i.*, dr.id AS deviation_id, dr.deviation AS deviation
+    FROM {prefix}ispy2 AS i
+        LEFT OUTER JOIN {prefix}ispy2_deviation AS d ON d.ispy2_tbl_id = i.id
+        LEFT OUTER JOIN {prefix}ispy2_deviation_reason AS dr ON dr.id = d.ispy2_deviation_reason_id
+    {"WHERE " + " AND ".join(where) if where else ""}
+    ORDER BY i.id, dr.position"""
+    return sql, params
+
+
+def fetch_batches(curs, arraysize: int = ARRAYSIZE):
+    "generate lists of up to arraysize rows from curs, which has executed a query; closes curs at the end"
+    curs.arraysize = arraysize
+    try:
+        while rows := curs.fetchmany(arraysize):
+            yield rows
+    finally:
+        curs.close()
+
+
+def open_backend(spec: str = DSN) -> Backend:
+    "connect to the database spec describes; see the module documentation"
+    kind, sep, where = spec.partition(":")
+    if sep and kind == "sqlite":
+        from ispy2_mri.sqlitedb import SQLiteBackend
+        return SQLiteBackend(where)
+    from ispy2_mri.odbc import OdbcBackend
+    return OdbcBackend(where if sep and kind == "odbc" else spec)
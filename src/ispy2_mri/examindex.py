@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Which exams are already recorded, to catch saving one twice.
+
+The same exam often arrives as two parameter files, one from Aegis and one
+from brtool.  An ExamIndex holds the (ispy2_id, visit_number, mri_date) key of
+every record in the ispy2 table, fetched with one query, and is kept up to
+date as exams are saved, so checking a new one is a dictionary lookup.
+"""
+from datetime import date, datetime
+import threading
+
+from ispy2_mri.scanparams import DB_COLUMNS
+
+_KEY_COLUMNS = tuple(DB_COLUMNS.index(col) for col in ("ispy2_id", "visit_number", "mri_date"))
+
+
+def exam_key(ispy2_id, visit_number, mri_date):
+    """The key identifying an exam, or None if there is no ispy2_id to identify it by.
+    Values may be as the form produces them or as the database returns them.
+    """
+    ispy2_id = (ispy2_id or "").strip()
+    if not ispy2_id:
+        return None
+    if isinstance(mri_date, str):
+        mri_date = date.fromisoformat(mri_date[:10]) if mri_date.strip() else None
+    # the ordinal is smaller than a date, and ignores any time of day
+    day = mri_date.toordinal() if isinstance(mri_date, (date, datetime)) else None
+    return (ispy2_id, (visit_number or "").strip().casefold(), day)
+
+
+def key_of(vals):
+    "the exam_key() of vals, the rb_insert_ispy2 arguments in order"
+    vals = tuple(vals)
+    return exam_key(*(vals[i] for i in _KEY_COLUMNS))
+
+
+class ExamIndex:
+    """{exam_key: ispy2_tbl_id} for recorded exams.
+    The id is None for exams saved here but not yet sent to the database.
+    Methods may be called from any thread.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.loaded = False  # True once load() has succeeded
+
+    def load(self, backend) -> int:
+        """Replace the exams from the database with all those now in backend, a db.Backend.
+        Exams not yet sent are kept.  Return the number of exams.
+        """
+        ids = {}
+        for ispy2_tbl_id, ispy2_id, visit_number, mri_date in backend.select_exam_keys():
+            # if the database already has duplicates, report the first
+            ids.setdefault(exam_key(ispy2_id, visit_number, mri_date), int(ispy2_tbl_id))
+        ids.pop(None, None)
+        with self._lock:
+            for key, ispy2_tbl_id in self._ids.items():
+                if ispy2_tbl_id is None:
+                    ids.setdefault(key, None)
+            self._ids = ids
+            self.loaded = True
+        return len(ids)
+
+    def add(self, key, ispy2_tbl_id=None):
+        "record an exam; ispy2_tbl_id None means it isn't in the database yet"
+        if key is None:
+            return
+        with self._lock:
+            if ispy2_tbl_id is not None or key not in self._ids:
+                self._ids[key] = ispy2_tbl_id
+
+    def discard(self, key):
+        "forget key, e.g., when its insert was rolled back"
+        with self._lock:
+            self._ids.pop(key, None)
+
+    def find(self, ispy2_id: str) -> list:
+        "[(key, ispy2_tbl_id)] for the exams of patient ispy2_id, by MRI date"
+        ispy2_id = (ispy2_id or "").strip()
+        with self._lock:
+            found = [(key, i) for key, i in self._ids.items() if key[0] == ispy2_id]
+        return sorted(found, key=lambda x: (x[0][2] or 0, x[1] or 0))
+
+    def __contains__(self, key) -> bool:
+        return key is not None and key in self._ids
+
+    def get(self, key):
+        "the ispy2_tbl_id recorded for key, None if it is not in the database yet; KeyError if unknown"
+        return self._ids[key]
+
+    def __len__(self) -> int:
+        return len(self._ids)
@@ -0,0 +1,195 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Export exams from the ispy2 table, with their deviation reasons, to CSV or Parquet.
+
+    ispy2-mri-export OUT.csv [--from DATE] [--to DATE] [--site SITE]
+
+One row per exam: every column of the ispy2 table, then deviation_ids and
+deviations, the exam's reason ids and texts, separated by "; ".
+The rows come from a single query (see Backend.select_exams) read with
+fetchmany() and are written as they arrive, so memory use does not depend
+on how many there are.  Progress and the rate are reported as it goes.
+Parquet output needs pyarrow, e.g., pip install ispy2-mri[parquet].
+"""
+import argparse
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain, groupby
+from operator import itemgetter
+from pathlib import Path
+import sys
+import time
+
+from ispy2_mri import db, sitematch
+
+DEVIATION_COLUMNS = ("deviation_ids", "deviations")
+SEPARATOR = "; "
+PROGRESS = 10000  # exams between progress reports
+
+
+def exam_rows(columns, batches):
+    """Generate one tuple per exam from the rows of Backend.select_exams().
+    The ispy2 columns come first, then DEVIATION_COLUMNS.
+    """
+    by_id = itemgetter(columns.index("id"))
+    n = len(columns) - 2  # deviation_id and deviation are last
+    for _, group in groupby(chain.from_iterable(batches), key=by_id):
+        group = list(group)
+        reasons = [r for r in group if r[n] is not None]
+        yield (*group[0][:n],
+               SEPARATOR.join(str(r[n]) for r in reasons),
+               SEPARATOR.join(r[n + 1] for r in reasons))
+
+
+class CsvWriter:
+    def __init__(self, path: Path, columns):
+        self._fout = path.open("wt", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._fout)
+        self._writer.writerow(columns)
+
+    def write(self, rows: list):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._fout.close()
+
+
+class ParquetWriter:
+    """Writes each list of rows as a row group.
+    Column types are those of the values in the first rows: numbers of mixed
+    types, and Decimals, are doubles, and columns with other mixtures, or no
+    values at all, are strings.  The SQLite stand-in, for one, returns '' for
+    some integer columns.
+    """
+
+    def __init__(self, path: Path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            msg = "Parquet output needs pyarrow; pip install ispy2-mri[parquet], or write CSV"
+            raise ImportError(msg) from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._path = path
+        self._columns = list(columns)
+        self._schema = None
+        self._writer = None
+
+    def _types(self, rows):
+        pa = self._pa
+        types = {str: pa.string(), int: pa.int64(), float: pa.float64(), Decimal: pa.float64(), bool: pa.bool_(),
+                 datetime: pa.timestamp("us"), date: pa.date32()}
+        fields = []
+        for i, col in enumerate(self._columns):
+            kinds = {types.get(type(r[i]), pa.string()) for r in rows if r[i] is not None}
+            if kinds == {pa.int64(), pa.float64()}:
+                kinds = {pa.float64()}
+            fields.append(pa.field(col, kinds.pop() if len(kinds) == 1 else pa.string()))
+        return pa.schema(fields)
+
+    def write(self, rows: list):
+        if self._writer is None:
+            self._schema = self._types(rows)
+            self._writer = self._pq.ParquetWriter(self._path, self._schema)
+        arrays = []
+        for i, field in enumerate(self._schema):
+            values = [r[i] for r in rows]
+            if field.type == self._pa.float64():
+                values = [None if v is None else float(v) for v in values]
+            elif field.type == self._pa.string():
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        if self._writer is None:
+            # no rows, but still a readable file
+            self._schema = self._pa.schema([(col, self._pa.string()) for col in self._columns])
+            self._writer = self._pq.ParquetWriter(self._path, self._schema)
+        self._writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def export(backend, path: Path, fmt: str = "csv", first=None, last=None, site=None, arraysize=db.ARRAYSIZE,
+           out=sys.stdout) -> int:
+    """Write the exams backend, a db.Backend, has to path in format fmt, a key of WRITERS.
+    first, last and site are as for Backend.select_exams().  Return the number of exams written.
+    """
+    t0 = time.perf_counter()
+    columns, batches = backend.select_exams(first, last, site, arraysize)
+    writer = WRITERS[fmt](path, [*columns[:-2], *DEVIATION_COLUMNS])
+    n = 0
+    try:
+        rows = []
+        for row in exam_rows(columns, batches):
+            rows.append(row)
+            if len(rows) >= arraysize:
+                writer.write(rows)
+                n += len(rows)
+                rows = []
+                if n % PROGRESS < arraysize:
+                    print(f"{n} exams, {n / (time.perf_counter() - t0):.0f}/s", file=out)
+        if rows:
+            writer.write(rows)
+            n += len(rows)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - t0
+    print(f"{n} exams written to {path} in {elapsed:.1f} s, {n / elapsed if elapsed else 0:.0f} rows/s.", file=out)
+    return n
+
+
+def parse_site(text: str, siteRecs):
+    "site id for text, either the id or something sitematch recognizes as the name"
+    if text.isdigit():
+        return int(text)
+    rec = sitematch.matcher(siteRecs).match(text)
+    if rec is None:
+        raise ValueError(f"Unrecognized site {text}")
+    return rec[1]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="ispy2-mri-export", description=__doc__.splitlines()[0])
+    ap.add_argument("output", type=Path, help="file to write; the format is from the extension, .csv or .parquet")
+    ap.add_argument("--dsn", default=db.DSN,
+                    help="ODBC data source, or sqlite:PATH for a local stand-in (default %(default)s)")
+    ap.add_argument("--from", dest="first", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                    help="earliest MRI date to include")
+    ap.add_argument("--to", dest="last", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                    help="latest MRI date to include")
+    ap.add_argument("--site", help="only this site: its site id or name")
+    ap.add_argument("--format", choices=sorted(WRITERS), help="output format, if not from the extension")
+    ap.add_argument("--arraysize", type=int, default=db.ARRAYSIZE,
+                    help="rows per fetch from the database, and per write (default %(default)s)")
+    args = ap.parse_args(argv)
+
+    fmt = args.format or args.output.suffix.lstrip(".").lower()
+    if fmt not in WRITERS:
+        ap.error(f"can't tell the format from {args.output.name}; use --format")
+    backend = db.open_backend(args.dsn)
+    try:
+        site = None
+        if args.site:
+            try:
+                site = parse_site(args.site, sitematch.SiteMatcher(
+                    backend.select_sites(), sitematch.AliasTable(sitematch.alias_path(args.dsn))))
+            except ValueError as e:
+                ap.error(str(e))
+        export(backend, args.output, fmt, args.first, args.last, site, max(1, args.arraysize))
+    except ImportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        backend.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Index of parameter files by exam, to find the second file for an exam.
+
+Each exam's parameter file is generated twice, once by Aegis and once by
+brtool (see the design notes in pre_fields.py).  FileIndex keeps, in a
+SQLite file, the exam_key() of every parameter file in the folders it has
+been asked to update(), so the other file for an exam is one indexed query
+away.  update() only reads files that are new, or whose size or
+modification time changed, since it last saw them, and forgets those that
+have gone; a consolidated export, with several exams, is not indexed.
+
+read_partners() reads the other files for an exam, off the GUI thread, and
+merge() combines them and lists the fields on which they disagree.
+"""
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+
+from ispy2_mri import scanparams
+from ispy2_mri.appdata import app_dir
+from ispy2_mri.examindex import exam_key
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    -- exam_key(), all NULL if the file has none
+    ispy2_id TEXT,
+    visit TEXT,
+    day INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_exam ON files (ispy2_id, visit, day);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+"""
+
+
+def index_path():
+    return app_dir() / "fileindex.sqlite3"
+
+
+def params_key(params: dict):
+    "exam_key() of {header: value} from a parameter file, or None"
+    try:
+        mri_date = scanparams.parse_date(params["Date"]) if params.get("Date") else None
+    except ValueError:
+        mri_date = None
+    return exam_key(params.get("I-SPY ID"), params.get("Visit ID"), mri_date)
+
+
+def read_key(path: Path):
+    "exam_key() of the parameter file at path, or None if it has none or can't be read"
+    try:
+        with path.open("rt") as fin:
+            return params_key(scanparams.read_parameters(fin))
+    except (OSError, UnicodeDecodeError, scanparams.UnexpectedInputError) as e:
+        log.info(f"Not indexing {path}: {e}")
+        return None
+
+
+class FileIndex:
+    """The index file.  Methods may be called from any thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def update(self, folders, pattern="*.txt") -> int:
+        """Bring the entries for the files matching pattern in folders up to date with the disk.
+        Return the number of files read.  A folder that can't be listed is left as it was.
+        """
+        n = 0
+        for folder in folders:
+            # the same folder however it was named
+            folder = Path(os.path.abspath(folder))
+            try:
+                present = {}
+                with os.scandir(folder) as it:
+                    for d in it:
+                        if d.is_file() and Path(d.name).match(pattern):
+                            st = d.stat()
+                            present[os.path.join(folder, d.name)] = (st.st_mtime_ns, st.st_size)
+            except OSError as e:
+                log.warning(f"Could not index {folder}: {e}")
+                continue
+            with self._lock:
+                known = {p: (m, s) for p, m, s in self._conn.execute(
+                    "SELECT path, mtime_ns, size FROM files WHERE folder = ?", (str(folder),))}
+            changed = [p for p, stat in present.items() if known.get(p) != stat]
+            # the reading is done outside the lock, so lookups go on meanwhile
+            rows = []
+            for p in changed:
+                key = read_key(Path(p)) or (None, None, None)
+                rows.append((p, str(folder), *present[p], *key))
+            gone = [(p,) for p in known if p not in present]
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany("DELETE FROM files WHERE path = ?", gone)
+                    self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            n += len(rows)
+        return n
+
+    def lookup(self, key) -> list:
+        "the paths of the indexed files for the exam with exam_key() key, sorted"
+        if key is None:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE ispy2_id = ? AND visit = ? AND day IS ? ORDER BY path", key).fetchall()
+        return [Path(p) for p, in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM files").fetchone()[0]
+
+
+def read_partners(index: FileIndex, path, params: dict) -> list:
+    """[(path, {header: value})] for the files index has for the exam of params, other than path,
+    the file params came from.  Those that can't be read are left out.  Runs on a worker thread.
+    """
+    path = Path(os.path.abspath(path))
+    files = []
+    for p in index.lookup(params_key(params)):
+        if p == path:
+            continue
+        try:
+            with p.open("rt") as fin:
+                files.append((p, scanparams.read_parameters(fin)))
+        except (OSError, UnicodeDecodeError, scanparams.UnexpectedInputError) as e:
+            log.warning(f"Could not read {p}: {e}")
+    return files
+
+
+def _values(header: str, v: str, siteRecs) -> tuple:
+    "the database values the text v of header gives, or v itself if it can't be read"
+    rec = scanparams.ScanParameters()
+    rec.set_text(header, v, siteRecs)
+    if rec.problems:
+        return (v.strip().casefold(),)
+    return tuple(getattr(rec, col) for col in scanparams.GUIDE_COLUMNS[scanparams.GUIDE[header]])
+
+
+def merge(files, siteRecs=()) -> tuple:
+    """Combine files, a list of (path, {header: value}) for one exam, the first preferred.
+    Return ({header: value}, {header: [(path, value)]}); the first is the first file's values, with
+    the others' for headers it lacks, the second the headers for which the files' values differ.
+    Values are compared as the database would have them, so '70%' and '70' agree.
+    """
+    merged = {}
+    seen = {}  # header -> [(path, value)]
+    for path, params in files:
+        for header, v in params.items():
+            merged.setdefault(header, v)
+            seen.setdefault(header, []).append((path, v))
+    conflicts = {}
+    for header, values in seen.items():
+        if header not in scanparams.GUIDE or len(values) < 2:
+            continue
+        if len({_values(header, v, siteRecs) for _, v in values}) > 1:
+            conflicts[header] = values
+    return merged, conflicts
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""The layout of the form as data, independent of Qt.
+
+build/pre_fields.py generates formtable.SECTIONS, one Section per row of the
+form, from the web application's ispy2.jsp.  BreastForm builds its widgets
+from that table at run time; batch and validation tools can use the same
+catalogue of fields, e.g., their choices or deviation reason ids, without
+building any widgets.
+"""
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Field:
+    "one widget on the form, which is the attribute name of BreastForm"
+    name: str
+    widget: str  # class name in ispy2_gui, e.g., BComboBox
+    text: str | None = None  # label of a check box
+    choices: tuple | None = None  # fixed alternatives of a drop-down
+    data: str | None = None  # attribute of the form with the alternatives, looked up when the form is built
+    reason: int | None = None  # deviation reason id of a check box
+    options: dict = field(default_factory=dict)  # other keyword arguments of the widget's constructor
+
+
+@dataclass
+class Section:
+    "one row of the form: a label and the fields beside it"
+    label: str
+    fields: tuple
+    automatic: bool = False  # usually filled in from the parameter file
+
+
+def sections() -> tuple:
+    "all Sections, in the order they appear on the form"
+    from ispy2_mri.formtable import SECTIONS
+    return SECTIONS
+
+
+def fields():
+    "generate all Fields, in the order they appear on the form"
+    for s in sections():
+        yield from s.fields
+
+
+def field_named(name: str) -> Field:
+    "the Field called name; KeyError if there is none"
+    for f in fields():
+        if f.name == name:
+            return f
+    raise KeyError(name)
+
+
+def deviation_reasons() -> dict:
+    "{field name: deviation reason id} for the deviation check boxes"
+    return {f.name: f.reason for f in fields() if f.reason is not None}
@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""The fields of the form, by row.  Generated by build/pre_fields.py from ispy2.jsp; do not edit.
+See formspec.py.
+"""
+from ispy2_mri.formspec import Field, Section
+
+SECTIONS = (
+    Section('Protocol Deviation submitted?', (
+        Field('submitted', 'BComboBox', choices=('', 'Y', 'N')),
+    )),
+    Section('ISPY-2 ID', (
+        Field('ispy2_id', 'BLineEdit'),
+        Field('visit_number', 'BComboBox', choices=('', '1', 'A3w', 'A6w', 'A12w', 'B3w', 'B6w', 'B12w', 'S1', '5', '2', '2.5', '3', '3.5', '4')),
+    ), automatic=True),
+    Section('MRI Date', (
+        Field('mri_date', 'BSmallDateWidget'),
+    ), automatic=True),
+    Section('Breast', (
+        Field('breast', 'BLRBox'),
+    ), automatic=True),
+    Section('DCE Protocol compliant', (
+        Field('dce_compliant', 'BComboBox', choices=('', 'Y', 'N')),
+    )),
+    Section('Screen fail', (
+        Field('screen_fail', 'BCheckBox'),
+    )),
+    Section('If not compliant, what was deviation?\n(check all that apply)', (
+        Field('discrep13', 'BCheckBox', text='Motion', reason=13),
+        Field('discrep14', 'BCheckBox', text='Background/Grey not 60', reason=14),
+        Field('discrep15', 'BCheckBox', text='FOV outside range', reason=15),
+        Field('discrep16', 'BCheckBox', text='FOV overlarge for patient', reason=16),
+        Field('discrep17', 'BCheckBox', text='FOV inconsistent between visits', reason=17),
+        Field('discrep18', 'BCheckBox', text='Poor fat suppression', reason=18),
+        Field('discrep19', 'BCheckBox', text='Different scanner used from baseline', reason=19),
+        Field('discrep20', 'BCheckBox', text='Contrast off protocol', reason=20),
+        Field('discrep21', 'BCheckBox', text='Scan duration more than 5 seconds different from baseline', reason=21),
+        Field('discrep1', 'BCheckBox', text='Boxing not consistent', reason=1),
+        Field('discrep2', 'BCheckBox', text='Timing deviation - Auto timing', reason=2),
+        Field('discrep3', 'BCheckBox', text='Scan duration off protocol', reason=3),
+        Field('discrep4', 'BCheckBox', text='PE threshold not 70%', reason=4),
+        Field('discrep5', 'BCheckBox', text='PE threshold not consistent', reason=5),
+        Field('discrep6', 'BCheckBox', text='Late exam submission', reason=6),
+        Field('discrep9', 'BCheckBox', text='Scan quality insufficient', reason=9),
+        Field('discrep10', 'BCheckBox', text='Image artifact present', reason=10),
+        Field('deviation_late_exam_overdue', 'BIntEdit'),
+    )),
+    Section('Volume Calculation', (
+        Field('volume_calculation', 'BComboBox', choices=('', 'Possible', 'Not Possible')),
+    )),
+    Section('Site', (
+        Field('site', 'BSiteComboBox', data='siteRecs'),
+    ), automatic=True),
+    Section('Tumor Volume Submitted', (
+        Field('tumor_volume_submitted', 'BLineEdit'),
+    ), automatic=True),
+    Section('Auto Timing', (
+        Field('auto_timing1', 'BAutoTimingWidget', choices=('', '1', '2', '3', '4'), options={'i': 1}),
+        Field('auto_timing2', 'BAutoTimingWidget', choices=('', '5', '6', '7', '8'), options={'i': 2}),
+    ), automatic=True),
+    Section('Scan Duration', (
+        Field('scan_duration', 'BNumEdit', options={'p': 5, 's': 2}),
+    ), automatic=True),
+    Section('PE Threshold Processed', (
+        Field('pe_threshold', 'BPctEdit'),
+    ), automatic=True),
+    Section('Background/Grey Threshold', (
+        Field('bg_grey_threshold', 'BPctEdit'),
+    ), automatic=True),
+    Section('Injection rate\n2cc/second', (
+        Field('injection_rate', 'BCheckBox'),
+    )),
+    Section('Flush volume\n20 cc', (
+        Field('flush_volume', 'BCheckBox'),
+    )),
+    Section('Final (official) processing done by UCSF?', (
+        Field('final_processing_location', 'BComboBox', choices=('', 'UCSF', 'Site')),
+        Field('final_processing_aegis', 'BComboBox', choices=('', 'AEGIS', 'No AEGIS')),
+    )),
+    Section('Comments', (
+        Field('comments', 'BTextEdit', options={'rows': 3, 'cols': 60}),
+    )),
+    Section('FOV', (
+        Field('fov', 'BFOV'),
+    ), automatic=True),
+    Section('MOCO to pre in Aegis', (
+        Field('moco', 'BCheckBox'),
+    )),
+    Section('Motion- brtool registration', (
+        Field('motion_brtool', 'BCheckBox'),
+    )),
+    Section('Report received date', (
+        Field('report_received', 'BSmallDateWidget'),
+    )),
+    Section('Report returned to site', (
+        Field('report_returned', 'BSmallDateWidget'),
+    )),
+)
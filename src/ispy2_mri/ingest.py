@@ -0,0 +1,170 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Enter whole directories of scan parameter files without the GUI.
+
+    ispy2-mri-ingest DIR [DIR ...]
+
+Each file is treated as if it had been loaded into a freshly cleared form
+and saved with no further edits: the same rb_insert_ispy2 call is made,
+with the same values, and the same deviation reasons are added.
+Inserts are committed in batches; a database error rolls back the
+current batch only.
+Files for exams already in the database, or earlier in the same run, are
+skipped unless --allow-duplicates is given, as are exams with values the
+database won't take (see validation.py).
+A consolidated export, with many exams in one file, is read one exam at a
+time (see consolidated.py); each exam is written, and reported with its
+line number, as if it had a file of its own.
+"""
+import argparse
+from pathlib import Path
+import sys
+
+from ispy2_mri import db, sitematch, validation
+from ispy2_mri.consolidated import iter_records
+from ispy2_mri.examindex import ExamIndex, key_of
+from ispy2_mri.scanparams import DB_COLUMNS, UnexpectedInputError
+
+
+def find_files(dirs, pattern="*.txt", recursive=False) -> list:
+    "return sorted list of parameter files in dirs"
+    files = []
+    for d in dirs:
+        d = Path(d)
+        if d.is_file():
+            files.append(d)
+        else:
+            files.extend(d.rglob(pattern) if recursive else d.glob(pattern))
+    return sorted(files)
+
+
+def ingest(files, backend, siteRecs, batch_size=20, lenient=False, dry_run=False, out=sys.stdout,
+           exams=None) -> dict:
+    """Insert an exam for each file, or each exam in a consolidated file, through backend, a db.Backend.
+    Return {where: (ok, message)}, where is the path, or 'path:line' for an exam in a consolidated file.
+
+    Commits after every batch_size successful inserts and at the end.
+    If the database raises, the current batch is rolled back and all its exams reported as failed.
+    Unless lenient, files with values that can't be interpreted are not written.
+    exams, an ExamIndex, has the exams already recorded; files for those are not written,
+    and each file written is added.  None means no check.
+    """
+    results = {}
+    pending = []  # inserted but not yet committed
+    keys = []  # of the exams in pending
+
+    def report(where, ok, msg):
+        results[where] = (ok, msg)
+        print(f"{'OK  ' if ok else 'FAIL'} {where}: {msg}", file=out)
+
+    def rollback(e):
+        "the database raised e: report the batch as failed, and forget its exams"
+        backend.rollback()
+        for p, _ in pending:
+            report(p, False, f"rolled back ({type(e).__name__}: {e})")
+        pending.clear()
+        if exams is not None:
+            for k in keys:
+                exams.discard(k)
+        keys.clear()
+
+    def commit():
+        if not dry_run:
+            try:
+                backend.commit()
+            except Exception as e:  # noqa: BLE001 pyodbc raises several unrelated classes
+                rollback(e)
+                return
+        for where, msg in pending:
+            report(where, True, msg)
+        pending.clear()
+        keys.clear()
+
+    def records():
+        "(where, ScanParameters or the error), one exam at a time"
+        for path in files:
+            try:
+                for r in iter_records(path):
+                    try:
+                        yield r.where, r.parse(siteRecs)
+                    except UnexpectedInputError as e:
+                        yield r.where, e
+            except OSError as e:
+                yield path, e
+
+    for where, rec in records():
+        if isinstance(rec, Exception):
+            report(where, False, str(rec))
+            continue
+        problems = "; ".join(f"{header}: {v}" for header, v in rec.problems)
+        if problems and not lenient:
+            report(where, False, "unrecognized " + problems)
+            continue
+        note = f" (left blank: {problems})" if problems else ""
+        invalid = validation.check(dict(zip(DB_COLUMNS, rec.db_values())))
+        if invalid:
+            report(where, False, "; ".join(map(str, invalid)))
+            continue
+        key = key_of(rec.db_values())
+        if exams is not None and key in exams:
+            ispy2_tbl_id = exams.get(key)
+            report(where, False, f"duplicate of id={ispy2_tbl_id}" if ispy2_tbl_id is not None
+                   else "duplicate of an earlier exam")
+            continue
+        if dry_run:
+            pending.append((where, "parsed" + note))
+        else:
+            try:
+                ispy2_tbl_id = backend.insert_exam(rec.db_values(), rec.discrep_values(), ())
+            except Exception as e:  # noqa: BLE001 pyodbc raises several unrelated classes
+                rollback(e)
+                report(where, False, f"{type(e).__name__}: {e}")
+                continue
+            pending.append((where, f"id={ispy2_tbl_id}{note}"))
+        if exams is not None:
+            exams.add(key, ispy2_tbl_id if not dry_run else None)
+            keys.append(key)
+        if len(pending) >= batch_size:
+            commit()
+    commit()
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="ispy2-mri-ingest", description=__doc__.splitlines()[0])
+    ap.add_argument("dirs", nargs="+", metavar="DIR", help="directory of parameter files, or a single file")
+    ap.add_argument("--dsn", default=db.DSN,
+                    help="ODBC data source, or sqlite:PATH for a local stand-in (default %(default)s)")
+    ap.add_argument("--batch-size", type=int, default=20, help="commit after this many inserts (default %(default)s)")
+    ap.add_argument("--pattern", default="*.txt", help="file name pattern (default %(default)s)")
+    ap.add_argument("--recursive", action="store_true", help="also search subdirectories")
+    ap.add_argument("--lenient", action="store_true",
+                    help="write files with unrecognized values, leaving those values blank")
+    ap.add_argument("--dry-run", action="store_true", help="parse and report, but write nothing")
+    ap.add_argument("--allow-duplicates", action="store_true",
+                    help="write files even if the database already has an exam with the same ID, visit and date")
+    args = ap.parse_args(argv)
+
+    files = find_files(args.dirs, args.pattern, args.recursive)
+    backend = db.open_backend(args.dsn)
+    try:
+        # one index for all the files, with the aliases users taught the form
+        aliases = sitematch.AliasTable(sitematch.alias_path(args.dsn))
+        siteRecs = sitematch.SiteMatcher(backend.select_sites(), aliases)
+        exams = None
+        if not args.allow_duplicates:
+            exams = ExamIndex()
+            exams.load(backend)
+        results = ingest(files, backend, siteRecs, max(1, args.batch_size), args.lenient, args.dry_run,
+                         exams=exams)
+    finally:
+        backend.close()
+    nOK = sum(1 for ok, _ in results.values() if ok)
+    print(f"{nOK} of {len(results)} exams {'parsed' if args.dry_run else 'written'}, {len(results) - nOK} failed.")
+    return 0 if nOK == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Local journal of saved exams, sent on to the database when it can be reached.
+
+Save writes the fully computed rb_insert_ispy2 arguments and the deviation
+string, with the reasons the record had when it was read, to a SQLite file
+in WAL mode, and returns at once.  replay() sends
+queued writes in order, committing in batches, and records the
+ispy2_tbl_id the database assigns.  So an outage no longer loses data:
+entries wait in the journal until the server is back.
+
+A write the server refuses for reasons other than the connection, e.g., a
+value out of range, is marked rejected and kept, with the error, for
+someone to look at; it does not hold up the ones behind it.
+
+If the program dies after the database commits a batch but before the
+journal records that, those exams will be sent again.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+import json
+import logging
+import sqlite3
+import threading
+
+from ispy2_mri.appdata import app_dir, safe_name
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    queued TEXT NOT NULL,  -- UTC time of the save
+    source TEXT,  -- parameter file the values came from, if any
+    vals TEXT NOT NULL,  -- JSON list of the rb_insert_ispy2 arguments
+    discrep TEXT NOT NULL,  -- insert_ispy2_deviation argument
+    loaded TEXT,  -- deviation reasons the record had when read, '' for a new record; see Backend.insert_exam
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, sent or rejected
+    error TEXT,  -- last error trying to send
+    ispy2_tbl_id INTEGER,  -- assigned by the database
+    sent TEXT  -- UTC time of the commit
+)
+"""
+
+# journals from before the loaded column
+MIGRATIONS = {"loaded": "ALTER TABLE writes ADD COLUMN loaded TEXT"}
+
+# seconds between attempts to reach the database while writes are waiting
+BACKOFF_BASE = 5
+BACKOFF_MAX = 300
+
+
+def journal_path(dsn: str):
+    "file holding the journal for data source dsn"
+    return app_dir() / f"journal-{safe_name(dsn)}.sqlite3"
+
+
+def backoff_delay(failures: int) -> int:
+    "seconds to wait before the next attempt after failures attempts in a row have failed"
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, failures - 1))
+
+
+def _encode(v):
+    "JSON can't hold dates"
+    if isinstance(v, datetime):
+        return {"datetime": v.isoformat()}
+    if isinstance(v, date):
+        return {"date": v.isoformat()}
+    raise TypeError(f"Can't journal {v!r}")
+
+
+def _decode(d: dict):
+    if "datetime" in d:
+        return datetime.fromisoformat(d["datetime"])
+    if "date" in d:
+        return date.fromisoformat(d["date"])
+    return d
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass(slots=True)
+class Queued:
+    seq: int
+    source: str
+    vals: tuple  # arguments to rb_insert_ispy2
+    discrep: str  # argument to insert_ispy2_deviation
+    loaded: tuple = None  # reason ids the record had when read, or None if not known
+
+
+class Journal:
+    """The journal file.  Methods may be called from any thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # a save must survive a crash or power loss once append() returns
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(SCHEMA)
+            columns = {r[1] for r in self._conn.execute("PRAGMA table_info(writes)")}
+            for col, sql in MIGRATIONS.items():
+                if col not in columns:
+                    self._conn.execute(sql)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def append(self, vals, discrep: str, source=None, loaded=None) -> int:
+        """queue one exam.  Return its sequence number.
+        loaded is as for Backend.insert_exam().
+        """
+        v = json.dumps(list(vals), default=_encode)
+        if loaded is not None:
+            loaded = ", ".join(str(rid) for rid in loaded)
+        with self._lock:
+            c = self._conn.execute("INSERT INTO writes (queued, source, vals, discrep, loaded) VALUES (?, ?, ?, ?, ?)",
+                                   (_now(), None if source is None else str(source), v, discrep, loaded))
+        return c.lastrowid
+
+    def pending(self, limit: int = -1) -> list:
+        "the oldest limit writes still to be sent, as Queued.  limit < 0 means all"
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, source, vals, discrep, loaded FROM writes WHERE status = 'pending' ORDER BY seq LIMIT ?",
+                (limit,)).fetchall()
+        return [Queued(seq, source, tuple(json.loads(vals, object_hook=_decode)), discrep,
+                       None if loaded is None else tuple(int(rid) for rid in loaded.split(",") if rid.strip()))
+                for seq, source, vals, discrep, loaded in rows]
+
+    def mark_sent(self, sent):
+        "sent is a list of (seq, ispy2_tbl_id), all committed to the database"
+        t = _now()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE writes SET status = 'sent', error = NULL, ispy2_tbl_id = ?, sent = ? WHERE seq = ?",
+                    [(int(ispy2_tbl_id), t, seq) for seq, ispy2_tbl_id in sent])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def reject(self, seq: int, error: str):
+        "the database refused write seq; don't try it again"
+        with self._lock:
+            self._conn.execute("UPDATE writes SET status = 'rejected', error = ? WHERE seq = ?", (error, seq))
+
+    def counts(self) -> dict:
+        "{status: number of writes}"
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, count(*) FROM writes GROUP BY status").fetchall())
+
+
+def replay(journal: Journal, backend, batch_size: int = 20) -> tuple:
+    """Send pending writes to the database through backend, a db.Backend, oldest first.
+    Return (sent, rejected): lists of (Queued, ispy2_tbl_id) and (Queued, error message).
+
+    Commits after every batch_size inserts.  A connection error rolls back the
+    current batch and is raised; the batch stays pending, as it does for an
+    error from the commit.  Any other error rolls back the batch and rejects
+    the write that caused it; the rest of the batch is sent again.
+    """
+    sent = []
+    rejected = []
+    while True:
+        batch = journal.pending(batch_size)
+        if not batch:
+            return sent, rejected
+        done = []
+        try:
+            for q in batch:
+                done.append((q, backend.insert_exam(q.vals, q.discrep, q.loaded)))
+            q = None  # no single write to blame if the commit fails
+            backend.commit()
+        except Exception as e:  # noqa: BLE001 pyodbc raises several unrelated classes
+            try:
+                backend.rollback()
+            except Exception:  # noqa: BLE001 the original error is the one to report
+                log.exception("rollback failed")
+            if q is None or backend.is_connection_error(e):
+                raise
+            msg = f"{type(e).__name__}: {e}"
+            log.error(f"Database rejected journal entry {q.seq} from {q.source}: {msg}")
+            journal.reject(q.seq, msg)
+            rejected.append((q, msg))
+            continue
+        journal.mark_sent([(q.seq, ispy2_tbl_id) for q, ispy2_tbl_id in done])
+        sent.extend(done)
@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""The real database: breastdb on SQL Server, through an ODBC data source.
+
+Each call to the server is a timing span; see timing.py.
+"""
+import pyodbc
+
+from ispy2_mri import timing
+from ispy2_mri.db import ARRAYSIZE, Backend, deviation_statements, exams_query, fetch_batches, new_record
+from ispy2_mri.scanparams import DB_COLUMNS
+
+INSERT_ISPY2 = "{call rb_insert_ispy2(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)}"
+UPDATE_ISPY2 = f"UPDATE dbo.ispy2 SET {', '.join(f'{col} = ?' for col in DB_COLUMNS[:-1])} WHERE id = ?"
+INSERT_DEVIATION = "{call insert_ispy2_deviation(?,?)}"
+SELECT_SITES = "{call select_ispy2_sites}"
+SELECT_ISPY2 = "{call select_ispy2(?)}"
+SELECT_DEVIATION = "{call select_ispy2_deviation(?)}"
+SELECT_EXAM_KEYS = "SELECT id, ispy2_id, visit_number, mri_date FROM dbo.ispy2"
+PING = "SELECT 1"
+
+
+class OdbcBackend(Backend):
+    def __init__(self, dsn: str):
+        """Open a connection to the named ODBC data source.
+        Login is passwordless.  autocommit is False, which we want.
+        """
+        self.name = dsn
+        with timing.span("pyodbc.connect", dsn=dsn):
+            self.conn = pyodbc.connect(f"DSN={dsn}")
+        self.curs = self.conn.cursor()
+
+    def select_sites(self) -> list:
+        siteRecs = []
+        with timing.span("select_ispy2_sites") as span:
+            rs = self.curs.execute(SELECT_SITES)
+            r = rs.fetchone()
+            while r:
+                siteRecs.append((r.id, r.site, r.name))
+                r = rs.fetchone()
+            span.add(rows=len(siteRecs))
+        return siteRecs
+
+    def insert_ispy2(self, vals) -> int:
+        vals = new_record(vals)
+        with timing.span("rb_insert_ispy2", ispy2_id=vals[0]):
+            # must use *; otherwise vals is considered a single argument
+            self.curs.execute(INSERT_ISPY2, *vals)
+            self.curs.nextset()  # otherwise get Previous SQL was not a query
+            return self.curs.fetchone().ispy2_tbl_id
+
+    def update_ispy2(self, vals) -> int:
+        vals = tuple(vals)
+        with timing.span("update_ispy2", ispy2_id=vals[0], id=vals[-1]):
+            if self.curs.execute(UPDATE_ISPY2, *vals).rowcount == 0:
+                raise ValueError(f"id={vals[-1]} is not in the database")
+        return vals[-1]
+
+    def insert_deviation(self, ispy2_tbl_id: int, deviation_string: str = "null"):
+        with timing.span("insert_ispy2_deviation", id=ispy2_tbl_id):
+            self.curs.execute(INSERT_DEVIATION, (ispy2_tbl_id, deviation_string))
+
+    def update_deviations(self, ispy2_tbl_id: int, add=(), remove=()):
+        statements = deviation_statements(ispy2_tbl_id, add, remove, "dbo.")
+        if not statements:
+            return
+        # one round trip; NOCOUNT so the row counts don't come back as results
+        sql = "SET NOCOUNT ON;\n" + ";\n".join(s for s, _ in statements)
+        with timing.span("update_ispy2_deviation", id=ispy2_tbl_id, add=len(add), remove=len(remove)):
+            self.curs.execute(sql, [p for _, params in statements for p in params])
+
+    def select_ispy2(self, ispy2_tbl_id: int):
+        with timing.span("select_ispy2", id=ispy2_tbl_id):
+            r = self.curs.execute(SELECT_ISPY2, ispy2_tbl_id).fetchone()
+        if r is None:
+            return None
+        return dict(zip((d[0] for d in self.curs.description), r))
+
+    def select_deviation(self, ispy2_tbl_id: int = None) -> list:
+        with timing.span("select_ispy2_deviation", id=ispy2_tbl_id):
+            return [(int(r.id), r.deviation, r.has_reason)
+                    for r in self.curs.execute(SELECT_DEVIATION, ispy2_tbl_id).fetchall()]
+
+    def select_exam_keys(self) -> list:
+        with timing.span("select_exam_keys"):
+            return [tuple(r) for r in self.curs.execute(SELECT_EXAM_KEYS).fetchall()]
+
+    def select_exams(self, first=None, last=None, site=None, arraysize=ARRAYSIZE) -> tuple:
+        # a cursor of its own, so the query can be read while others run
+        curs = self.conn.cursor()
+        curs.execute(*exams_query("dbo.", first, last, site))
+        return [d[0] for d in curs.description], fetch_batches(curs, arraysize)
+
+    def commit(self):
+        with timing.span("commit"):
+            self.conn.commit()
+
+    def rollback(self):
+        with timing.span("rollback"):
+            self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    def ping(self):
+        with timing.span("ping"):
+            self.curs.execute(PING).fetchone()
+
+    def is_connection_error(self, e: Exception) -> bool:
+        if isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError)):
+            return True
+        # SQLSTATE class 08 is connection exceptions
+        return isinstance(e, pyodbc.Error) and bool(e.args) and str(e.args[0]).startswith("08")
@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Parsed parameter files held ready to load, checked against the disk in the background.
+
+Parameter files often sit on a slow network share.  The worklist reads the
+files it expects to be needed next on a worker thread; loading one then
+needs no file I/O as long as its entry was checked recently.
+An entry is read again if the file's size or modification time changed,
+and dropped once it has gone unchecked for a while.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+import threading
+import time
+
+from ispy2_mri import scanparams
+
+
+@dataclass(slots=True)
+class Entry:
+    path: Path
+    mtime_ns: int
+    size: int
+    params: dict  # {header: value}, or None if the file couldn't be read
+    record: scanparams.ScanParameters  # or None, as for params
+    error: str  # why the file couldn't be read, or None
+    checked: float  # time.monotonic() when last compared with the file
+    sites: object = None  # the site records record was matched against
+
+
+def read_entry(path: Path, siteRecs=()) -> Entry:
+    "read and parse path.  Raises OSError if the file can't be found"
+    st = path.stat()
+    params = record = error = None
+    try:
+        with path.open("rt") as fin:
+            params = scanparams.read_parameters(fin)
+        record = scanparams.ScanParameters.from_text(params, siteRecs)
+    except (OSError, scanparams.UnexpectedInputError) as e:
+        error = str(e)
+    return Entry(path, st.st_mtime_ns, st.st_size, params, record, error, time.monotonic(), siteRecs)
+
+
+class ParseCache:
+    """Entries for parameter files, keyed by path.
+    refresh() does the I/O and is meant for worker threads; the other methods don't touch the disk.
+    """
+
+    def __init__(self, fresh_for=30.0, max_age=600.0):
+        """get() only returns entries checked in the last fresh_for seconds.
+        evict() drops entries not checked in the last max_age seconds.
+        """
+        self.fresh_for = fresh_for
+        self.max_age = max_age
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        "the entry for path if it was checked recently enough to trust, else None"
+        with self._lock:
+            e = self._entries.get(path)
+        if e is not None and time.monotonic() - e.checked <= self.fresh_for:
+            return e
+        return None
+
+    def peek(self, path):
+        "the entry for path, however old, or None"
+        with self._lock:
+            return self._entries.get(path)
+
+    def refresh(self, paths, siteRecs=()) -> list:
+        """Bring the entries for paths up to date with the disk.
+        Return the entries that are new or were read again.
+        Files that have disappeared are dropped.
+        """
+        changed = []
+        for p in paths:
+            with self._lock:
+                old = self._entries.get(p)
+            try:
+                st = p.stat()
+            except OSError:
+                self.discard([p])
+                continue
+            if old is not None and old.mtime_ns == st.st_mtime_ns and old.size == st.st_size:
+                old.checked = time.monotonic()
+                continue
+            try:
+                e = read_entry(p, siteRecs)
+            except OSError:
+                self.discard([p])
+                continue
+            with self._lock:
+                self._entries[p] = e
+            changed.append(e)
+        return changed
+
+    def rematch(self, siteRecs=(), entries=None) -> list:
+        """Parse entries, by default all of them, again without reading the files,
+        if they were matched against other site records than siteRecs.
+        Return the entries that were parsed again.
+        """
+        if entries is None:
+            with self._lock:
+                entries = list(self._entries.values())
+        entries = [e for e in entries if e.params is not None and e.sites is not siteRecs]
+        for e in entries:
+            e.record = scanparams.ScanParameters.from_text(e.params, siteRecs)
+            e.sites = siteRecs
+        return entries
+
+    def discard(self, paths):
+        with self._lock:
+            for p in paths:
+                self._entries.pop(p, None)
+
+    def evict(self):
+        "drop entries that have not been checked for max_age seconds"
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            for p in [p for p, e in self._entries.items() if e.checked < cutoff]:
+                del self._entries[p]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,305 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Compare an archive of parameter files with the database, and optionally fix it.
+
+    ispy2-mri-reconcile DIR [DIR ...] [--csv DIFFS.csv] [--apply]
+
+Each exam in the files (see consolidated.py) is looked up by ID, visit and
+date in the exams read from the database by one query at the start.  For an
+exam the database has, the values of the fields the file gives (GUIDE, as
+readFile() uses it) are compared with those stored, column by column, and
+any differences reported: typos from entering them by hand, say.  An exam the
+database lacks is reported as new.  With --apply, records that differ are
+updated to the file's values, and new exams are inserted, as ispy2-mri-ingest
+would, committing in batches; values validation.py rejects are not written.
+Only the values an update changes are checked, as older records may break
+rules the web form did not enforce.
+
+Files are parsed by a pool of processes, one per core by default, in chunks.
+Only a few chunks are in flight at a time and results are reported in file
+order as they arrive, so memory does not grow with the size of the archive.
+"""
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+import os
+from pathlib import Path
+import sys
+
+from ispy2_mri import db, sitematch, validation
+from ispy2_mri.consolidated import iter_records
+from ispy2_mri.examindex import exam_key, key_of
+from ispy2_mri.export import exam_rows
+from ispy2_mri.ingest import find_files
+from ispy2_mri.scanparams import DB_COLUMNS, GUIDE, GUIDE_COLUMNS, UnexpectedInputError
+
+# the columns parameter files can set, in the order they are compared
+COMPARED = tuple(dict.fromkeys(col for fld in GUIDE.values() for col in GUIDE_COLUMNS[fld]))
+CHUNK = 50  # files per task for the pool
+
+_sites = ()  # site records for the parsing in this process; see _init()
+
+
+@dataclass(frozen=True)
+class Difference:
+    column: str
+    stored: object  # in the database
+    parsed: object  # from the file
+
+    def __str__(self):
+        return f"{self.column}: {self.stored!r} -> {self.parsed!r}"
+
+
+def _norm(v):
+    "v in a form to compare: None for blanks, dates without times, numbers as float, text casefolded"
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date) or v is None:
+        return v
+    if isinstance(v, (int, float, Decimal)):
+        return float(v)
+    v = str(v).strip()
+    if not v:
+        return None
+    try:
+        # the form sends pe_threshold, an int column, as text, for one
+        return float(v)
+    except ValueError:
+        return v.casefold()
+
+
+def differences(rec, headers, stored: dict) -> list:
+    """Difference for each column set by the headers, those of the parameter file,
+    where rec, the file's ScanParameters, disagrees with stored, {column: value} from the database.
+    Headers whose values couldn't be read are skipped.
+    """
+    unread = {header for header, _ in rec.problems}
+    diffs = []
+    for header in headers:
+        if header in unread:
+            continue
+        for col in GUIDE_COLUMNS[GUIDE[header]]:
+            parsed = getattr(rec, col)
+            if _norm(parsed) != _norm(stored.get(col)):
+                diffs.append(Difference(col, stored.get(col), parsed))
+    return diffs
+
+
+def load_exams(backend, arraysize: int = db.ARRAYSIZE) -> dict:
+    """{exam_key: [(ispy2_tbl_id, values of COMPARED)]} for every exam in the database,
+    from one Backend.select_exams() query.  Only the COMPARED columns are kept.
+    """
+    columns, batches = backend.select_exams(arraysize=arraysize)
+    where = [columns.index(col) for col in COMPARED]
+    ids = columns.index("id")
+    key = [columns.index(col) for col in ("ispy2_id", "visit_number", "mri_date")]
+    exams = {}
+    for row in exam_rows(columns, batches):
+        exams.setdefault(exam_key(*(row[i] for i in key)), []).append(
+            (int(row[ids]), tuple(row[i] for i in where)))
+    return exams
+
+
+def _init(siteRecs, alias_path):
+    "set up site matching in a worker, with the aliases users taught the form"
+    global _sites
+    _sites = sitematch.SiteMatcher(siteRecs, sitematch.AliasTable(alias_path) if alias_path else None)
+
+
+def _parse_chunk(paths) -> list:
+    "[(where, ScanParameters or None, headers, error)] for each exam in the files at paths"
+    results = []
+    for path in paths:
+        try:
+            for r in iter_records(path):
+                try:
+                    results.append((r.where, r.parse(_sites), tuple(r.params), ""))
+                except UnexpectedInputError as e:
+                    results.append((r.where, None, (), str(e)))
+        except OSError as e:
+            results.append((path, None, (), str(e)))
+    return results
+
+
+def parse_files(files, siteRecs, alias_path=None, workers: int = None, chunk: int = CHUNK):
+    """Generate (where, ScanParameters or None, headers, error) for each exam in files, in order.
+    workers is the number of processes, default one per core; 1 parses in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = (files[i:i + chunk] for i in range(0, len(files), chunk))
+    siteRecs = [tuple(r) for r in siteRecs]
+    if workers <= 1:
+        _init(siteRecs, alias_path)
+        for c in chunks:
+            yield from _parse_chunk(c)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init, initargs=(siteRecs, alias_path)) as pool:
+        pending = deque()
+        for c in chunks:
+            pending.append(pool.submit(_parse_chunk, c))
+            # enough to keep every worker busy, without reading ahead of the reporting
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _update(backend, ispy2_tbl_id: int, diffs) -> tuple:
+    "give record ispy2_tbl_id the parsed values of diffs, with update_ispy2().  Return the values written, in order"
+    values = backend.select_ispy2(ispy2_tbl_id)
+    if values is None:
+        raise ValueError(f"id={ispy2_tbl_id} is no longer in the database")
+    for d in diffs:
+        values[d.column] = d.parsed
+    vals = (*(values[col] for col in DB_COLUMNS[:-1]), ispy2_tbl_id)
+    backend.update_ispy2(vals)
+    return vals
+
+
+def reconcile(files, backend, siteRecs, alias_path=None, workers=None, chunk=CHUNK, apply=False, batch_size=20,
+              out=sys.stdout, diffs_out=None) -> dict:
+    """Compare the exams in files with those backend, a db.Backend, has; see the module documentation.
+    diffs_out, if given, is a csv.writer for a row per difference: where, id, column, database, file.
+    Return the number of exams {"same", "different", "new", "ambiguous", "failed", "updated", "inserted"}.
+    """
+    exams = load_exams(backend)
+    counts = dict.fromkeys(("same", "different", "new", "ambiguous", "failed", "updated", "inserted"), 0)
+    pending = []  # (where, what, key, exams[key] before) for writes not yet committed
+
+    def report(tag, where, msg):
+        print(f"{tag:4} {where}: {msg}", file=out)
+
+    def commit():
+        backend.commit()
+        for _, what, _, _ in pending:
+            counts[what] += 1
+        pending.clear()
+
+    def write(where, what, key, fn, compared):
+        """do fn(), a write; what is 'updated' or 'inserted'.  Return its result, or None if it failed.
+        compared(result) gives the values of COMPARED the exam now has
+        """
+        try:
+            result = fn()
+        except Exception as e:  # noqa: BLE001 pyodbc raises several unrelated classes
+            backend.rollback()
+            for p, _, k, before in reversed(pending):
+                report("FAIL", p, "rolled back")
+                counts["failed"] += 1
+                if before is None:
+                    exams.pop(k, None)
+                else:
+                    exams[k] = before
+            pending.clear()
+            report("FAIL", where, f"{type(e).__name__}: {e}")
+            counts["failed"] += 1
+            return None
+        pending.append((where, what, key, exams.get(key)))
+        # so the same exam later in the archive is compared with what was written
+        exams[key] = [compared(result)]
+        if len(pending) >= batch_size:
+            commit()
+        return result
+
+    for where, rec, headers, error in parse_files(files, siteRecs, alias_path, workers, chunk):
+        if rec is None:
+            report("FAIL", where, error)
+            counts["failed"] += 1
+            continue
+        key = key_of(rec.db_values())
+        if key is None:
+            report("FAIL", where, "no I-SPY ID")
+            counts["failed"] += 1
+            continue
+        found = exams.get(key)
+        if not found:
+            counts["new"] += 1
+            report("NEW", where, "not in the database")
+            if apply:
+                if rec.problems:
+                    report("FAIL", where, "not inserted; unrecognized " +
+                           "; ".join(f"{header}: {v}" for header, v in rec.problems))
+                    counts["failed"] += 1
+                    continue
+                invalid = validation.check(dict(zip(DB_COLUMNS, rec.db_values())))
+                if invalid:
+                    report("FAIL", where, "not inserted; " + "; ".join(map(str, invalid)))
+                    counts["failed"] += 1
+                    continue
+                ispy2_tbl_id = write(where, "inserted", key,
+                                     lambda: backend.insert_exam(rec.db_values(), rec.discrep_values(), ()),
+                                     lambda i: (i, tuple(getattr(rec, col) for col in COMPARED)))
+                if ispy2_tbl_id is not None:
+                    report("ADD", where, f"id={ispy2_tbl_id}")
+            continue
+        if len(found) > 1:
+            counts["ambiguous"] += 1
+            report("FAIL", where, "several exams in the database: " + ", ".join(f"id={i}" for i, _ in found))
+            continue
+        [(ispy2_tbl_id, stored)] = found
+        diffs = differences(rec, headers, dict(zip(COMPARED, stored)))
+        if not diffs:
+            counts["same"] += 1
+            continue
+        counts["different"] += 1
+        report("DIFF", where, f"id={ispy2_tbl_id}: " + "; ".join(map(str, diffs)))
+        if diffs_out is not None:
+            diffs_out.writerows((str(where), ispy2_tbl_id, d.column, d.stored, d.parsed) for d in diffs)
+        if apply:
+            invalid = validation.check(dict(zip(COMPARED, stored), **{d.column: d.parsed for d in diffs}),
+                                       validation.rules_for(d.column for d in diffs))
+            if invalid:
+                report("FAIL", where, "not updated; " + "; ".join(map(str, invalid)))
+                counts["failed"] += 1
+                continue
+            vals = write(where, "updated", key, lambda: _update(backend, ispy2_tbl_id, diffs),
+                         lambda vals: (ispy2_tbl_id, tuple(dict(zip(DB_COLUMNS, vals))[col] for col in COMPARED)))
+            if vals is not None:
+                report("FIX", where, f"id={ispy2_tbl_id}")
+    if pending:
+        commit()
+    return counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="ispy2-mri-reconcile", description=__doc__.splitlines()[0])
+    ap.add_argument("dirs", nargs="+", metavar="DIR", help="directory of parameter files, or a single file")
+    ap.add_argument("--dsn", default=db.DSN,
+                    help="ODBC data source, or sqlite:PATH for a local stand-in (default %(default)s)")
+    ap.add_argument("--pattern", default="*.txt", help="file name pattern (default %(default)s)")
+    ap.add_argument("--recursive", action="store_true", help="also search subdirectories")
+    ap.add_argument("--csv", type=Path, metavar="PATH", help="also write the differences, one per row, to PATH")
+    ap.add_argument("--apply", action="store_true",
+                    help="update records that differ to the files' values, and insert exams the database lacks")
+    ap.add_argument("--batch-size", type=int, default=20, help="commit after this many writes (default %(default)s)")
+    ap.add_argument("--workers", type=int, help="processes parsing files (default one per core)")
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="files per task (default %(default)s)")
+    args = ap.parse_args(argv)
+
+    files = find_files(args.dirs, args.pattern, args.recursive)
+    backend = db.open_backend(args.dsn)
+    fout = None
+    try:
+        diffs_out = None
+        if args.csv:
+            fout = args.csv.open("wt", newline="", encoding="utf-8")
+            diffs_out = csv.writer(fout)
+            diffs_out.writerow(("where", "id", "column", "database", "file"))
+        counts = reconcile(files, backend, backend.select_sites(), sitematch.alias_path(args.dsn), args.workers,
+                           max(1, args.chunk), args.apply, max(1, args.batch_size), diffs_out=diffs_out)
+    finally:
+        if fout is not None:
+            fout.close()
+        backend.close()
+    print(", ".join(f"{n} {what}" for what, n in counts.items() if n or what in ("same", "different", "new")) + ".")
+    return 1 if counts["failed"] or counts["ambiguous"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Exams read back from the database, to correct them in the form.
+
+fetch() reads one record with select_ispy2 and select_ispy2_deviation, as
+ispy2.jsp does.  RecordCache keeps the most recently viewed ones, so moving
+back and forth between records doesn't go back to the server; saving an
+edit must discard() the record it changed.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+
+from ispy2_mri.examindex import exam_key
+
+MAXSIZE = 50  # records kept by a RecordCache
+
+
+@dataclass(frozen=True)
+class StoredExam:
+    "a record of the ispy2 table"
+    id: int  # ispy2_tbl_id
+    values: dict  # {column: value}, as from Backend.select_ispy2()
+    deviations: tuple  # ids of its deviation reasons
+
+    def key(self):
+        "its examindex.exam_key()"
+        return exam_key(self.values.get("ispy2_id"), self.values.get("visit_number"), self.values.get("mri_date"))
+
+    def describe(self) -> str:
+        "e.g., 'id=5: 12341 A3w 2023-10-01'"
+        v = self.values
+        mri_date = v.get("mri_date")
+        return (f"id={self.id}: {(v.get('ispy2_id') or '').strip()} {v.get('visit_number') or '?'}"
+                f" {f'{mri_date:%Y-%m-%d}' if mri_date else 'no date'}")
+
+
+def fetch(backend, ispy2_tbl_id: int):
+    "the StoredExam with ispy2_tbl_id from backend, a db.Backend, or None if there is none"
+    values = backend.select_ispy2(ispy2_tbl_id)
+    if values is None:
+        return None
+    deviations = tuple(int(rid) for rid, _, has_reason in backend.select_deviation(ispy2_tbl_id)
+                       if has_reason is not None)
+    return StoredExam(int(ispy2_tbl_id), values, deviations)
+
+
+class RecordCache:
+    """The maxsize StoredExams used most recently, by id.
+    Methods may be called from any thread.
+    """
+
+    def __init__(self, maxsize: int = MAXSIZE):
+        self.maxsize = maxsize
+        self._exams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ispy2_tbl_id: int):
+        "the cached StoredExam, or None"
+        with self._lock:
+            exam = self._exams.get(ispy2_tbl_id)
+            if exam is not None:
+                self._exams.move_to_end(ispy2_tbl_id)
+            return exam
+
+    def put(self, exam: StoredExam):
+        with self._lock:
+            self._exams[exam.id] = exam
+            self._exams.move_to_end(exam.id)
+            while len(self._exams) > self.maxsize:
+                self._exams.popitem(last=False)
+
+    def discard(self, ispy2_tbl_id: int):
+        "forget the record, e.g., because it has been changed"
+        with self._lock:
+            self._exams.pop(ispy2_tbl_id, None)
+
+    def fetch(self, backend, ispy2_tbl_id: int):
+        "the StoredExam with ispy2_tbl_id, from the cache if it is there, else as fetch() gives it"
+        exam = self.get(ispy2_tbl_id)
+        if exam is None:
+            exam = fetch(backend, ispy2_tbl_id)
+            if exam is not None:
+                self.put(exam)
+        return exam
+
+    def __contains__(self, ispy2_tbl_id) -> bool:
+        return ispy2_tbl_id in self._exams
+
+    def __len__(self) -> int:
+        return len(self._exams)
@@ -0,0 +1,397 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Parsing of scan parameter files, independent of Qt.
+
+The form widgets use the normalizers here for their fromtext() and todb()
+methods, and batch tools use ScanParameters directly without building any
+widgets.
+
+A parameter file has one line per value, e.g.
+    I-SPY ID: 12345
+    FOV: 32.0 x 32.0
+GUIDE maps the headers to form fields.
+A consolidated export holds many such exams, separated by DELIMITER_RE lines;
+consolidated.py reads those.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from operator import attrgetter
+from pathlib import Path
+import re
+
+from ispy2_mri import formspec, sitematch
+
+
+class UnexpectedInputError(Exception):
+    def __init__(self, obj=None):
+        super().__init__(obj)
+
+
+# arguments of rb_insert_ispy2, in order
+DB_COLUMNS = (
+    "ispy2_id",
+    "visit_number",
+    "submitted",
+    "mri_date",
+    "mri_code",
+    "breast",
+    "dce_compliant",
+    "deviation_other_reason",
+    "deviation_late_exam_overdue",
+    "volume_calculation",
+    "site",
+    "tumor_volume_submitted",
+    "auto_timing1_min",
+    "auto_timing1_sec",
+    "auto_timing1_option",
+    "auto_timing2_min",
+    "auto_timing2_sec",
+    "auto_timing2_option",
+    "scan_duration",
+    "pe_threshold",
+    "special_handling",
+    "aegis_issues",
+    "final_processing_location",
+    "final_processing_aegis",
+    "comments",
+    "screen_fail",
+    "report_returned_date",
+    "report_returned_code",
+    "bg_grey_threshold",
+    "injection_rate",
+    "flush_volume",
+    "fov1",
+    "fov2",
+    "moco",
+    "motion_brtool",
+    "report_received_date",
+    "report_received_code",
+    "id",
+)
+
+# keys are line headers in text file, values are names of form fields
+GUIDE = {
+    'I-SPY ID': "ispy2_id",
+    'Date': "mri_date",
+    'Visit ID': "visit_number",
+    'Institution': "site",
+    'Breast': "breast",
+    'Tumor Volume': "tumor_volume_submitted",
+    'Early Post Timing': "auto_timing1",
+    'Late Post Timing': "auto_timing2",
+    'PE Threshold': "pe_threshold",
+    'Scan Duration': "scan_duration",
+    'Gray Threshold': "bg_grey_threshold",
+    'MOCO': "moco",
+    'FOV': "fov",
+}
+
+# the DB_COLUMNS set from each form field in GUIDE
+GUIDE_COLUMNS = {
+    **{fld: (fld,) for fld in GUIDE.values()},
+    "mri_date": ("mri_date", "mri_code"),
+    "auto_timing1": ("auto_timing1_min", "auto_timing1_sec", "auto_timing1_option"),
+    "auto_timing2": ("auto_timing2_min", "auto_timing2_sec", "auto_timing2_option"),
+    "fov": ("fov1", "fov2"),
+}
+
+
+def _options(name: str) -> tuple:
+    "the choices of the form's drop-down for field name, as formtable.py has them, without the blank"
+    return tuple(c for c in formspec.field_named(name).choices if c)
+
+
+VISITS = ("", *_options("visit_number"))
+# BAutoTimingWidget adds 4, which sometimes occurs, to the options of auto timing 2
+TIMING_OPTIONS = {1: _options("auto_timing1"), 2: ("4", *_options("auto_timing2"))}
+
+PARAM_RE = re.compile(r'^\s*(?P<var>[^:]+)\s*:\s*(?P<val>.*\S)\s*$')
+# between exams in a consolidated export; a repeated FIRST_HEADER also starts a new exam
+DELIMITER_RE = re.compile(r'^\s*(?:-{3,}|={3,}|\*{3,}|\f)\s*$')
+FIRST_HEADER = 'I-SPY ID'
+TIMING_RE = re.compile(r"(\d*):(\d+)\s+\((\d)\)")
+FOV_RE = re.compile(r"([0-9.]+)\s+x\s+([0-9.]+)")
+
+
+### Normalizers shared with the widgets
+def strip_pct(v: str) -> str:
+    "remove a trailing %"
+    v = v.strip()
+    if v[-1] == "%":
+        v = v[:-1]
+    return v
+
+
+def parse_lr(v: str):
+    "return 'L' or 'R' for any case of l, r, left or right.  Otherwise None"
+    match v.strip().lower():
+        case 'l' | 'left':
+            return "L"
+        case 'r' | 'right':
+            return "R"
+    return None
+
+
+def parse_yn(v: str) -> bool:
+    "interpret yes/no text.  Raises UnexpectedInputError if it is neither"
+    match v.lower():
+        case 'n' | 'no' | 'none':
+            return False
+        case 'y' | 'yes':
+            return True
+    raise UnexpectedInputError(f"Unrecognized value {v} for checkbox")
+
+
+def yn(b: bool) -> str:
+    "database form of a checkbox"
+    return "Y" if b else "N"
+
+
+def parse_date(txt: str) -> date:
+    """date from text like '10/31/2023 13:45:00'.  Raises ValueError if that fails.
+    This makes a lot of assumptions.  It also loses the time info.
+    """
+    return datetime.strptime(txt.split(sep=" ", maxsplit=1)[0], '%m/%d/%Y').date()
+
+
+def date_code(d) -> str:
+    "code the database expects with a date"
+    return 'mdy' if d else 'uk'
+
+
+def parse_timing(v: str) -> tuple:
+    "split auto timing like '2:30 (2)' into (minutes, seconds, option)"
+    m = TIMING_RE.match(v)
+    if m:
+        return m.groups()
+    raise UnexpectedInputError(v)
+
+
+def parse_fov(v: str) -> tuple:
+    "split FOV like '32.0 x 32.0' into its 2 parts, as text"
+    m = FOV_RE.match(v)
+    if m:
+        return m.group(1), m.group(2)
+    raise UnexpectedInputError(f"{v} value unparseable for FOV")
+
+
+def to_int(txt: str):
+    "integer for database, or None if blank"
+    txt = txt.strip()
+    if len(txt) == 0:
+        return None
+    # weirdly, some of these have fractions
+    return round(float(txt))
+
+
+def to_num(txt: str):
+    "numeric(p, s) for database, or None if blank"
+    txt = txt.strip()
+    if len(txt) == 0:
+        return None
+    return float(txt)
+
+
+def match_site(name: str, siteRecs):
+    """return the site record, (internal_id, site_id, site_name), for name.  None if no confident match.
+    siteRecs may be a list of site records or a sitematch.SiteMatcher; see sitematch.py.
+    """
+    return sitematch.matcher(siteRecs).match(name)
+
+
+def discrep_string(ids) -> str:
+    """ids of deviation reasons in the format insert_ispy2_deviation expects.
+    The empty string would cause a syntax error on server side, so no ids gives 'null'.
+    """
+    r = ", ".join(str(i) for i in ids)
+    return r if r else "null"
+
+
+SEVERAL_EXAMS = "File holds several exams; enter it with ispy2-mri-ingest"
+
+
+def read_parameters(lines) -> dict:
+    """Return {header: value} from lines of a parameter file.
+    lines may be an open file.
+    Raises UnexpectedInputError for lines or headers we can't handle,
+    and for a consolidated export of several exams.
+    """
+    r = {}
+    for line in lines:
+        m = PARAM_RE.match(line)
+        if m:
+            header = m.group('var')
+            if header not in GUIDE:
+                raise UnexpectedInputError(f"Unknown parameter {header}")
+            if header == FIRST_HEADER and header in r:
+                raise UnexpectedInputError(SEVERAL_EXAMS)
+            r[header] = m.group('val')
+        elif DELIMITER_RE.match(line):
+            raise UnexpectedInputError(SEVERAL_EXAMS)
+        elif line.strip():
+            raise UnexpectedInputError(f"Can't handle mystery line: {line.strip()}")
+    return r
+
+
+@dataclass(slots=True)
+class ScanParameters:
+    """Values for one exam, in database form.
+
+    The defaults are what a cleared form sends: combo boxes and line edits give "",
+    unchecked boxes "N", and empty numbers and dates None.
+    """
+    ispy2_id: str = ""
+    visit_number: str = ""
+    submitted: str = ""
+    mri_date: date = None
+    mri_code: str = "uk"
+    breast: str = ""
+    dce_compliant: str = ""
+    deviation_other_reason: str = None  # not on form
+    deviation_late_exam_overdue: int = None
+    volume_calculation: str = ""
+    site: int = None
+    tumor_volume_submitted: str = ""
+    auto_timing1_min: str = ""
+    auto_timing1_sec: str = ""
+    auto_timing1_option: str = ""
+    auto_timing2_min: str = ""
+    auto_timing2_sec: str = ""
+    auto_timing2_option: str = ""
+    scan_duration: float = None
+    pe_threshold: str = ""  # int in the database, but the form sends text
+    special_handling: str = None  # not on form
+    aegis_issues: str = None  # not on form
+    final_processing_location: str = ""
+    final_processing_aegis: str = ""
+    comments: str = ""
+    screen_fail: str = "N"
+    report_returned_date: date = None
+    report_returned_code: str = "uk"
+    bg_grey_threshold: str = ""
+    injection_rate: str = "N"
+    flush_volume: str = "N"
+    fov1: int = None
+    fov2: int = None
+    moco: str = "N"
+    motion_brtool: str = "N"
+    report_received_date: date = None
+    report_received_code: str = "uk"
+    id: int = None  # output of rb_insert_ispy2
+    deviations: tuple = ()  # ids of deviation reasons
+    problems: list = field(default_factory=list)  # (header, value) that could not be used
+
+    def db_values(self) -> tuple:
+        "values in the order rb_insert_ispy2 expects"
+        return _db_getter(self)
+
+    def discrep_values(self) -> str:
+        "deviations in the format insert_ispy2_deviation expects"
+        return discrep_string(self.deviations)
+
+    def set_text(self, header: str, v: str, siteRecs=()):
+        """Set the value(s) for a header of the parameter file from its text v.
+        A value that can't be interpreted is added to problems, and left as it was.
+        """
+        try:
+            fld = GUIDE[header]
+            if fld == "site":
+                # the only one that needs the sites
+                _site(self, v, siteRecs)
+            else:
+                _CONVERTERS[fld](self, v)
+        except (UnexpectedInputError, ValueError):
+            self.problems.append((header, v))
+
+    @classmethod
+    def from_text(cls, params: dict, siteRecs=()):
+        "new record from {header: value}, e.g., from read_parameters()"
+        rec = cls()
+        for header, v in params.items():
+            rec.set_text(header, v, siteRecs)
+        return rec
+
+
+_db_getter = attrgetter(*DB_COLUMNS)
+
+
+def parse_file(path: Path, siteRecs=()) -> ScanParameters:
+    "read a parameter file into a new ScanParameters"
+    with Path(path).open("rt") as fin:
+        return ScanParameters.from_text(read_parameters(fin), siteRecs)
+
+
+### Converters from file text to record.  Keys are form field names; site is done by _site().
+def _text(col, clean=str):
+    def convert(rec, v):
+        setattr(rec, col, clean(v))
+    return convert
+
+
+def _timing(seq: int):
+    def convert(rec, v):
+        mins, secs, option = parse_timing(v)
+        setattr(rec, f"auto_timing{seq}_min", mins)
+        setattr(rec, f"auto_timing{seq}_sec", secs)
+        if option not in TIMING_OPTIONS[seq]:
+            raise UnexpectedInputError(option)
+        setattr(rec, f"auto_timing{seq}_option", option)
+    return convert
+
+
+def _visit(rec, v):
+    if v not in VISITS:
+        raise UnexpectedInputError(v)
+    rec.visit_number = v
+
+
+def _mri_date(rec, v):
+    rec.mri_date = parse_date(v)
+    rec.mri_code = date_code(rec.mri_date)
+
+
+def _site(rec, v, siteRecs):
+    r = match_site(v, siteRecs)
+    if r is None:
+        raise UnexpectedInputError(v)
+    rec.site = r[1]
+
+
+def _breast(rec, v):
+    lr = parse_lr(v)
+    if lr is None:
+        raise UnexpectedInputError(v)
+    # database is lower case
+    rec.breast = lr.lower()
+
+
+def _moco(rec, v):
+    rec.moco = yn(parse_yn(v))
+
+
+def _fov(rec, v):
+    fov1, fov2 = parse_fov(v)
+    rec.fov1 = to_int(fov1)
+    rec.fov2 = to_int(fov2)
+
+
+def _scan_duration(rec, v):
+    rec.scan_duration = to_num(v)
+
+
+_CONVERTERS = {
+    "ispy2_id": _text("ispy2_id"),
+    "mri_date": _mri_date,
+    "visit_number": _visit,
+    "breast": _breast,
+    "tumor_volume_submitted": _text("tumor_volume_submitted"),
+    "auto_timing1": _timing(1),
+    "auto_timing2": _timing(2),
+    "pe_threshold": _text("pe_threshold", strip_pct),
+    "scan_duration": _scan_duration,
+    "bg_grey_threshold": _text("bg_grey_threshold", strip_pct),
+    "moco": _moco,
+    "fov": _fov,
+}
@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Local copy of the site list, so the form can start without waiting for the database.
+
+The list rarely changes.  The form builds the site drop-down from this cache
+and refreshes the cache from the database in the background.
+"""
+from datetime import datetime, timezone
+import json
+import logging
+
+from ispy2_mri.appdata import app_dir, safe_name
+
+log = logging.getLogger(__name__)
+
+
+def cache_path(dsn: str):
+    "file holding the cached sites for data source dsn"
+    return app_dir() / f"sites-{safe_name(dsn)}.json"
+
+
+def normalize(siteRecs) -> list:
+    """Return site records as a list of (internal_id, site_id, site_name) with integer ids.
+    The database may give the ids as Decimal, which JSON can't hold.
+    """
+    return [(int(r[0]), int(r[1]), r[2]) for r in siteRecs]
+
+
+def load(dsn: str) -> tuple:
+    """Return (siteRecs, time saved) from the cache.
+    Return ([], None) if there is no usable cache.
+    """
+    try:
+        with cache_path(dsn).open("rt", encoding="utf-8") as fin:
+            d = json.load(fin)
+        return [tuple(r) for r in d["sites"]], datetime.fromisoformat(d["saved"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.info(f"No usable site cache for {dsn}: {e}")
+        return [], None
+
+
+def save(dsn: str, siteRecs):
+    "write siteRecs to the cache, with the current time"
+    p = cache_path(dsn)
+    tmp = p.with_suffix(".tmp")
+    with tmp.open("wt", encoding="utf-8") as fout:
+        json.dump({"saved": datetime.now(timezone.utc).isoformat(), "sites": normalize(siteRecs)}, fout)
+    # replace in one step, so a reader never sees a partial file
+    tmp.replace(p)
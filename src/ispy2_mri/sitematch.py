@@ -0,0 +1,255 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Matching the Institution of a parameter file to a site in the database.
+
+The names in the files rarely match the database exactly: "UCSF Medical
+Center" for "UCSF", "Georgetown" for "Georgetown University", or a typo.
+SiteMatcher normalizes names to tokens (case, accents, punctuation,
+common abbreviations and small words) and scores the sites sharing
+trigrams with a name through an inverted index, so a lookup costs a few
+dictionary operations rather than a pass over every site.  Trigrams most
+sites have, like those of "Medical Center", would bring in every site, so
+candidates are found by the rarer ones only.
+
+A name is only matched when it is
+    an alias the user taught us (see AliasTable),
+    equal to a site's name after normalization,
+    the acronym of exactly one site's name, or
+    similar enough to one site (score at least THRESHOLD) and clearly
+    better than the next (by MARGIN).
+Otherwise the user picks from the list, and the form remembers the choice
+as an alias for next time.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+import heapq
+from itertools import chain
+import json
+import logging
+import re
+import threading
+import unicodedata
+
+from ispy2_mri.appdata import app_dir, safe_name
+
+log = logging.getLogger(__name__)
+
+THRESHOLD = 0.75  # minimum score of a fuzzy match
+MARGIN = 0.05  # by which the best fuzzy match must beat the next
+# a trigram in more than COMMON_SHARE of the sites, and more than COMMON_MIN, doesn't find candidates
+COMMON_SHARE = 0.1
+COMMON_MIN = 50
+
+ABBREVIATIONS = {
+    "univ": "university",
+    "ctr": "center",
+    "cntr": "center",
+    "centre": "center",
+    "hosp": "hospital",
+    "med": "medical",
+    "inst": "institute",
+    "natl": "national",
+    "st": "saint",
+    "mt": "mount",
+}
+STOPWORDS = {"the", "of", "at", "and", "for", "in"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokens(name: str) -> tuple:
+    "the words of name, normalized for comparison"
+    s = unicodedata.normalize("NFKD", name or "")
+    s = "".join(c for c in s if not unicodedata.combining(c)).casefold()
+    return tuple(t for t in (ABBREVIATIONS.get(t, t) for t in _TOKEN_RE.findall(s)) if t not in STOPWORDS)
+
+
+def normalize(name: str) -> str:
+    "name as compared, and as aliases are stored"
+    return " ".join(tokens(name))
+
+
+def trigrams(norm: str) -> frozenset:
+    "three letter pieces of a normalized name, padded so short words still have some"
+    s = f"  {norm} "
+    return frozenset(s[i:i + 3] for i in range(len(s) - 2))
+
+
+@dataclass(frozen=True)
+class Match:
+    rec: tuple  # (internal_id, site_id, site_name)
+    score: float  # 1 for alias and exact matches
+    how: str  # alias, exact, acronym or fuzzy
+
+
+class SiteMatcher:
+    """Index of site records, (internal_id, site_id, site_name), for matching names.
+    Iterates, and has len(), like the list of records it was made from,
+    so it can go wherever site records are expected.
+    """
+
+    def __init__(self, siteRecs, aliases=None):
+        "aliases, if given, is an AliasTable"
+        self._recs = [tuple(r) for r in siteRecs]
+        self.aliases = aliases
+        self._bySite = {}  # site_id -> rec
+        self._exact = {}  # normalized name -> rec
+        self._acronyms = {}  # acronym -> [rec]
+        self._grams = {}  # trigram -> [index into _recs], for all but the common trigrams
+        self._common = {}  # trigram -> [index into _recs], for the common ones
+        self._commonOf = []  # set of the common trigrams, by index
+        self._sizes = []  # number of trigrams, by index
+        self._tokens = []  # set of tokens, by index
+        for i, r in enumerate(self._recs):
+            self._bySite.setdefault(r[1], r)
+            t = tokens(r[2])
+            norm = " ".join(t)
+            self._exact.setdefault(norm, r)
+            if len(t) > 1:
+                self._acronyms.setdefault("".join(w[0] for w in t), []).append(r)
+            g = trigrams(norm)
+            for gram in g:
+                self._grams.setdefault(gram, []).append(i)
+            self._sizes.append(len(g))
+            self._tokens.append(set(t))
+        limit = max(COMMON_MIN, COMMON_SHARE * len(self._recs))
+        for gram in [gram for gram, postings in self._grams.items() if len(postings) > limit]:
+            self._common[gram] = self._grams.pop(gram)
+        self._commonOf = [set() for _ in self._recs]
+        for gram, postings in self._common.items():
+            for i in postings:
+                self._commonOf[i].add(gram)
+
+    def __iter__(self):
+        return iter(self._recs)
+
+    def __len__(self):
+        return len(self._recs)
+
+    def __getitem__(self, i):
+        return self._recs[i]
+
+    def candidates(self, name: str, n: int = 3) -> list:
+        "the n best Matches for name, best first, without regard to THRESHOLD"
+        norm = normalize(name)
+        if not norm:
+            return []
+        if self.aliases is not None:
+            r = self._bySite.get(self.aliases.get(norm))
+            if r is not None:
+                return [Match(r, 1.0, "alias")]
+        r = self._exact.get(norm)
+        if r is not None:
+            return [Match(r, 1.0, "exact")]
+        matches = []
+        acronym = self._acronyms.get(norm)
+        if acronym is not None and len(acronym) == 1:
+            matches.append(Match(acronym[0], 0.9, "acronym"))
+        q = trigrams(norm)
+        common = {gram for gram in q if gram in self._common}
+        grams = self._common if common == q else self._grams
+        # Counter counts an iterable in C
+        shared = Counter(chain.from_iterable(grams.get(gram, ()) for gram in q))
+        qt = set(norm.split())
+        scores = []
+        for i, k in shared.items():
+            if grams is self._grams:
+                # the common trigrams the site shares count too
+                k += len(common & self._commonOf[i])
+            dice = 2 * k / (len(q) + self._sizes[i])
+            overlap = len(qt & self._tokens[i]) / min(len(qt), len(self._tokens[i]))
+            # a name that is part of another, e.g., Georgetown, does well on overlap
+            scores.append((max(dice, (dice + overlap) / 2), i))
+        for score, i in heapq.nlargest(n + 1, scores):
+            matches.append(Match(self._recs[i], round(score, 3), "fuzzy"))
+        best = []
+        # an acronym match may also be a fuzzy one
+        for m in heapq.nlargest(n + 1, matches, key=lambda m: m.score):
+            if all(m.rec != b.rec for b in best):
+                best.append(m)
+        return best[:n]
+
+    def best(self, name: str):
+        """the Match for name, if it is good enough to select without asking, else None.
+        See the module documentation.
+        """
+        c = self.candidates(name, 2)
+        if not c or c[0].score < THRESHOLD:
+            return None
+        if c[0].how == "fuzzy" and len(c) > 1 and c[0].score - c[1].score < MARGIN:
+            return None
+        return c[0]
+
+    def match(self, name: str):
+        "the site record for name, as for best(), or None"
+        m = self.best(name)
+        return m.rec if m else None
+
+
+@lru_cache(maxsize=8)
+def _matcher(recs: tuple) -> SiteMatcher:
+    return SiteMatcher(recs)
+
+
+def matcher(siteRecs) -> SiteMatcher:
+    """a SiteMatcher for siteRecs, which may already be one.
+    Matchers for plain lists are reused while the list is unchanged.
+    """
+    if isinstance(siteRecs, SiteMatcher):
+        return siteRecs
+    return _matcher(tuple(tuple(r) for r in siteRecs))
+
+
+def alias_path(dsn: str):
+    "file holding the site aliases for data source dsn"
+    return app_dir() / f"site-aliases-{safe_name(dsn)}.json"
+
+
+class AliasTable:
+    """{normalized name: site_id} learned from the sites users picked for names that didn't match.
+    Saved to path, if given, as each is learned.  Methods may be called from any thread.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._aliases = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with path.open("rt", encoding="utf-8") as fin:
+                    self._aliases = {k: int(v) for k, v in json.load(fin)["aliases"].items()}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                log.warning(f"Ignoring unusable site aliases in {path}: {e}")
+
+    def get(self, norm: str):
+        "the site_id for normalized name norm, or None"
+        return self._aliases.get(norm)
+
+    def learn(self, name: str, site_id: int):
+        "from now on, name means site site_id"
+        norm = normalize(name)
+        if not norm:
+            return
+        with self._lock:
+            if self._aliases.get(norm) == site_id:
+                return
+            self._aliases[norm] = int(site_id)
+            aliases = dict(self._aliases)
+        log.info(f"Site alias {norm!r} -> {site_id}")
+        if self.path is None:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            with tmp.open("wt", encoding="utf-8") as fout:
+                json.dump({"aliases": aliases}, fout, indent=1, sort_keys=True)
+            tmp.replace(self.path)
+        except OSError as e:
+            log.warning(f"Could not save site aliases to {self.path}: {e}")
+
+    def __len__(self):
+        return len(self._aliases)
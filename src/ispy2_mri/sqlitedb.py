@@ -0,0 +1,202 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""A local SQLite file standing in for breastdb, for work without the SQL Server.
+
+The tables hold what the stored procedures need, and the methods follow
+the procedures as described in Notes.md, including their quirks:
+insert_ispy2_deviation first deletes the record's reasons that are not in
+the string, then adds those that are missing, and 'null' changes nothing
+(the server's DELETE ... NOT IN (null) matches no rows).
+
+rb_insert_ispy2 itself is not documented, and only ever called with a null
+id (the last argument), to insert; so it is here.  Edits are a plain UPDATE,
+as in odbc.py.
+
+The sites and deviation reasons are not created for you; see add_site()
+and add_deviation_reason().
+"""
+from datetime import date, datetime
+import sqlite3
+
+from ispy2_mri.db import (ARRAYSIZE, Backend, deviation_statements, exams_query, fetch_batches, new_record,
+                          parse_deviation_string)
+from ispy2_mri.scanparams import DB_COLUMNS
+
+# rb_insert_ispy2 arguments, less the final id, with types as declared in the procedure
+ISPY2_COLUMNS = {
+    "ispy2_id": "TEXT",
+    "visit_number": "TEXT",
+    "submitted": "TEXT",
+    "mri_date": "TEXT",
+    "mri_code": "TEXT",
+    "breast": "TEXT",
+    "dce_compliant": "TEXT",
+    "deviation_other_reason": "TEXT",
+    "deviation_late_exam_overdue": "INTEGER",
+    "volume_calculation": "TEXT",
+    "site": "INTEGER",
+    "tumor_volume_submitted": "TEXT",
+    "auto_timing1_min": "TEXT",
+    "auto_timing1_sec": "TEXT",
+    "auto_timing1_option": "TEXT",
+    "auto_timing2_min": "TEXT",
+    "auto_timing2_sec": "TEXT",
+    "auto_timing2_option": "TEXT",
+    "scan_duration": "REAL",
+    "pe_threshold": "INTEGER",
+    "special_handling": "TEXT",
+    "aegis_issues": "TEXT",
+    "final_processing_location": "TEXT",
+    "final_processing_aegis": "TEXT",
+    "comments": "TEXT",
+    "screen_fail": "TEXT",
+    "report_returned_date": "TEXT",
+    "report_returned_code": "TEXT",
+    "bg_grey_threshold": "TEXT",
+    "injection_rate": "TEXT",
+    "flush_volume": "TEXT",
+    "fov1": "INTEGER",
+    "fov2": "INTEGER",
+    "moco": "TEXT",
+    "motion_brtool": "TEXT",
+    "report_received_date": "TEXT",
+    "report_received_code": "TEXT",
+}
+DATE_COLUMNS = ("mri_date", "report_returned_date", "report_received_date")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS ispy2_site (
+    id INTEGER PRIMARY KEY,
+    site INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ispy2 (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {", ".join(f"{col} {ISPY2_COLUMNS[col]}" for col in DB_COLUMNS[:-1])}
+);
+CREATE TABLE IF NOT EXISTS ispy2_deviation_reason (
+    id INTEGER PRIMARY KEY,
+    deviation TEXT NOT NULL,
+    archive TEXT,
+    position INTEGER
+);
+CREATE TABLE IF NOT EXISTS ispy2_deviation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ispy2_tbl_id INTEGER NOT NULL,
+    ispy2_deviation_reason_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ispy2_deviation_tbl ON ispy2_deviation (ispy2_tbl_id);
+"""
+
+_INSERT = f"INSERT INTO ispy2 ({', '.join(DB_COLUMNS[:-1])}) VALUES ({', '.join('?' * (len(DB_COLUMNS) - 1))})"
+_UPDATE = f"UPDATE ispy2 SET {', '.join(f'{col} = ?' for col in DB_COLUMNS[:-1])} WHERE id = ?"
+
+
+def _to_db(v):
+    "the server takes dates for datetime2 columns; store them as ISO text"
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+
+class SQLiteBackend(Backend):
+    def __init__(self, path):
+        "open, or create, the SQLite database at path.  ':memory:' works too"
+        self.name = f"sqlite:{path}"
+        # the form opens the connection on one worker thread and uses it on others, one at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def add_site(self, site: int, name: str) -> int:
+        "add a site, with its site id and name.  Return its internal id"
+        return self.conn.execute("INSERT INTO ispy2_site (site, name) VALUES (?, ?)", (site, name)).lastrowid
+
+    def add_deviation_reason(self, deviation: str, position: int = None, id: int = None) -> int:
+        "add a deviation reason.  Return its id"
+        return self.conn.execute("INSERT INTO ispy2_deviation_reason (id, deviation, position) VALUES (?, ?, ?)",
+                                 (id, deviation, position)).lastrowid
+
+    def select_sites(self) -> list:
+        return self.conn.execute("SELECT id, site, name FROM ispy2_site ORDER BY name").fetchall()
+
+    def insert_ispy2(self, vals) -> int:
+        return self.conn.execute(_INSERT, [_to_db(v) for v in new_record(vals)[:-1]]).lastrowid
+
+    def update_ispy2(self, vals) -> int:
+        vals = [_to_db(v) for v in vals]
+        if self.conn.execute(_UPDATE, vals).rowcount == 0:
+            raise ValueError(f"id={vals[-1]} is not in the database")
+        return vals[-1]
+
+    def insert_deviation(self, ispy2_tbl_id: int, deviation_string: str = "null"):
+        ids = parse_deviation_string(deviation_string)
+        if ids is None:
+            return
+        self.conn.execute(
+            f"DELETE FROM ispy2_deviation WHERE ispy2_deviation_reason_id NOT IN ({', '.join('?' * len(ids))})"
+            " AND ispy2_tbl_id = ?", (*ids, ispy2_tbl_id))
+        for rid in ids:
+            if self.conn.execute("SELECT 1 FROM ispy2_deviation WHERE ispy2_tbl_id = ? AND ispy2_deviation_reason_id = ?",
+                                 (ispy2_tbl_id, rid)).fetchone() is None:
+                self.conn.execute("INSERT INTO ispy2_deviation (ispy2_tbl_id, ispy2_deviation_reason_id) VALUES (?, ?)",
+                                  (ispy2_tbl_id, rid))
+
+    def update_deviations(self, ispy2_tbl_id: int, add=(), remove=()):
+        # nothing to gain from one batch without a network; sqlite3 runs one statement at a time anyway
+        for sql, params in deviation_statements(ispy2_tbl_id, add, remove):
+            self.conn.execute(sql, params)
+
+    def select_ispy2(self, ispy2_tbl_id: int):
+        curs = self.conn.execute("SELECT * FROM ispy2 WHERE id = ?", (ispy2_tbl_id,))
+        r = curs.fetchone()
+        if r is None:
+            return None
+        r = dict(zip((d[0] for d in curs.description), r))
+        # datetime2 columns come back from the server as datetime
+        for col in DATE_COLUMNS:
+            if r[col] is not None:
+                r[col] = datetime.fromisoformat(r[col])
+        return r
+
+    def select_deviation(self, ispy2_tbl_id: int = None) -> list:
+        return self.conn.execute(
+            """SELECT dr.id, dr.deviation, d.ispy2_deviation_reason_id
+            FROM ispy2_deviation_reason AS dr
+                LEFT OUTER JOIN ispy2_deviation AS d
+                ON dr.id = d.ispy2_deviation_reason_id AND d.ispy2_tbl_id = ?
+            ORDER BY dr.position ASC""", (ispy2_tbl_id,)).fetchall()
+
+    def select_exam_keys(self) -> list:
+        return self.conn.execute("SELECT id, ispy2_id, visit_number, mri_date FROM ispy2").fetchall()
+
+    def select_exams(self, first=None, last=None, site=None, arraysize=ARRAYSIZE) -> tuple:
+        sql, params = exams_query("", first, last, site)
+        curs = self.conn.execute(sql, [_to_db(v) for v in params])
+        columns = [d[0] for d in curs.description]
+        dates = [columns.index(col) for col in DATE_COLUMNS]
+
+        def batches():
+            # as the server returns them; see select_ispy2()
+            for rows in fetch_batches(curs, arraysize):
+                for k, r in enumerate(rows):
+                    r = list(r)
+                    for i in dates:
+                        if r[i] is not None:
+                            r[i] = datetime.fromisoformat(r[i])
+                    rows[k] = tuple(r)
+                yield rows
+        return columns, batches()
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    def ping(self):
+        self.conn.execute("SELECT 1").fetchone()
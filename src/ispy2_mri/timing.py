@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Timing of the slow operations, written as a JSONL log.
+
+    with timing.span("insert_ispy2", ispy2_id="12341"):
+        ...
+
+Spans are off unless enable() has been called, e.g., by ispy2-mri --timing,
+or the environment variable ISPY2_MRI_TIMING names the log file.  While off,
+span() is one test and returns a shared context manager that does nothing.
+
+Each line of the log is one span:
+    {"span": "commit", "start": 1700000000.123, "ms": 12.345, "thread": "MainThread", "ok": true}
+start is seconds since the epoch, ok is false if the block raised, and any
+keyword arguments of span() are added.  The spans around database calls
+(see odbc.py) show whether a slow save was the network or the server.
+"""
+import json
+import os
+import threading
+import time
+
+from ispy2_mri.appdata import app_dir
+
+_fout = None  # the open log, while enabled
+_lock = threading.Lock()
+
+
+def default_path():
+    return app_dir() / "timing.jsonl"
+
+
+def enable(path=None):
+    "append spans to the log at path, default default_path()"
+    global _fout
+    disable()
+    _fout = open(path or default_path(), "at", encoding="utf-8")  # noqa: SIM115 closed by disable()
+
+
+def disable():
+    global _fout
+    with _lock:
+        fout, _fout = _fout, None
+    if fout is not None:
+        fout.close()
+
+
+def enabled() -> bool:
+    return _fout is not None
+
+
+def _write(record: dict):
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        if _fout is not None:
+            _fout.write(line)
+            # so the spans before a crash, or a hang, are there to read
+            _fout.flush()
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "start", "t0")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def add(self, **attrs):
+        "more to log with the span, e.g., the number of rows"
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self.t0) * 1000
+        _write({"span": self.name, "start": round(self.start, 3), "ms": round(ms, 3),
+                "thread": threading.current_thread().name, "ok": exc_type is None, **self.attrs})
+        return False
+
+
+class _Off:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def add(self, **attrs):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_OFF = _Off()
+
+
+def span(name: str, **attrs):
+    "context manager timing its block as name; see the module documentation"
+    if _fout is None:
+        return _OFF
+    return _Span(name, attrs)
+
+
+if os.environ.get("ISPY2_MRI_TIMING"):
+    enable(os.environ["ISPY2_MRI_TIMING"])
@@ -0,0 +1,371 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Checking exam values against what the ispy2 table will take.
+
+RULES is the table of checks, one or more per column, from the declaration
+of rb_insert_ispy2 (see BreastForm.write()): the lengths of the varchar and
+char columns, int and numeric(5, 2) values, the ranges we have seen for
+pe_threshold and the fields of view, and the date codes this tool writes.
+A blank value, None or "", passes them all.
+
+check() checks one exam, e.g., the form's, in plain Python.
+check_columns() and check_rows() check many at once, each rule working on
+a whole column as a NumPy array, and return a Report of the problems by
+field.  They need numpy, e.g., pip install ispy2-mri[validate].
+
+    ispy2-mri-validate [--from DATE] [--to DATE] [--site SITE]
+
+checks the exams already in the database.
+"""
+import argparse
+from dataclasses import dataclass
+from datetime import date
+import math
+import sys
+import time
+
+from ispy2_mri import db, sitematch
+from ispy2_mri.export import parse_site
+from ispy2_mri.scanparams import DB_COLUMNS
+
+INT_MIN = -2**31
+INT_MAX = 2**31 - 1
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        msg = "Checking many exams at once needs numpy; pip install ispy2-mri[validate]"
+        raise ImportError(msg) from e
+    return numpy
+
+
+def _blank(v) -> bool:
+    return v is None or v == ""
+
+
+def _number(v):
+    "v as a float, or None if it isn't a number"
+    try:
+        x = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(x) else x
+
+
+def _blank_array(np, a):
+    return (a == None) | (a == "")  # noqa: E711 elementwise
+
+
+def _number_array(np, a, blank):
+    "(float array of a, with nan for blanks and non-numbers; mask of the non-numbers)"
+    x = np.full(len(a), np.nan)
+    filled = ~blank
+    try:
+        x[filled] = a[filled].astype(float)
+    except (TypeError, ValueError):
+        # some aren't numbers; find out which, one at a time
+        x[filled] = [math.nan if (n := _number(v)) is None else n for v in a[filled]]
+    return x, filled & np.isnan(x)
+
+
+@dataclass(frozen=True)
+class MaxLength:
+    "a varchar(length) or char(length) column"
+    column: str
+    length: int
+
+    def message(self, v) -> str:
+        return f"is {len(str(v))} characters; at most {self.length} fit"
+
+    def bad(self, values: dict) -> bool:
+        v = values.get(self.column)
+        return not _blank(v) and len(str(v)) > self.length
+
+    def bad_array(self, np, columns: dict):
+        a = columns[self.column]
+        lengths = np.fromiter(map(len, map(str, a)), dtype=np.int64, count=len(a))
+        return ~_blank_array(np, a) & (lengths > self.length)
+
+
+@dataclass(frozen=True)
+class IntRange:
+    "an int column, with values from low to high"
+    column: str
+    low: int = INT_MIN
+    high: int = INT_MAX
+
+    def message(self, v) -> str:
+        if (self.low, self.high) == (INT_MIN, INT_MAX):
+            return f"{v!r} is not a whole number"
+        return f"{v!r} is not a whole number from {self.low} to {self.high}"
+
+    def bad(self, values: dict) -> bool:
+        v = values.get(self.column)
+        if _blank(v):
+            return False
+        x = _number(v)
+        return x is None or not x.is_integer() or not self.low <= x <= self.high
+
+    def bad_array(self, np, columns: dict):
+        a = columns[self.column]
+        x, nonnumber = _number_array(np, a, _blank_array(np, a))
+        with np.errstate(invalid="ignore"):
+            return nonnumber | ((np.floor(x) != x) & ~np.isnan(x)) | (x < self.low) | (x > self.high)
+
+
+@dataclass(frozen=True)
+class Numeric:
+    "a numeric(precision, scale) column.  The server rounds extra decimals, so only the size matters"
+    column: str
+    precision: int
+    scale: int
+
+    @property
+    def limit(self) -> float:
+        return 10.0 ** (self.precision - self.scale)
+
+    def message(self, v) -> str:
+        return f"{v!r} is not a number less than {self.limit:g} in size"
+
+    def bad(self, values: dict) -> bool:
+        v = values.get(self.column)
+        if _blank(v):
+            return False
+        x = _number(v)
+        return x is None or abs(round(x, self.scale)) >= self.limit
+
+    def bad_array(self, np, columns: dict):
+        a = columns[self.column]
+        x, nonnumber = _number_array(np, a, _blank_array(np, a))
+        with np.errstate(invalid="ignore"):
+            return nonnumber | (np.abs(np.round(x, self.scale)) >= self.limit)
+
+
+@dataclass(frozen=True)
+class DateCode:
+    """column is the code for date_column.  We write 'mdy' with a date and 'uk' without
+    (scanparams.date_code()), and check only those two; the web form's DateTime.formatDateString()
+    takes other codes too, and we don't know which of them go with a date.
+    """
+    column: str
+    date_column: str
+
+    def message(self, v) -> str:
+        return f"{v!r} doesn't match {self.date_column}; 'mdy' goes with a date, 'uk' without one"
+
+    def bad(self, values: dict) -> bool:
+        code = values.get(self.column)
+        dated = values.get(self.date_column) is not None
+        return (code == "mdy" and not dated) or (code == "uk" and dated)
+
+    def bad_array(self, np, columns: dict):
+        code = columns[self.column]
+        dated = columns[self.date_column] != None  # noqa: E711 elementwise
+        return ((code == "mdy") & ~dated) | ((code == "uk") & dated)
+
+
+RULES = (
+    MaxLength("ispy2_id", 10),
+    MaxLength("visit_number", 10),
+    MaxLength("submitted", 1),
+    DateCode("mri_code", "mri_date"),
+    MaxLength("breast", 1),
+    MaxLength("dce_compliant", 1),
+    MaxLength("deviation_other_reason", 1000),
+    IntRange("deviation_late_exam_overdue"),
+    MaxLength("volume_calculation", 100),
+    IntRange("site"),
+    MaxLength("tumor_volume_submitted", 10),
+    *(MaxLength(f"auto_timing{seq}_{part}", 10) for seq in (1, 2) for part in ("min", "sec", "option")),
+    Numeric("scan_duration", 5, 2),
+    IntRange("pe_threshold", 7, 89),
+    MaxLength("special_handling", 1),
+    MaxLength("aegis_issues", 1),
+    MaxLength("final_processing_location", 50),
+    MaxLength("final_processing_aegis", 50),
+    MaxLength("comments", 1000),
+    MaxLength("screen_fail", 1),
+    DateCode("report_returned_code", "report_returned_date"),
+    MaxLength("bg_grey_threshold", 10),
+    MaxLength("injection_rate", 1),
+    MaxLength("flush_volume", 1),
+    IntRange("fov1", 22, 48),
+    IntRange("fov2", 22, 48),
+    MaxLength("moco", 1),
+    MaxLength("motion_brtool", 1),
+    DateCode("report_received_code", "report_received_date"),
+)
+
+
+@dataclass(frozen=True)
+class Problem:
+    row: int  # position in the batch; 0 for check()
+    column: str
+    value: object
+    message: str
+
+    def __str__(self):
+        return f"{self.column}: {self.message}"
+
+
+def check(values: dict, rules=RULES) -> list:
+    "list of Problem with values, {column: value} for one exam, e.g., dict(zip(DB_COLUMNS, db_values()))"
+    return [Problem(0, rule.column, values.get(rule.column), rule.message(values.get(rule.column)))
+            for rule in rules if rule.bad(values)]
+
+
+def rules_for(columns, rules=RULES) -> list:
+    "the rules that look at any of columns, e.g., to check only the values an update changes"
+    columns = set(columns)
+    return [rule for rule in rules if rule.column in columns or getattr(rule, "date_column", None) in columns]
+
+
+class Report:
+    "the problems found by check_columns()"
+
+    def __init__(self, n: int, failures: list):
+        self.n = n  # exams checked
+        self._failures = failures  # [(rule, array of the rows that fail it)], for rules with any
+
+    def __bool__(self) -> bool:
+        "True if there are problems"
+        return bool(self._failures)
+
+    def counts(self) -> dict:
+        "{column: number of exams with a problem there}"
+        counts = {}
+        for rule, rows in self._failures:
+            counts[rule.column] = counts.get(rule.column, 0) + len(rows)
+        return counts
+
+    def rows(self) -> list:
+        "sorted positions of the exams with any problem"
+        return sorted({int(i) for _, rows in self._failures for i in rows})
+
+    def problems(self, columns: dict):
+        "generate a Problem for each failure, by rule, then row.  columns are those given to check_columns()"
+        for rule, rows in self._failures:
+            values = columns[rule.column]
+            for i in rows:
+                yield Problem(int(i), rule.column, values[i], rule.message(values[i]))
+
+    def summary(self) -> list:
+        "lines for people: the exams checked, and how many failed each rule"
+        lines = [f"{self.n} exams checked, {len(self.rows())} with problems."]
+        for rule, rows in self._failures:
+            lines.append(f"{rule.column}: {len(rows)} ({type(rule).__name__})")
+        return lines
+
+
+def check_columns(columns: dict, rules=RULES) -> Report:
+    """Check many exams at once.  columns is {column: values}, with the same number of values
+    for each column that rules need; the values are converted to NumPy object arrays.
+    """
+    np = _numpy()
+    arrays = {col: np.asarray(v, dtype=object) if not isinstance(v, np.ndarray) else v for col, v in columns.items()}
+    n = len(next(iter(arrays.values()))) if arrays else 0
+    failures = []
+    for rule in rules:
+        rows = np.flatnonzero(rule.bad_array(np, arrays))
+        if len(rows):
+            failures.append((rule, rows))
+    return Report(n, failures)
+
+
+def to_columns(rows, columns=DB_COLUMNS) -> dict:
+    "{column: object array} from rows, tuples with the values of columns, e.g., db_values()"
+    np = _numpy()
+    rows = list(rows)
+    if not rows:
+        return {col: np.empty(0, dtype=object) for col in columns}
+    table = np.empty((len(rows), len(columns)), dtype=object)
+    table[:] = rows
+    return {col: table[:, i] for i, col in enumerate(columns)}
+
+
+def check_rows(rows, columns=DB_COLUMNS, rules=RULES) -> tuple:
+    "(Report, the columns checked): check_columns() of to_columns(rows, columns)"
+    cols = to_columns(rows, columns)
+    return check_columns(cols, rules), cols
+
+
+def validate(backend, first=None, last=None, site=None, arraysize=db.ARRAYSIZE, limit=20, out=sys.stdout) -> dict:
+    """Check the exams in the database, a batch of Backend.select_exams() at a time, and print a report:
+    the counts by field, then up to limit problems for each.
+    first, last and site are as for select_exams().  Return {column: number of exams with a problem there}.
+    """
+    t0 = time.perf_counter()
+    columns, batches = backend.select_exams(first, last, site, arraysize)
+    present = [col for col in DB_COLUMNS if col in columns]
+    rules = [rule for rule in RULES if rule.column in present and getattr(rule, "date_column", rule.column) in present]
+    where = [columns.index(col) for col in present]
+    ids = columns.index("id")
+    n = 0
+    counts = {}
+    shown = {}
+    seen = None
+    for rows in batches:
+        # one row per deviation reason; the exam's own columns are the same in each
+        exams = []
+        for r in rows:
+            if r[ids] != seen:
+                seen = r[ids]
+                exams.append(r)
+        if not exams:
+            continue
+        cols = to_columns(([r[i] for i in where] for r in exams), present)
+        report = check_columns(cols, rules)
+        n += len(exams)
+        for col, k in report.counts().items():
+            counts[col] = counts.get(col, 0) + k
+        for p in report.problems(cols):
+            lines = shown.setdefault(p.column, [])
+            if len(lines) < limit:
+                lines.append(f"  id={exams[p.row][ids]}: {p.message}")
+    elapsed = time.perf_counter() - t0
+    print(f"{n} exams checked in {elapsed:.2f} s.", file=out)
+    if not counts:
+        print("No problems.", file=out)
+    for col, k in counts.items():
+        print(f"{col}: {k}", file=out)
+        for line in shown[col]:
+            print(line, file=out)
+    return counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="ispy2-mri-validate", description="Check the exams in the database")
+    ap.add_argument("--dsn", default=db.DSN,
+                    help="ODBC data source, or sqlite:PATH for a local stand-in (default %(default)s)")
+    ap.add_argument("--from", dest="first", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                    help="earliest MRI date to include")
+    ap.add_argument("--to", dest="last", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                    help="latest MRI date to include")
+    ap.add_argument("--site", help="only this site: its site id or name")
+    ap.add_argument("--limit", type=int, default=20, help="problems to list for each field (default %(default)s)")
+    args = ap.parse_args(argv)
+
+    backend = db.open_backend(args.dsn)
+    try:
+        site = None
+        if args.site:
+            try:
+                site = parse_site(args.site, sitematch.SiteMatcher(
+                    backend.select_sites(), sitematch.AliasTable(sitematch.alias_path(args.dsn))))
+            except ValueError as e:
+                ap.error(str(e))
+        validate(backend, args.first, args.last, site, limit=args.limit)
+    except ImportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        backend.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Run slow calls, mostly to the database, off the GUI thread.
+
+Results and errors come back as Qt signals.  Connect them to methods of
+QObjects that live in the GUI thread, e.g., the form; Qt then queues the
+call so it runs in the GUI thread.  Plain functions and lambdas would
+run in the worker thread instead.
+"""
+import sys
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+
+class WorkerSignals(QObject):
+    "QRunnable is not a QObject, so it can't have signals itself"
+    result = Signal(object)  # return value of the function
+    error = Signal(object)  # (exc_type, exc_value, exc_traceback)
+    finished = Signal()  # after either of the above
+
+
+class Worker(QRunnable):
+    "call fn(*args, **kwargs) in a pool thread and report by signal"
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.done = False
+
+    def run(self):
+        try:
+            r = self.fn(*self.args, **self.kwargs)
+        except Exception:  # noqa: BLE001 all errors are reported to the GUI thread
+            # done first, so a slot may start the next one
+            self.done = True
+            self.signals.error.emit(sys.exc_info())
+        else:
+            self.done = True
+            self.signals.result.emit(r)
+        finally:
+            self.signals.finished.emit()
+
+
+def start(fn, *args, result=None, error=None, finished=None, **kwargs) -> Worker:
+    """Start fn(*args, **kwargs) on the global thread pool.
+    result, error and finished are optional slots for the corresponding signals.
+    Keep a reference to the returned Worker until it finishes, or the signals may be lost.
+    """
+    w = Worker(fn, *args, **kwargs)
+    if result:
+        w.signals.result.connect(result)
+    if error:
+        w.signals.error.connect(error)
+    if finished:
+        w.signals.finished.connect(finished)
+    QThreadPool.globalInstance().start(w)
+    return w
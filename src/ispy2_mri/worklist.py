@@ -0,0 +1,244 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Pane listing the parameter files waiting in an inbox folder.
+
+Sites drop parameter files into a shared folder all day.  The folder is
+watched, with a slow poll as a backstop since change notification is
+unreliable on some network shares.  The folder is listed, and new files
+parsed, in the background; they are listed with their I-SPY ID, date and institution;
+choosing one emits fileChosen with the already parsed contents.
+
+The PREFETCH entries after the one last chosen are checked against the
+disk in the background on every poll, so moving on to the next exam
+normally needs no file I/O in the GUI thread.  An entry that has not
+been checked recently is read on a worker before it is emitted.
+"""
+from pathlib import Path
+
+from PySide6.QtCore import QFileSystemWatcher, QSettings, Qt, QTimer, Signal, Slot
+from PySide6.QtGui import QBrush
+from PySide6.QtWidgets import QFileDialog, QListWidget, QListWidgetItem, QPushButton, QVBoxLayout, QWidget
+
+from ispy2_mri import prefetch, workers
+
+POLL_MS = 30_000  # backstop for missed change notifications
+PREFETCH = 3  # entries after the current one kept ready to load
+
+
+def inbox_setting():
+    "the inbox folder saved from a previous session, or None"
+    d = QSettings("ispy2_mri", "ispy2_mri").value("inbox")
+    return Path(d) if d else None
+
+
+def entry_label(path: Path, params: dict) -> str:
+    "ISPY ID | date | institution, for the list"
+    def get(header):
+        return params.get(header, "?")
+    date = get('Date').split(sep=" ", maxsplit=1)[0]
+    return f"{get('I-SPY ID')} | {date} | {get('Institution')}\n    {path.name}"
+
+
+class Worklist(QWidget):
+    # (path, {header: value}) of the entry the user picked
+    fileChosen = Signal(object, object)
+    # Path of new inbox folder
+    inboxChanged = Signal(object)
+
+    def __init__(self, inbox=None, sites=None, parent=None):
+        """sites, if given, is a function returning the current site records,
+        or a sitematch.SiteMatcher, used to match the Institution of prefetched files.
+        """
+        super().__init__(parent)
+        self.inbox = None
+        self.sites = sites or tuple
+        # entries polled every POLL_MS stay fresh in between
+        self.cache = prefetch.ParseCache(fresh_for=1.5 * POLL_MS / 1000)
+        self._items = {}  # Path -> QListWidgetItem
+        self._done = set()  # Paths saved to the database
+        self._current = None  # Path last chosen
+        self._wanted = None  # (Path, Worker reading it) chosen but not yet emitted
+        self._parsers = []  # workers in progress
+        self._lister = None  # Worker listing the inbox
+        self._rescan = False  # list the inbox again when _lister finishes
+        self.list = QListWidget()
+        self.list.itemClicked.connect(self._activated)
+        self.chooser = QPushButton("Choose inbox...")
+        self.chooser.clicked.connect(self.chooseInbox)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.chooser)
+        layout.addWidget(self.list)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.scan)
+        self.poller = QTimer(self)
+        self.poller.timeout.connect(self.poll)
+        self.poller.start(POLL_MS)
+        if inbox:
+            self.setInbox(inbox)
+
+    def setInbox(self, inbox):
+        "watch folder inbox, replacing any previous one"
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self.inbox = Path(inbox)
+        self.watcher.addPath(str(self.inbox))
+        self.chooser.setText(f"Inbox: {self.inbox}")
+        self.chooser.setToolTip("Click to choose a different inbox folder")
+        self.list.clear()
+        self.cache.discard(list(self._items))
+        self._items.clear()
+        self._done.clear()
+        self._current = self._wanted = None
+        self.scan()
+        self.inboxChanged.emit(self.inbox)
+
+    @Slot()
+    def chooseInbox(self):
+        d = QFileDialog.getExistingDirectory(self, "Inbox for Scan Parameter Files", str(self.inbox or "."))
+        if d:
+            QSettings("ispy2_mri", "ispy2_mri").setValue("inbox", d)
+            self.setInbox(d)
+
+    @Slot()
+    def poll(self):
+        self.scan()
+        self.prefetch()
+        self.cache.evict()
+
+    @Slot()
+    def scan(self):
+        "list the inbox in the background, then add and drop entries in _listed()"
+        if self.inbox is None:
+            return
+        if self._lister is not None:
+            # the listing in progress may have missed the change
+            self._rescan = True
+            return
+        self._lister = workers.start(self._list, self.inbox, result=self._listed, finished=self._listDone)
+
+    @staticmethod
+    def _list(inbox):
+        "Runs on a worker thread.  (inbox, set of its parameter files), or None if it can't be read"
+        try:
+            return inbox, set(inbox.glob("*.txt"))
+        except OSError:
+            # share unavailable; try again on the next poll
+            return inbox, None
+
+    @Slot()
+    def _listDone(self):
+        self._lister = None
+        if self._rescan:
+            self._rescan = False
+            self.scan()
+
+    @Slot(object)
+    def _listed(self, listing):
+        "add entries for new files, and drop those for files that have gone"
+        inbox, present = listing
+        if inbox != self.inbox or present is None:
+            # listed before the inbox was changed, or unavailable
+            return
+        gone = set(self._items) - present
+        for p in gone:
+            self.list.takeItem(self.list.row(self._items.pop(p)))
+        self.cache.discard(gone)
+        self._done -= gone
+        new = sorted(present - set(self._items))
+        if not new:
+            return
+        for p in new:
+            item = QListWidgetItem(f"{p.name} (reading)")
+            item.setData(Qt.UserRole, p)
+            self._items[p] = item
+            self.list.addItem(item)
+        self._read(new)
+
+    def prefetch(self):
+        "check the PREFETCH pending entries after the current one in the background"
+        row = self.list.row(self._items[self._current]) + 1 if self._current in self._items else 0
+        upcoming = []
+        while row < self.list.count() and len(upcoming) < PREFETCH:
+            p = self.list.item(row).data(Qt.UserRole)
+            if p not in self._done:
+                upcoming.append(p)
+            row += 1
+        if upcoming:
+            self._read(upcoming)
+
+    def _read(self, paths):
+        w = workers.start(self._refresh, paths, result=self._parsed, finished=self._reap)
+        self._parsers.append(w)
+        return w
+
+    def _refresh(self, paths) -> list:
+        "Runs on a worker thread"
+        return self.cache.refresh(paths, self.sites())
+
+    @Slot()
+    def rematch(self):
+        "match the files against the current sites again, e.g., after the site list changed"
+        self._parsed(self.cache.rematch(self.sites()))
+
+    @Slot(object)
+    def _parsed(self, entries):
+        # the sites may have changed while the files were read
+        self.cache.rematch(self.sites(), entries)
+        for e in entries:
+            item = self._items.get(e.path)
+            if item is None:
+                # removed while being read
+                continue
+            if e.error:
+                item.setText(f"{e.path.name}\n    {e.error}")
+                item.setForeground(QBrush(Qt.red))
+            else:
+                label = entry_label(e.path, e.params)
+                if e.path in self._done:
+                    label = label.replace("\n", " (saved)\n", 1)
+                item.setText(label)
+                item.setData(Qt.ForegroundRole, QBrush(Qt.gray) if e.path in self._done else None)
+            problems = ", ".join(header for header, _ in e.record.problems) if e.record else ""
+            item.setToolTip(f"Not recognized: {problems}" if problems else "")
+
+    @Slot()
+    def _reap(self):
+        self._parsers = [w for w in self._parsers if not w.done]
+        if self._wanted is not None and self._wanted[1].done:
+            p = self._wanted[0]
+            self._wanted = None
+            self._emit(p, self.cache.peek(p))
+
+    @Slot(QListWidgetItem)
+    def _activated(self, item):
+        p = item.data(Qt.UserRole)
+        e = self.cache.get(p)
+        if e is None:
+            # not checked recently: read it in the background first
+            self._wanted = (p, self._read([p]))
+        else:
+            self._wanted = None
+            self._emit(p, e)
+
+    def _emit(self, p, e):
+        "emit fileChosen for p from its entry e, and start on the next ones"
+        if e is None:
+            # the file has gone
+            return
+        if e.error:
+            # the entry already shows why it can't be loaded
+            return
+        self._current = p
+        self.fileChosen.emit(p, e.params)
+        self.prefetch()
+
+    def markDone(self, path):
+        "show that path has been saved to the database"
+        path = Path(path) if path else None
+        item = self._items.get(path)
+        if item is not None and path not in self._done:
+            self._done.add(path)
+            item.setForeground(QBrush(Qt.gray))
+            item.setText(item.text().replace("\n", " (saved)\n", 1))
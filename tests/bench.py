@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Timing helpers for the benchmarks in test_benchmarks.py, and the other tests marked benchmark.
+They are skipped unless pytest is run with --benchmarks.
+
+Each benchmark's timings are summarized as a Stats and compared with
+benchmark_baseline.json.  A benchmark fails if its median is more than
+TOLERANCE times the baseline median; the default is generous because the
+baseline comes from one particular machine.
+
+Environment variables:
+    ISPY2_BENCH_TOLERANCE   allowed ratio to the baseline median (default 3)
+    ISPY2_BENCH_SAVE        if set, write this run's results as the new baseline
+"""
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+import statistics
+import time
+
+BASELINE = Path(__file__).parent / "benchmark_baseline.json"
+TOLERANCE = float(os.environ.get("ISPY2_BENCH_TOLERANCE", "3"))
+SAVE = bool(os.environ.get("ISPY2_BENCH_SAVE"))
+
+RESULTS = {}  # name -> Stats for this run
+
+
+@dataclass
+class Stats:
+    "timings in milliseconds"
+    n: int
+    median: float
+    p90: float
+    p99: float
+    min: float
+    max: float
+
+    @classmethod
+    def of(cls, times_ms):
+        q = statistics.quantiles(times_ms, n=100, method="inclusive")
+        return cls(len(times_ms), statistics.median(times_ms), q[89], q[98], min(times_ms), max(times_ms))
+
+
+def measure(fn, repeat: int, warmup: int = 2, setup=None) -> Stats:
+    """Time repeat calls of fn(), after warmup untimed ones.
+    setup(), if given, runs untimed before each call.
+    """
+    times = []
+    for i in range(warmup + repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter_ns()
+        fn()
+        t = time.perf_counter_ns() - t0
+        if i >= warmup:
+            times.append(t / 1e6)
+    return Stats.of(times)
+
+
+def load_baseline() -> dict:
+    "{name: Stats} from the stored baseline, empty if there is none"
+    try:
+        with BASELINE.open("rt", encoding="utf-8") as fin:
+            return {name: Stats(**d) for name, d in json.load(fin).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results: dict):
+    with BASELINE.open("wt", encoding="utf-8", newline="\r\n") as fout:
+        json.dump({name: {k: round(v, 4) for k, v in asdict(s).items()} for name, s in sorted(results.items())},
+                  fout, indent=2)
+        fout.write("\n")
+
+
+def check(name: str, stats: Stats, baseline: dict):
+    "record stats, and fail if they are too far above the baseline"
+    RESULTS[name] = stats
+    base = baseline.get(name)
+    if SAVE or base is None:
+        return
+    limit = base.median * TOLERANCE
+    assert stats.median <= limit, (
+        f"{name}: median {stats.median:.3f} ms is over {TOLERANCE:g} x baseline {base.median:.3f} ms")
+
+
+def report(baseline: dict) -> list:
+    "lines summarizing RESULTS against baseline"
+    lines = [f"{'benchmark':32} {'n':>4} {'median':>9} {'p90':>9} {'p99':>9} {'baseline':>9} {'ratio':>6}  (ms)"]
+    for name, s in sorted(RESULTS.items()):
+        base = baseline.get(name)
+        b = f"{base.median:9.3f} {s.median / base.median:6.2f}" if base else f"{'-':>9} {'-':>6}"
+        lines.append(f"{name:32} {s.n:4d} {s.median:9.3f} {s.p90:9.3f} {s.p99:9.3f} {b}")
+    return lines
@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+import os
+from pathlib import Path
+import sys
+
+import pytest
+
+# before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from tests import bench  # noqa: E402
+
+SITES = [(1, 1001, "UCSF"), (2, 1002, "Georgetown University"), (3, 2301, "Mayo Clinic")]
+DATA = Path(__file__).parent / "data"  # sample parameter files
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true",
+                     help="also run the tests marked benchmark, and compare them with the baseline; see bench.py")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: a timing, only run with --benchmarks")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    # timings vary with the machine, and take a while
+    skip = pytest.mark.skip(reason="a benchmark; run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app_home(tmp_path_factory):
+    "keep the site cache, journal and other files of the program out of the user's own"
+    home = tmp_path_factory.mktemp("ispy2_mri_home")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("ISPY2_MRI_HOME", str(home))
+        yield home
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    QtWidgets = pytest.importorskip("PySide6.QtWidgets")
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture(scope="session")
+def stub_backend():
+    """A db.Backend that answers at once and writes nothing.
+    Returns the spec to pass as BreastForm's dsn.
+    """
+    from ispy2_mri import db, sitecache
+
+    class StubBackend(db.Backend):
+        name = "stub"
+        next_id = 0
+
+        def select_sites(self):
+            return list(SITES)
+
+        def insert_ispy2(self, vals):
+            StubBackend.next_id += 1
+            return StubBackend.next_id
+
+        def update_ispy2(self, vals):
+            return tuple(vals)[-1]
+
+        def insert_deviation(self, ispy2_tbl_id, deviation_string="null"):
+            pass
+
+        def update_deviations(self, ispy2_tbl_id, add=(), remove=()):
+            pass
+
+        def select_ispy2(self, ispy2_tbl_id):
+            return None
+
+        def select_deviation(self, ispy2_tbl_id=None):
+            return []
+
+        def select_exam_keys(self):
+            return []
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    mp = pytest.MonkeyPatch()
+    mp.setattr(db, "open_backend", lambda spec=db.DSN: StubBackend())
+    # so the form has its sites from the start, as it usually does
+    sitecache.save("stub", SITES)
+    yield "stub"
+    mp.undo()
+
+
+@pytest.fixture
+def restore_excepthook():
+    "BreastForm installs its own"
+    hook = sys.excepthook
+    yield
+    sys.excepthook = hook
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    "the stored benchmark results; see bench.py"
+    return bench.load_baseline()
+
+
+@pytest.fixture(scope="module")
+def gui(qapp, stub_backend):
+    "the ispy2_gui module"
+    from PySide6.QtCore import QThreadPool
+
+    from ispy2_mri import ispy2_gui
+
+    yield ispy2_gui
+    # the forms' background connections
+    QThreadPool.globalInstance().waitForDone()
+
+
+@pytest.fixture
+def form(gui, stub_backend, restore_excepthook):
+    "a BreastForm on the stub backend"
+    f = gui.BreastForm(dsn=stub_backend)
+    yield f
+    f.deleteLater()
+
+
+def make_db(n: int = 0):
+    """a SQLiteBackend with the exams in complete.txt, with deviations 2 and 1, and sparse.txt, with none;
+    then n more like complete.txt, a day apart
+    """
+    from datetime import date
+
+    from ispy2_mri.scanparams import parse_file
+    from ispy2_mri.sqlitedb import SQLiteBackend
+
+    backend = SQLiteBackend(":memory:")
+    for _, site, name in SITES:
+        backend.add_site(site, name)
+    backend.add_deviation_reason("Late", 1, id=1)
+    backend.add_deviation_reason("Protocol", 2, id=2)
+    rec = parse_file(DATA / "complete.txt", SITES)
+    backend.insert_exam(rec.db_values(), "2, 1")
+    backend.insert_exam(parse_file(DATA / "sparse.txt", SITES).db_values(), "null")
+    for i in range(n):
+        rec.mri_date = date.fromordinal(date(2020, 1, 1).toordinal() + i)
+        backend.insert_exam(rec.db_values(), "1")
+    backend.commit()
+    return backend
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not bench.RESULTS:
+        return
+    baseline = bench.load_baseline()
+    terminalreporter.section("benchmarks")
+    for line in bench.report(baseline):
+        terminalreporter.write_line(line)
+    if bench.SAVE:
+        bench.save_baseline({**baseline, **bench.RESULTS})
+        terminalreporter.write_line(f"Saved as the new baseline in {bench.BASELINE}")
@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Timings of the main form operations, to catch regressions in the generated ispy2_gui.py.
+
+Runs with the offscreen Qt platform and a stub database backend; see conftest.py.
+The summary at the end of the pytest run shows medians and percentiles
+against the stored baseline; see bench.py.  Like the other tests marked
+benchmark, they only run with pytest --benchmarks.
+"""
+import pytest
+
+from tests import bench
+from tests.conftest import DATA
+
+pytestmark = pytest.mark.benchmark
+
+FILES = sorted(DATA.glob("*.txt"))
+
+
+def test_form_construction(gui, stub_backend, restore_excepthook, baseline, qapp):
+    forms = []
+
+    def build():
+        forms.append(gui.BreastForm(dsn=stub_backend))
+
+    stats = bench.measure(build, repeat=20)
+    # the form has the generated fields, including the deviation check boxes
+    assert len(forms[-1]._fields) > 30
+    for f in forms:
+        f.deleteLater()
+    qapp.processEvents()
+    bench.check("BreastForm()", stats, baseline)
+
+
+@pytest.mark.parametrize("path", FILES, ids=[p.stem for p in FILES])
+def test_read_file(form, path, baseline):
+    stats = bench.measure(lambda: form.readFile(path), repeat=200, setup=form.clear)
+    assert form.ispy2_id.todb().startswith("123")
+    bench.check(f"readFile({path.name})", stats, baseline)
+
+
+def test_clear(form, baseline):
+    path = DATA / "unmatched.txt"
+    # clearing a filled form, with some fields marked as errors, is the usual case
+    stats = bench.measure(form.clear, repeat=200, setup=lambda: form.readFile(path))
+    assert form.ispy2_id.todb() == ""
+    bench.check("clear()", stats, baseline)
+
+
+@pytest.mark.parametrize("method", ["all_values", "db_values", "discrep_values"])
+def test_values(form, method, baseline):
+    form.readFile(DATA / "complete.txt")
+    fn = getattr(form, method)
+    # db_values() is a generator
+    stats = bench.measure(lambda: list(fn()) if method == "db_values" else fn(), repeat=500)
+    bench.check(f"{method}()", stats, baseline)
+
+
+def test_db_values_match_batch_parse(form):
+    "the benchmarked path and the Qt-free one must agree, or the timings mean little"
+    from ispy2_mri import scanparams
+    from tests.conftest import SITES
+
+    path = DATA / "complete.txt"
+    form.loadFile(path)
+    assert tuple(form.db_values()) == scanparams.parse_file(path, SITES).db_values()
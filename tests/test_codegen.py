@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""build/pre_fields.py must reproduce the committed ispy2_gui.py and formtable.py from its inputs."""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+BUILD = Path(__file__).parents[1] / "build"
+
+
+@pytest.fixture(scope="module")
+def pre_fields():
+    spec = importlib.util.spec_from_file_location("pre_fields", BUILD / "pre_fields.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def reasons_db(tmp_path, monkeypatch):
+    "sqlite:PATH of a stand-in database with the deviation reasons the committed form shows"
+    from ispy2_mri import db, formspec
+    from ispy2_mri.sqlitedb import SQLiteBackend
+
+    # not the stub the form's tests use
+    monkeypatch.setattr(db, "open_backend", lambda spec: SQLiteBackend(spec.partition(":")[2]))
+    path = tmp_path / "reasons.sqlite3"
+    backend = SQLiteBackend(path)
+    for position, f in enumerate(f for f in formspec.fields() if f.reason is not None):
+        backend.add_deviation_reason(f.text, position, f.reason)
+    backend.commit()
+    backend.close()
+    return f"sqlite:{path}"
+
+
+@pytest.mark.parametrize("name", ["ispy2_gui.py", "formtable.py"])
+def test_generate(pre_fields, reasons_db, tmp_path, name):
+    assert pre_fields.generate(tmp_path, dsn=reasons_db)
+    assert (tmp_path / name).read_bytes() == (pre_fields.TARGET.parent / name).read_bytes()
+
+
+def test_manifest_current(pre_fields):
+    "fails if an input changed without rerunning pre_fields.py"
+    assert pre_fields.up_to_date()
+
+
+def test_content_hash_ignores_line_ends(pre_fields, tmp_path):
+    (tmp_path / "crlf").write_bytes(b"a\r\nb\r\n")
+    (tmp_path / "lf").write_bytes(b"a\nb\n")
+    assert pre_fields.content_hash(tmp_path / "crlf") == pre_fields.content_hash(tmp_path / "lf")
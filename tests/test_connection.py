@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Reconnecting when the connection to the database has died."""
+import pytest
+
+from ispy2_mri import connection, db, journal
+from ispy2_mri.scanparams import parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests.conftest import DATA, SITES
+
+
+class Dropped(Exception):
+    "what the driver raises once the server has dropped the connection"
+
+
+class DroppableBackend(SQLiteBackend):
+    "a SQLite stand-in that can be cut off, as a server does overnight"
+    opened = []
+    down = False  # new connections are dead at once
+
+    def __init__(self):
+        super().__init__(":memory:")
+        self.dead = DroppableBackend.down
+        self.pings = 0
+        DroppableBackend.opened.append(self)
+
+    def ping(self):
+        self.pings += 1
+        self._check()
+
+    def _check(self):
+        if self.dead:
+            raise Dropped("08S01 communication link failure")
+
+    def select_sites(self):
+        self._check()
+        return list(SITES)
+
+    def is_connection_error(self, e):
+        return isinstance(e, Dropped)
+
+
+def sites_of(backend):
+    return backend.select_sites()
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    DroppableBackend.opened = []
+    DroppableBackend.down = False
+    monkeypatch.setattr(db, "open_backend", lambda spec: DroppableBackend())
+    c = connection.Connection("test")
+    c.connect()
+    yield c
+    c.close()
+
+
+def test_reconnects_once(conn):
+    with pytest.raises(RuntimeError):
+        connection.Connection("test").run(sites_of)
+    assert conn.run(sites_of) == SITES
+    first = conn.backend
+    first.dead = True
+    assert conn.run(sites_of) == SITES
+    assert conn.reconnects == 1 and conn.backend is not first
+    # not idle, so no pings
+    assert first.pings == 0 and conn.backend.pings == 0
+
+    def fail(backend):
+        raise ValueError("refused")
+    with pytest.raises(ValueError):
+        conn.run(fail)
+    assert conn.reconnects == 1
+    # a server that is down stays down
+    DroppableBackend.down = True
+    conn.backend.dead = True
+    with pytest.raises(Dropped):
+        conn.run(sites_of)
+    assert conn.reconnects == 2
+
+
+def test_checked_when_idle(conn):
+    conn.check_after = 0
+    calls = []
+    conn.backend.dead = True
+    conn.run(lambda backend: calls.append(backend))
+    # the dead connection was found, and replaced, before the call
+    assert calls == [conn.backend] and conn.reconnects == 1 and DroppableBackend.opened[0].pings == 1
+    assert not conn.keep_alive() and conn.backend.pings == 1
+    conn.backend.dead = True
+    assert conn.keep_alive() and conn.reconnects == 2
+    conn.check_after = 60
+    conn.backend.dead = True
+    assert not conn.keep_alive()
+
+
+def test_replay_after_drop(conn, tmp_path):
+    j = journal.Journal(tmp_path / "journal.sqlite3")
+    rec = parse_file(DATA / "complete.txt", SITES)
+    j.append(rec.db_values(), rec.discrep_values())
+    conn.backend.dead = True
+    # the insert fails, and is rolled back, on the dead connection
+    conn.backend.insert_ispy2 = lambda vals: conn.backend._check()
+    sent, rejected = conn.run(lambda backend: journal.replay(j, backend))
+    assert [i for _, i in sent] == [1] and not rejected and not j.pending()
+    assert conn.backend.select_exam_keys() == [(1, "12341", "A3w", "2023-10-01")]
+    j.close()
+
+
+def test_form_reconnects(form, qapp, tmp_path):
+    from PySide6.QtCore import QThreadPool
+
+    QThreadPool.globalInstance().waitForDone()
+    qapp.processEvents()
+    assert form.backend is not None
+    dead = DroppableBackend()
+    dead.dead = True
+    dead.insert_ispy2 = lambda vals: dead._check()
+    form.connection.backend = dead
+    for q in form.journal.pending():
+        form.journal.reject(q.seq, "not for this test")
+    rec = parse_file(DATA / "complete.txt", SITES)
+    form.journal.append(rec.db_values(), rec.discrep_values())
+    form.replay()
+    QThreadPool.globalInstance().waitForDone()
+    qapp.processEvents()
+    # sent on a new connection, with no wait and no message
+    assert not form.journal.pending() and form.connection.reconnects == 1
+    assert form.backend is not None and form.backend is not dead and form._failures == 0
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Reading consolidated exports of many exams."""
+import io
+import tracemalloc
+
+import pytest
+
+from ispy2_mri import consolidated, ingest
+from ispy2_mri.consolidated import iter_records
+from ispy2_mri.scanparams import SEVERAL_EXAMS, UnexpectedInputError, parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests import bench
+from tests.conftest import DATA, SITES
+
+
+def exam(i: int) -> str:
+    "text of exam i, like complete.txt but with its own I-SPY ID"
+    return (DATA / "complete.txt").read_text().replace("12341", str(20000 + i))
+
+
+def export(path, n: int, delimiter="-----\n"):
+    with path.open("wt") as fout:
+        for i in range(n):
+            fout.write(exam(i) + delimiter)
+    return path
+
+
+def test_ordinary_file():
+    [r] = iter_records(DATA / "complete.txt")
+    assert r.single and r.where == DATA / "complete.txt" and r.line == 1
+    assert r.parse(SITES) == parse_file(DATA / "complete.txt", SITES)
+
+
+def test_records(tmp_path):
+    path = tmp_path / "export.txt"
+    lines = exam(0).count("\n")
+    # no delimiter after the second; the repeated I-SPY ID starts the third
+    path.write_text(exam(0) + "\n=====\n\n" + exam(1) + exam(2) + "*****\nMystery\n" + exam(3))
+    records = list(iter_records(path))
+    assert [r.index for r in records] == [0, 1, 2, 3]
+    assert [r.line for r in records] == [1, lines + 4, 2 * lines + 4, 3 * lines + 5]
+    assert [r.params["I-SPY ID"] for r in records] == ["20000", "20001", "20002", "20003"]
+    assert not any(r.single for r in records)
+    assert records[1].where == f"{path}:{lines + 4}"
+    # only its own exam is spoiled
+    assert records[3].error == f"line {3 * lines + 5}: Can't handle mystery line: Mystery"
+    with pytest.raises(UnexpectedInputError):
+        records[3].parse(SITES)
+    assert records[2].parse(SITES).ispy2_id == "20002"
+    # the form and the worklist read one exam per file
+    with pytest.raises(UnexpectedInputError, match=SEVERAL_EXAMS):
+        parse_file(path, SITES)
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+    [r] = iter_records(path)
+    assert r.single and r.params == {} and not r.error
+
+
+def test_mmap(tmp_path, monkeypatch):
+    path = export(tmp_path / "export.txt", 50)
+    small = [(r.line, r.params) for r in iter_records(path)]
+    monkeypatch.setattr(consolidated, "MMAP_MIN", 0)
+    assert [(r.line, r.params) for r in iter_records(path)] == small
+
+
+def test_memory_is_flat(tmp_path, monkeypatch):
+    "memory in use while reading doesn't grow with the file"
+    monkeypatch.setattr(consolidated, "MMAP_MIN", 0)
+    peaks = []
+    for n in (200, 4000):
+        path = export(tmp_path / f"export{n}.txt", n)
+        tracemalloc.start()
+        count = sum(1 for _ in iter_records(path))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert count == n
+    assert peaks[1] < 2 * peaks[0]
+
+
+def test_ingest_export(tmp_path):
+    path = tmp_path / "export.txt"
+    lines = exam(0).count("\n")
+    path.write_text(exam(0) + "-----\n" + exam(1) + "Oops\n-----\n" + exam(2).replace("Breast: Left", "Breast: Middle"))
+    backend = SQLiteBackend(":memory:")
+    results = ingest.ingest([DATA / "sparse.txt", path], backend, SITES, out=io.StringIO())
+    assert results[DATA / "sparse.txt"][0] and results[f"{path}:1"][0]
+    assert results[f"{path}:{lines + 2}"] == (False, f"line {2 * lines + 2}: Can't handle mystery line: Oops")
+    assert results[f"{path}:{2 * lines + 4}"] == (False, "unrecognized Breast: Middle")
+    assert len(results) == 4
+
+
+@pytest.mark.benchmark
+def test_read_speed(tmp_path, baseline):
+    path = export(tmp_path / "export.txt", 1000)
+
+    def read():
+        for r in iter_records(path):
+            r.parse(SITES)
+
+    stats = bench.measure(read, repeat=10)
+    bench.check("iter_records+parse (1000 exams)", stats, baseline)
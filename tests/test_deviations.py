@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Sending only the deviation reasons that changed."""
+import sqlite3
+import sys
+import types
+
+import pytest
+
+from ispy2_mri import db, journal
+from ispy2_mri.scanparams import parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests.conftest import DATA, SITES
+
+
+class CountingBackend(SQLiteBackend):
+    "remembers the deviation calls made"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    def insert_deviation(self, ispy2_tbl_id, deviation_string="null"):
+        self.calls.append(("insert_deviation", deviation_string))
+        super().insert_deviation(ispy2_tbl_id, deviation_string)
+
+    def update_deviations(self, ispy2_tbl_id, add=(), remove=()):
+        self.calls.append(("update_deviations", list(add), list(remove)))
+        super().update_deviations(ispy2_tbl_id, add, remove)
+
+
+@pytest.fixture
+def backend():
+    b = CountingBackend(":memory:")
+    for position, rid in enumerate((1, 2, 7, 9)):
+        b.add_deviation_reason(f"reason {rid}", position, id=rid)
+    yield b
+    b.close()
+
+
+def reasons(backend, ispy2_tbl_id):
+    return [rid for rid, _, has_reason in backend.select_deviation(ispy2_tbl_id) if has_reason is not None]
+
+
+def test_delta():
+    assert db.deviation_delta((2, 7), [7, 9, 1]) == ([1, 9], [2])
+    assert db.deviation_delta((), ()) == ([], [])
+    assert db.deviation_statements(5) == []
+    [(delete, dparams), (insert, iparams)] = db.deviation_statements(5, [1, 9], [2], "dbo.")
+    assert delete == "DELETE FROM dbo.ispy2_deviation WHERE ispy2_tbl_id = ? AND ispy2_deviation_reason_id IN (?)"
+    assert dparams == [5, 2]
+    assert insert.endswith("VALUES (?, ?), (?, ?)") and iparams == [5, 1, 5, 9]
+
+
+def test_insert_exam(backend):
+    vals = list(parse_file(DATA / "complete.txt", SITES).db_values())
+    # a new record: only adds, and nothing at all without reasons
+    i = backend.insert_exam(vals, "2, 7", ())
+    j = backend.insert_exam(vals, "null", ())
+    assert backend.calls == [("update_deviations", [2, 7], [])]
+    assert reasons(backend, i) == [2, 7] and reasons(backend, j) == []
+
+    vals[-1] = i
+    backend.calls.clear()
+    backend.insert_exam(vals, "2, 7", (2, 7))
+    assert backend.calls == []
+    backend.insert_exam(vals, "7, 9", (2, 7))
+    assert backend.calls == [("update_deviations", [9], [2])]
+    assert reasons(backend, i) == [7, 9]
+    # unlike insert_ispy2_deviation, 'null' can take away the last ones
+    backend.insert_exam(vals, "null", (7, 9))
+    assert reasons(backend, i) == []
+
+    # without what was loaded, the stored procedure as before
+    backend.calls.clear()
+    backend.insert_exam(vals, "1", None)
+    assert backend.calls == [("insert_deviation", "1")] and reasons(backend, i) == [1]
+
+
+def test_update(backend):
+    vals = list(parse_file(DATA / "complete.txt", SITES).db_values())
+    i = backend.insert_exam(vals, "null", ())
+    vals[1:2] = ["A4"]
+    vals[-1] = i
+    # edits are plain updates; rb_insert_ispy2 is only known to insert
+    with pytest.raises(ValueError, match="update_ispy2"):
+        backend.insert_ispy2(vals)
+    assert backend.insert_exam(vals, "null", ()) == i
+    assert backend.select_ispy2(i)["visit_number"] == "A4"
+    assert backend.select_exam_keys() == [(i, "12341", "A4", "2023-10-01")]
+    vals[-1] = i + 1
+    with pytest.raises(ValueError, match="not in the database"):
+        backend.update_ispy2(vals)
+
+
+def test_journal(tmp_path, backend):
+    path = tmp_path / "journal.sqlite3"
+    # a journal written before the loaded column
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE writes (seq INTEGER PRIMARY KEY AUTOINCREMENT, queued TEXT NOT NULL, source TEXT,
+        vals TEXT NOT NULL, discrep TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', error TEXT,
+        ispy2_tbl_id INTEGER, sent TEXT)""")
+    conn.execute("INSERT INTO writes (queued, vals, discrep) VALUES ('', '[]', 'null')")
+    conn.commit()
+    conn.close()
+
+    j = journal.Journal(path)
+    vals = tuple(parse_file(DATA / "complete.txt", SITES).db_values())
+    j.append(vals, "2", "new.txt", ())
+    j.append((*vals[:-1], 1), "7", "id=1", (2, 7))
+    old, new, edit = j.pending()
+    assert old.loaded is None and new.loaded == () and edit.loaded == (2, 7)
+    j.reject(old.seq, "not for this test")
+
+    sent, rejected = journal.replay(j, backend)
+    assert [i for _, i in sent] == [1, 1] and not rejected
+    assert backend.calls == [("update_deviations", [2], []), ("update_deviations", [], [2])]
+    assert reasons(backend, 1) == []
+    j.close()
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, *params):
+        self.executed.append((sql, *params))
+        return self
+
+
+def test_odbc_one_batch(monkeypatch):
+    conn = types.SimpleNamespace(cursor=RecordingCursor)
+    monkeypatch.setitem(sys.modules, "pyodbc", types.SimpleNamespace(connect=lambda dsn: conn))
+    monkeypatch.delitem(sys.modules, "ispy2_mri.odbc", raising=False)
+    from ispy2_mri.odbc import OdbcBackend
+
+    backend = OdbcBackend("test")
+    backend.update_deviations(5)
+    assert backend.curs.executed == []
+    backend.update_deviations(5, [1, 9], [2])
+    [(sql, params)] = backend.curs.executed
+    assert sql.startswith("SET NOCOUNT ON;") and "DELETE FROM dbo.ispy2_deviation" in sql
+    assert "INSERT INTO dbo.ispy2_deviation" in sql and params == [5, 2, 5, 1, 5, 9]
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Duplicate exam detection, against a SQLite stand-in for the database."""
+from datetime import date, datetime
+import io
+import shutil
+
+import pytest
+
+from ispy2_mri import ingest
+from ispy2_mri.examindex import ExamIndex, exam_key, key_of
+from ispy2_mri.scanparams import parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests import bench
+from tests.conftest import DATA, SITES
+
+
+def test_key_normalization():
+    k = exam_key("12341", "A3w", date(2023, 10, 1))
+    # as the database returns them
+    assert exam_key(" 12341 ", "a3W", datetime(2023, 10, 1, 11, 30)) == k
+    assert exam_key("12341", "A3w", "2023-10-01T00:00:00") == k
+    assert exam_key("12341", "A3w", None) != k
+    assert exam_key("", "A3w", date(2023, 10, 1)) is None
+
+
+def test_load_and_update():
+    backend = SQLiteBackend(":memory:")
+    rec = parse_file(DATA / "complete.txt", SITES)
+    ispy2_tbl_id = backend.insert_exam(rec.db_values(), rec.discrep_values())
+    backend.commit()
+    exams = ExamIndex()
+    unsent = key_of(parse_file(DATA / "sparse.txt", SITES).db_values())
+    exams.add(unsent)
+    assert exams.load(backend) == 2
+    assert exams.get(key_of(rec.db_values())) == ispy2_tbl_id
+    # saved here and not yet sent
+    assert unsent in exams and exams.get(unsent) is None
+    exams.add(unsent, 99)
+    assert exams.get(unsent) == 99
+    # a later save without an id does not hide the one the database gave
+    exams.add(unsent)
+    assert exams.get(unsent) == 99
+    assert None not in exams
+
+
+def test_ingest_skips_duplicates(tmp_path):
+    backend = SQLiteBackend(":memory:")
+    shutil.copy(DATA / "complete.txt", tmp_path / "aegis.txt")
+    shutil.copy(DATA / "complete.txt", tmp_path / "brtool.txt")
+    shutil.copy(DATA / "sparse.txt", tmp_path / "other.txt")
+    files = ingest.find_files([tmp_path])
+    exams = ExamIndex()
+    exams.load(backend)
+    results = ingest.ingest(files, backend, SITES, out=io.StringIO(), exams=exams)
+    assert [results[f][0] for f in files] == [True, False, True]
+    assert results[tmp_path / "brtool.txt"][1].startswith("duplicate of id=")
+    # and on a second run, all are already there
+    exams.load(backend)
+    results = ingest.ingest(files, backend, SITES, out=io.StringIO(), exams=exams)
+    assert not any(ok for ok, _ in results.values())
+
+
+START = date(2015, 1, 1).toordinal()
+
+
+@pytest.mark.benchmark
+def test_lookup_time():
+    "the check on Save must not be noticeable, even with a long history"
+
+    class History:
+        def select_exam_keys(self):
+            return [(i, str(10000 + i // 4), f"A{i % 4}w", date.fromordinal(START + i // 4))
+                    for i in range(100_000)]
+
+    exams = ExamIndex()
+    exams.load(History())
+    # half of them recorded
+    keys = [exam_key(str(10000 + i), "A1w", date.fromordinal(START + i)) for i in range(0, 50_000, 25)]
+    assert sum(k in exams for k in keys) == len(keys) // 2
+    stats = bench.measure(lambda: [k in exams for k in keys], repeat=200)
+    bench.check("ExamIndex 2000 lookups (100k exams)", stats, bench.load_baseline())
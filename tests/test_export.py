@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Exporting exams, from a SQLite stand-in for the database."""
+import csv
+from datetime import date, datetime
+import io
+
+import pytest
+
+from ispy2_mri import db, export
+from ispy2_mri.scanparams import parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests import bench
+from tests.conftest import DATA, SITES, make_db
+
+
+def read_csv(path) -> list:
+    with path.open(newline="", encoding="utf-8") as fin:
+        return list(csv.DictReader(fin))
+
+
+def test_csv(tmp_path):
+    path = tmp_path / "out.csv"
+    assert export.export(make_db(), path, out=io.StringIO()) == 2
+    rows = read_csv(path)
+    assert [r["ispy2_id"] for r in rows] == ["12341", "12344"]
+    # by position, not as given
+    assert rows[0]["deviation_ids"] == "1; 2" and rows[0]["deviations"] == "Late; Protocol"
+    assert rows[1]["deviation_ids"] == rows[1]["deviations"] == ""
+    assert rows[0]["mri_date"] == "2023-10-01 00:00:00"
+
+
+def test_filters(tmp_path):
+    backend = make_db(30)
+    path = tmp_path / "out.csv"
+    # several batches, to check exams aren't split across them
+    assert export.export(backend, path, first=date(2020, 1, 10), last=date(2020, 1, 19), arraysize=3,
+                         out=io.StringIO()) == 10
+    rows = read_csv(path)
+    assert rows[0]["mri_date"] == "2020-01-10 00:00:00" and rows[-1]["mri_date"] == "2020-01-19 00:00:00"
+    assert export.export(backend, path, site=export.parse_site("Mayo", SITES), out=io.StringIO()) == 1
+    with pytest.raises(ValueError):
+        export.parse_site("Stanford", SITES)
+
+
+def test_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    assert export.export(make_db(5), path, "parquet", arraysize=2, out=io.StringIO()) == 7
+    table = pq.read_table(path)
+    assert table.num_rows == 7
+    assert table.column("mri_date")[0].as_py() == datetime(2023, 10, 1)
+    assert table.column("deviations")[0].as_py() == "Late; Protocol"
+    # no exams still gives a file
+    assert export.export(make_db(), path, "parquet", first=date(2030, 1, 1), out=io.StringIO()) == 0
+    assert pq.read_table(path).num_rows == 0
+
+
+def test_main(tmp_path, monkeypatch):
+    # not the stub the form's tests use
+    monkeypatch.setattr(db, "open_backend", lambda spec: SQLiteBackend(spec.partition(":")[2]))
+    db_path = tmp_path / "ispy2.db"
+    backend = SQLiteBackend(db_path)
+    backend.insert_exam(parse_file(DATA / "complete.txt", SITES).db_values(), "null")
+    backend.commit()
+    backend.close()
+    assert export.main([str(tmp_path / "out.csv"), "--dsn", f"sqlite:{db_path}", "--from", "2023-10-01"]) == 0
+    assert [r["ispy2_id"] for r in read_csv(tmp_path / "out.csv")] == ["12341"]
+    with pytest.raises(SystemExit):
+        export.main([str(tmp_path / "out.xlsx"), "--dsn", f"sqlite:{db_path}"])
+
+
+@pytest.mark.benchmark
+def test_export_speed(tmp_path, baseline):
+    backend = make_db(20000)
+    path = tmp_path / "out.csv"
+    stats = bench.measure(lambda: export.export(backend, path, out=io.StringIO()), repeat=5, warmup=1)
+    bench.check("export CSV (20k exams)", stats, baseline)
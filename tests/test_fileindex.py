@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""The index pairing the parameter files for an exam."""
+import os
+import shutil
+import threading
+
+import pytest
+
+from ispy2_mri import fileindex
+from ispy2_mri.fileindex import FileIndex, read_partners
+from tests import bench
+from tests.conftest import DATA, SITES
+
+KEY = ("12341", "a3w", 738794)  # complete.txt, 10/01/2023
+
+# complete.txt as the other program writes it: different PE threshold, no gray threshold
+TWIN = """I-SPY ID: 12341
+Date: 10/01/2023 11:31:02
+Visit ID: A3w
+Institution: UCSF
+Breast: L
+Tumor Volume: 12.30
+Early Post Timing: 2:30 (2)
+Late Post Timing: 7:45 (6)
+PE Threshold: 75%
+Scan Duration: 90.5
+MOCO: Y
+FOV: 32 x 32
+"""
+
+
+@pytest.fixture
+def folder(tmp_path):
+    d = tmp_path / "inbox"
+    d.mkdir()
+    shutil.copy(DATA / "complete.txt", d / "aegis.txt")
+    (d / "brtool.txt").write_text(TWIN)
+    shutil.copy(DATA / "sparse.txt", d / "sparse.txt")
+    (d / "notes.txt").write_text("nothing to see here\n")
+    return d
+
+
+@pytest.fixture
+def index(tmp_path):
+    i = FileIndex(tmp_path / "fileindex.sqlite3")
+    yield i
+    i.close()
+
+
+def test_update(folder, index, tmp_path):
+    assert fileindex.params_key({"I-SPY ID": "12341", "Visit ID": "A3w", "Date": "10/01/2023 11:30:00"}) == KEY
+    assert index.update([folder]) == 4
+    assert index.lookup(KEY) == [folder / "aegis.txt", folder / "brtool.txt"]
+    assert index.lookup(None) == [] and len(index) == 4
+    # only what changed is read again
+    assert index.update([folder]) == 0
+    twin = folder / "brtool.txt"
+    twin.write_text(TWIN.replace("A3w", "A6w"))
+    os.utime(twin, ns=(1, 1))
+    assert index.update([folder]) == 1
+    assert index.lookup(KEY) == [folder / "aegis.txt"]
+    (folder / "aegis.txt").unlink()
+    assert index.update([str(folder) + os.sep]) == 0
+    assert index.lookup(KEY) == [] and len(index) == 3
+    # a folder that can't be listed is left alone
+    assert index.update([tmp_path / "missing"]) == 0
+    index.close()
+    assert len(FileIndex(tmp_path / "fileindex.sqlite3")) == 3
+
+
+def test_merge(folder):
+    aegis = {"PE Threshold": "70%", "Breast": "Left", "Gray Threshold": "60%", "Institution": "UCSF"}
+    brtool = {"PE Threshold": "75", "Breast": "L", "Institution": "ucsf ", "MOCO": "Y"}
+    merged, conflicts = fileindex.merge([("a", aegis), ("b", brtool)], SITES)
+    assert merged == {**aegis, "MOCO": "Y"}
+    assert conflicts == {"PE Threshold": [("a", "70%"), ("b", "75")]}
+    assert fileindex.merge([("a", aegis)], SITES) == (aegis, {})
+
+
+def settle(qapp):
+    "let the form's workers finish and their signals arrive"
+    from PySide6.QtCore import QThreadPool
+
+    for _ in range(4):
+        QThreadPool.globalInstance().waitForDone()
+        qapp.processEvents()
+
+
+def test_form_pairs(form, folder, index, monkeypatch, qapp):
+    monkeypatch.setattr(form, "fileIndex", index)
+    index.update([folder])
+    reads = []
+    monkeypatch.setattr(fileindex, "read_partners", lambda *args: reads.append(threading.current_thread())
+                        or read_partners(*args))
+    form.loadFile(folder / "aegis.txt")
+    settle(qapp)
+    # the other file is read off the GUI thread
+    assert reads and threading.main_thread() not in reads
+    assert form.fileButton.text() == "aegis.txt + brtool.txt"
+    assert form.pe_threshold.todb() == "70" and form.bg_grey_threshold.todb() == "60"
+    assert form.pe_threshold.styleSheet() == form.CONFLICT_STYLE
+    assert "brtool.txt: 75%" in form.pe_threshold.toolTip()
+    assert form.breast.styleSheet() == ""
+    # the one without a gray threshold gets it from the other
+    form.loadFile(folder / "brtool.txt")
+    settle(qapp)
+    assert form.bg_grey_threshold.todb() == "60" and form.pe_threshold.todb() == "75"
+    form.clear()
+    assert form.pe_threshold.styleSheet() == "" and "disagree" not in form.pe_threshold.toolTip()
+
+
+@pytest.mark.benchmark
+def test_lookup_speed(tmp_path, index, baseline):
+    d = tmp_path / "many"
+    d.mkdir()
+    text = (DATA / "complete.txt").read_text()
+    for i in range(2000):
+        (d / f"{i}.txt").write_text(text.replace("12341", str(20000 + i)))
+    assert index.update([d]) == 2000
+    key = ("21234", "a3w", KEY[2])
+    stats = bench.measure(lambda: index.lookup(key), repeat=1000)
+    assert index.lookup(key) == [d / "1234.txt"]
+    bench.check("FileIndex.lookup (2000 files)", stats, baseline)
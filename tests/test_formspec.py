@@ -0,0 +1,32 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""The form table, with and without Qt."""
+import pytest
+
+from ispy2_mri import formspec, scanparams
+
+
+def test_catalogue_without_qt():
+    names = [f.name for f in formspec.fields()]
+    assert len(names) == len(set(names))
+    # every value in a parameter file has a field to go in
+    assert set(scanparams.GUIDE.values()) <= set(names)
+    assert formspec.field_named("visit_number").choices[:2] == ("", "1")
+    assert formspec.deviation_reasons()["discrep13"] == 13
+    with pytest.raises(KeyError):
+        formspec.field_named("no_such_field")
+
+
+def test_form_built_from_table(qapp, stub_backend, restore_excepthook):
+    from ispy2_mri import ispy2_gui
+
+    form = ispy2_gui.BreastForm(dsn=stub_backend)
+    assert list(form._fields) == [f.name for f in formspec.fields()]
+    for f in formspec.fields():
+        assert type(getattr(form, f.name)).__name__ == f.widget
+    assert form.discrep13.val() == 13
+    assert form.visit_number.count() == len(formspec.field_named("visit_number").choices)
+    assert len(form._automatics) == sum(s.automatic for s in formspec.sections())
+    form.deleteLater()
@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Cold start of the package for scripted use: no Qt or pyodbc unless needed.
+
+Each check runs a fresh interpreter with -X importtime, whose report on stderr
+has a line per module: self and cumulative microseconds, then the name,
+indented by nesting.
+"""
+import subprocess
+import sys
+
+import pytest
+
+from tests import bench
+
+# what batch tools import
+SCRIPTED = "import ispy2_mri.ingest, ispy2_mri.formspec, ispy2_mri.journal, ispy2_mri.sitecache, ispy2_mri.sqlitedb"
+
+
+def importtime(code: str) -> dict:
+    """Run code in a new interpreter.
+    Return {module: (cumulative ms, nesting depth)} for the modules it imported.
+    """
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                       capture_output=True, text=True, check=True)
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        # one space, then two more per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(cumulative) / 1000, depth)
+    return times
+
+
+def test_scripted_imports_skip_gui():
+    loaded = importtime(SCRIPTED)
+    assert "ispy2_mri.ingest" in loaded
+    assert not [m for m in loaded if m.startswith(("PySide6", "shiboken6", "pyodbc", "ispy2_mri.ispy2_gui"))]
+
+
+@pytest.mark.benchmark
+def test_scripted_import_time():
+    "benchmark of the package's own imports, against the baseline as for test_benchmarks.py"
+    times = []
+    for _ in range(5):
+        loaded = importtime(SCRIPTED)
+        times.append(sum(ms for m, (ms, depth) in loaded.items() if depth == 0 and m.startswith("ispy2_mri")))
+    bench.check("import (scripted)", bench.Stats.of(times), bench.load_baseline())
+
+
+def test_gui_names_load_qt_on_use():
+    pytest.importorskip("PySide6")
+    code = ("import sys, ispy2_mri\n"
+            "assert 'PySide6' not in sys.modules\n"
+            "from ispy2_mri import launch, BreastForm\n"
+            "assert 'PySide6.QtWidgets' in sys.modules\n"
+            "from ispy2_mri import db\n"
+            "assert db.DSN\n")
+    subprocess.run([sys.executable, "-c", code], check=True)
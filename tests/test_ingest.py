@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Entering directories of parameter files, against a SQLite stand-in for the database."""
+import io
+import shutil
+
+import pytest
+
+from ispy2_mri import ingest
+from ispy2_mri.examindex import ExamIndex
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests.conftest import DATA, SITES
+
+
+@pytest.fixture
+def files(tmp_path):
+    "complete.txt, sparse.txt, unmatched.txt, whose site and more aren't recognized, and one that isn't there"
+    for name in ("complete.txt", "sparse.txt", "unmatched.txt"):
+        shutil.copy(DATA / name, tmp_path / name)
+    return [*ingest.find_files([tmp_path]), tmp_path / "missing.txt"]
+
+
+@pytest.fixture
+def backend():
+    b = SQLiteBackend(":memory:")
+    yield b
+    b.close()
+
+
+def test_ingest(files, backend):
+    out = io.StringIO()
+    results = ingest.ingest(files, backend, SITES, batch_size=1, out=out)
+    assert [results[f][0] for f in files] == [True, True, False, False]
+    assert results[files[0]][1] == "id=1" and results[files[2]][1].startswith("unrecognized ")
+    assert out.getvalue().splitlines()[0] == f"OK   {files[0]}: id=1"
+    assert [r[0] for r in backend.select_exam_keys()] == [1, 2]
+    # lenient writes what it can read of the rejected file
+    results = ingest.ingest(files[2:3], backend, SITES, lenient=True, out=out)
+    assert results[files[2]][0] and "(left blank: " in results[files[2]][1]
+
+
+def test_dry_run(files, backend):
+    exams = ExamIndex()
+    results = ingest.ingest(files, backend, SITES, dry_run=True, out=io.StringIO(), exams=exams)
+    assert [results[f] for f in files[:2]] == [(True, "parsed"), (True, "parsed")]
+    assert backend.select_exam_keys() == []
+    # the exams are known, without ids, so duplicates are caught
+    again = ingest.ingest(files[:1], backend, SITES, dry_run=True, out=io.StringIO(), exams=exams)
+    assert again == {files[0]: (False, "duplicate of an earlier exam")}
+
+
+def test_commit_fails(files, backend, monkeypatch):
+    exams = ExamIndex()
+
+    def commit():
+        raise RuntimeError("08S01 link failure")
+    monkeypatch.setattr(backend, "commit", commit)
+    results = ingest.ingest(files[:2], backend, SITES, out=io.StringIO(), exams=exams)
+    assert results == {f: (False, "rolled back (RuntimeError: 08S01 link failure)") for f in files[:2]}
+    # nothing was written, so a later run may write them
+    assert backend.select_exam_keys() == [] and len(exams) == 0
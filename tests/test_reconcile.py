@@ -0,0 +1,138 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Reconciling parameter files with a SQLite stand-in for the database."""
+import csv
+import io
+import shutil
+
+import pytest
+
+from ispy2_mri import db, reconcile
+from ispy2_mri.ingest import find_files
+from ispy2_mri.scanparams import parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests.conftest import DATA, SITES
+
+
+@pytest.fixture
+def backend():
+    "complete.txt, entered with a wrong PE threshold and breast"
+    b = SQLiteBackend(":memory:")
+    for _, site, name in SITES:
+        b.add_site(site, name)
+    rec = parse_file(DATA / "complete.txt", SITES)
+    rec.pe_threshold = "7"
+    rec.breast = "r"
+    b.insert_exam(rec.db_values(), "null", ())
+    b.commit()
+    yield b
+    b.close()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    "complete.txt, sparse.txt twice, and unmatched.txt; the database doesn't have the last two"
+    d = tmp_path / "archive"
+    d.mkdir()
+    for name in ("complete.txt", "sparse.txt", "unmatched.txt"):
+        shutil.copy(DATA / name, d / name)
+    shutil.copy(DATA / "sparse.txt", d / "sparse2.txt")
+    return find_files([d])
+
+
+def test_differences():
+    rec = parse_file(DATA / "complete.txt", SITES)
+    stored = dict(zip(reconcile.COMPARED, (getattr(rec, col) for col in reconcile.COMPARED)))
+    headers = ("I-SPY ID", "Breast", "PE Threshold", "FOV")
+    # as the server returns them
+    assert reconcile.differences(rec, headers, dict(stored, pe_threshold=70, breast="L", fov1=32)) == []
+    diffs = reconcile.differences(rec, headers, dict(stored, fov2=23, scan_duration=1))
+    assert diffs == [reconcile.Difference("fov2", 23, 32)]
+    assert str(diffs[0]) == "fov2: 23 -> 32"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_report(backend, archive, workers):
+    out = io.StringIO()
+    rows = io.StringIO()
+    counts = reconcile.reconcile(archive, backend, SITES, workers=workers, chunk=1, out=out,
+                                 diffs_out=csv.writer(rows))
+    assert counts == dict(same=0, different=1, new=3, ambiguous=0, failed=0, updated=0, inserted=0)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("DIFF ") and lines[0].endswith("complete.txt: id=1: breast: 'r' -> 'l'; "
+                                                             "pe_threshold: 7 -> '70'")
+    assert [line.split()[0] for line in lines] == ["DIFF", "NEW", "NEW", "NEW"]
+    assert [r[2:] for r in csv.reader(io.StringIO(rows.getvalue()))] == [["breast", "r", "l"],
+                                                                          ["pe_threshold", "7", "70"]]
+    # nothing written
+    assert backend.select_ispy2(1)["pe_threshold"] == 7
+
+
+def test_apply(backend, archive):
+    out = io.StringIO()
+    counts = reconcile.reconcile(archive, backend, SITES, workers=1, apply=True, batch_size=1, out=out)
+    assert counts["updated"] == 1 and counts["inserted"] == 1 and counts["new"] == 2
+    # the second copy of sparse.txt matches the first
+    assert counts["same"] == 1
+    # unmatched.txt is new, but its values couldn't all be read
+    assert counts["failed"] == 1 and "FAIL" in out.getvalue() and "unmatched.txt" in out.getvalue()
+    values = backend.select_ispy2(1)
+    assert values["pe_threshold"] == 70 and values["breast"] == "l"
+    assert [k[1] for k in backend.select_exam_keys()] == ["12341", "12344"]
+    counts = reconcile.reconcile(archive, backend, SITES, workers=1, out=io.StringIO())
+    assert counts["different"] == 0 and counts["same"] == 3
+
+
+def test_apply_checks_changes(backend, archive):
+    "only the values an update changes are checked, and a bad one doesn't roll back the batch"
+    # entered by the web form, which let a 'uk' date code have a date
+    backend.conn.execute("UPDATE ispy2 SET report_returned_code = 'uk', report_returned_date = '2023-10-02'")
+    sparse = parse_file(DATA / "sparse.txt", SITES)
+    sparse.breast = "L"
+    backend.insert_exam(sparse.db_values(), "null", ())
+    backend.commit()
+    bad = archive[0].parent / "zfov.txt"
+    bad.write_text((DATA / "complete.txt").read_text().replace("I-SPY ID: 12341", "I-SPY ID: 12349")
+                   .replace("FOV: 32.0 x 32.0", "FOV: 60.0 x 32.0"))
+    fixed = parse_file(bad, SITES)
+    fixed.fov1 = 32
+    backend.insert_exam(fixed.db_values(), "null", ())
+    backend.commit()
+    out = io.StringIO()
+    counts = reconcile.reconcile([*archive[:2], bad], backend, SITES, workers=1, apply=True, out=out)
+    assert counts["updated"] == 2 and counts["failed"] == 1
+    assert "zfov.txt: not updated; fov1: 60 is not a whole number from 22 to 48" in out.getvalue()
+    assert "rolled back" not in out.getvalue()
+    assert backend.select_ispy2(1)["pe_threshold"] == 70 and backend.select_ispy2(2)["breast"] == "r"
+    assert backend.select_ispy2(3)["fov1"] == 32
+
+
+def test_rollback(backend, archive, monkeypatch):
+    "a write the database refuses rolls back the batch"
+    def refuse(vals):
+        raise db_error
+    db_error = RuntimeError("refused")
+    monkeypatch.setattr(backend, "insert_ispy2", refuse)
+    monkeypatch.setattr(backend, "update_ispy2", refuse)
+    out = io.StringIO()
+    counts = reconcile.reconcile(archive[:2], backend, SITES, workers=1, apply=True, out=out)
+    assert counts["failed"] == 2 and counts["updated"] == counts["inserted"] == 0
+    assert "RuntimeError: refused" in out.getvalue()
+
+
+def test_main(tmp_path, archive, monkeypatch):
+    # not the stub the form's tests use
+    monkeypatch.setattr(db, "open_backend", lambda spec: SQLiteBackend(spec.partition(":")[2]))
+    db_path = tmp_path / "ispy2.db"
+    backend = SQLiteBackend(db_path)
+    for _, site, name in SITES:
+        backend.add_site(site, name)
+    backend.insert_exam(parse_file(DATA / "complete.txt", SITES).db_values(), "null", ())
+    backend.commit()
+    backend.close()
+    diffs = tmp_path / "diffs.csv"
+    args = [str(archive[0]), "--dsn", f"sqlite:{db_path}", "--workers", "1", "--csv", str(diffs)]
+    assert reconcile.main(args) == 0
+    assert diffs.read_text().splitlines() == ["where,id,column,database,file"]
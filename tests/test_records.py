@@ -0,0 +1,223 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Reading records back to correct them, against a SQLite stand-in for the database."""
+from datetime import date
+
+import pytest
+
+from ispy2_mri import journal, records
+from ispy2_mri.records import RecordCache, StoredExam
+from ispy2_mri.scanparams import parse_file
+from ispy2_mri.sqlitedb import SQLiteBackend
+from tests import bench
+from tests.conftest import DATA, SITES
+
+
+@pytest.fixture
+def backend():
+    "complete.txt, with deviation reasons 2 and 7, the latter not on the form"
+    b = SQLiteBackend(":memory:")
+    for position, rid in enumerate((1, 2, 7)):
+        b.add_deviation_reason(f"reason {rid}", position, id=rid)
+    rec = parse_file(DATA / "complete.txt", SITES)
+    b.insert_exam(rec.db_values(), "2, 7")
+    b.commit()
+    yield b
+    b.close()
+
+
+def test_fetch(backend):
+    exam = records.fetch(backend, 1)
+    assert exam.id == 1 and exam.deviations == (2, 7)
+    assert exam.values["ispy2_id"] == "12341"
+    assert exam.key() == ("12341", "a3w", date(2023, 10, 1).toordinal())
+    assert exam.describe() == "id=1: 12341 A3w 2023-10-01"
+    assert records.fetch(backend, 99) is None
+
+
+def test_cache(backend):
+    cache = RecordCache(maxsize=2)
+    calls = []
+    select = backend.select_ispy2
+    backend.select_ispy2 = lambda i: calls.append(i) or select(i)
+    assert cache.fetch(backend, 1) is cache.fetch(backend, 1)
+    assert calls == [1]
+    for i in (2, 3):
+        cache.put(StoredExam(i, {}, ()))
+    # 1 was used least recently
+    assert 1 not in cache and len(cache) == 2
+    cache.get(2)
+    cache.put(StoredExam(4, {}, ()))
+    assert 2 in cache and 3 not in cache
+    cache.discard(2)
+    assert cache.get(2) is None
+    # nothing cached for an id the database doesn't have
+    assert cache.fetch(backend, 99) is None and 99 not in cache
+
+
+def test_edit(form, backend):
+    exam = records.fetch(backend, 1)
+    form.showRecord(exam)
+    assert form.recordId == 1
+    original = parse_file(DATA / "complete.txt", SITES).db_values()
+    assert tuple(form.db_values()) == (*original[:-1], 1)
+    assert form.discrep2.isChecked() and not form.discrep1.isChecked()
+    # the reason without a check box stays
+    assert form.discrep_values() == "2, 7"
+
+    for q in form.journal.pending():
+        form.journal.reject(q.seq, "not for this test")
+    form.comments.fromdb("corrected")
+    form.discrep1.setChecked(True)
+    assert form.write()
+    assert form.recordId is None and 1 not in form.records
+    # not again until there is another exam to save
+    assert not form.submit.isEnabled()
+    form.newRecord()
+    assert form.submit.isEnabled()
+    sent, rejected = journal.replay(form.journal, backend)
+    assert [i for _, i in sent] == [1] and not rejected
+    assert backend.select_exam_keys() == [(1, "12341", "A3w", "2023-10-01")]
+    exam = records.fetch(backend, 1)
+    assert exam.values["comments"] == "corrected"
+    assert exam.deviations == (1, 2, 7)
+
+
+def test_edit_removes_last_reason(form, backend):
+    backend.insert_deviation(1, "2")
+    backend.commit()
+    form.showRecord(records.fetch(backend, 1))
+    for q in form.journal.pending():
+        form.journal.reject(q.seq, "not for this test")
+    form.discrep2.setChecked(False)
+    assert form.discrep_values() == "null"
+    assert form.write()
+    journal.replay(form.journal, backend)
+    assert records.fetch(backend, 1).deviations == ()
+
+
+def test_old_and_blank_values(form, backend):
+    exam = records.fetch(backend, 1)
+    values = dict(exam.values, mri_date=date(2015, 6, 30), site=None, breast=None, moco=None, fov1=None)
+    form.showRecord(StoredExam(1, values, ()))
+    assert form.mri_date.todb() == date(2015, 6, 30)
+    assert form.site.todb() is None and form.breast.todb() == "" and form.moco.todb() == "N"
+    assert form.fov.todb() == [None, 32]
+
+
+def test_history(form, backend, monkeypatch):
+    for i in (1, 2, 3):
+        form.records.put(StoredExam(i, {"ispy2_id": str(i)}, ()))
+    for i in (1, 2, 3):
+        form.openRecord(i)
+    form.back()
+    form.back()
+    assert form.recordId == 1 and form.forwardButton.isEnabled() and not form.backButton.isEnabled()
+    form.forward()
+    assert form.recordId == 2
+    # opening another drops what was ahead
+    form.openRecord(3)
+    form.openRecord(1)
+    assert form._history == [1, 2, 3, 1]
+    # a file is a new exam
+    form.loadFile(DATA / "sparse.txt")
+    assert form.recordId is None and tuple(form.db_values())[-1] is None
+
+
+def test_look_up(form, monkeypatch):
+    opened = []
+    monkeypatch.setattr(form, "openRecord", opened.append)
+    form.exams.add(("12341", "a3w", 10), 5)
+    form.exams.add(("12341", "b3w", 20), 8)
+    form.exams.add(("12345", "a3w", 20), 9)
+    for text in ("#7", "id=6", "12345", "42"):
+        form.recordEdit.setText(text)
+        form.lookUp()
+    assert opened == [7, 6, 9, 42]
+    monkeypatch.setattr(form, "_chooseRecord", lambda found: found[-1][1])
+    form.recordEdit.setText("12341")
+    form.lookUp()
+    assert opened[-1] == 8
+
+
+@pytest.mark.benchmark
+def test_cached_record_speed(form, backend, baseline):
+    form.records.put(records.fetch(backend, 1))
+    stats = bench.measure(lambda: form.openRecord(1), repeat=200)
+    assert form.recordId == 1
+    bench.check("openRecord() cached", stats, baseline)
+
+
+def test_apply_record(form, backend):
+    form.showRecord(records.fetch(backend, 1))
+    record = form.snapshot()
+    form.newRecord()
+    assert form.snapshot() != record
+    assert form.apply_record(record) == []
+    assert form.snapshot() == record
+    # values the fields don't take are shown as errors, until a record with good ones replaces them
+    assert form.apply_record(dict(record, site=9999, breast="x")) == ["breast", "site"]
+    assert form.site.styleSheet() and form.breast.styleSheet()
+    form.apply_record(record)
+    assert not form.site.styleSheet() and not form.breast.styleSheet() and not form.site.toolTip()
+    # fields it lacks are cleared
+    form.apply_record({"ispy2_id": "5"})
+    assert form.ispy2_id.todb() == "5" and form.site.todb() is None and form.fov.todb() == [None, None]
+
+
+def test_switch_paints(form, backend, qapp):
+    """_bulk() leaves updates on: turning them off while switching exams, and back on after,
+    paints the whole form instead of the fields that changed.
+    """
+    from PySide6.QtCore import QEvent, QObject
+
+    class PaintCounter(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint:
+                counts[-1] += 1
+            return False
+
+    good = form._recordValues(records.fetch(backend, 1))
+    bad = dict(good, site=9999, breast="x", visit_number="A9w")
+    counter = PaintCounter()
+    counts = []
+    form.show()
+    qapp.processEvents()
+    qapp.installEventFilter(counter)
+    try:
+        for off in (False, True) * 2:
+            for record in (bad, good):
+                counts.append(0)
+                form.setUpdatesEnabled(not off)
+                form.apply_record(record)
+                form.setUpdatesEnabled(True)
+                qapp.processEvents()
+    finally:
+        qapp.removeEventFilter(counter)
+        form.hide()
+    plain, off = counts[4:6], counts[6:]  # the first round settles the styling
+    assert 0 < max(plain) and 2 * max(plain) < min(off)
+
+
+@pytest.mark.benchmark
+def test_switch_speed(form, backend, baseline, qapp):
+    """Switching between two exams, one with values the form doesn't take, with apply_record(),
+    repaint included.  Only guards against regressions: it takes about as long as setting
+    the widgets one by one did.
+    """
+    good = form._recordValues(records.fetch(backend, 1))
+    bad = dict(good, site=9999, breast="x", visit_number="A9w")
+    exams = [good, bad] * 200
+
+    def apply_record():
+        form.apply_record(exams.pop())
+        qapp.processEvents()
+
+    form.show()
+    try:
+        stats = bench.measure(apply_record, repeat=100)
+    finally:
+        form.hide()
+    bench.check("switch exams apply_record()", stats, baseline)
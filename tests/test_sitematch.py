@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Matching the Institution of a file to a site."""
+import random
+import string
+
+import pytest
+
+from ispy2_mri import scanparams
+from ispy2_mri.sitematch import AliasTable, SiteMatcher, matcher, normalize
+from tests import bench
+from tests.conftest import DATA, SITES
+
+
+def test_normalize():
+    assert normalize("The Univ. of  São Paulo") == "university sao paulo"
+    assert normalize("Mt. Sinai Med Ctr") == "mount sinai medical center"
+    assert normalize("") == normalize(None) == ""
+
+
+def test_matches():
+    m = SiteMatcher(SITES)
+    assert m.best("ucsf").how == "exact"
+    assert m.match("georgetown univ.") == SITES[1]
+    assert m.best("Georgetown").rec == SITES[1]
+    assert m.best("Mayo Clinc").how == "fuzzy"
+    assert m.best("MC").rec == SITES[2] and m.best("MC").how == "acronym"
+    # too far from anything
+    assert m.match("UCSF Medical Center") is None
+    assert m.candidates("UCSF Medical Center")[0].rec == SITES[0]
+    assert m.match("Stanford") is None
+    assert m.match("") is None
+    # it still looks like the list of records
+    assert list(m) == SITES and len(m) == 3 and m[1] == SITES[1]
+
+
+def test_ambiguous():
+    m = SiteMatcher([(1, 1, "Saint Mary Hospital"), (2, 2, "Saint Mark Hospital")])
+    assert m.match("Saint Mar Hospital") is None
+    assert m.match("St Mary Hosp") == (1, 1, "Saint Mary Hospital")
+
+
+def test_aliases(tmp_path):
+    path = tmp_path / "aliases.json"
+    aliases = AliasTable(path)
+    m = SiteMatcher(SITES, aliases)
+    assert m.match("UCSF Medical Center") is None
+    aliases.learn("UCSF  Medical Center", 1001)
+    assert m.best("ucsf medical center").how == "alias"
+    # saved for the next session
+    m = SiteMatcher(SITES, AliasTable(path))
+    assert m.match("UCSF Medical Center") == SITES[0]
+    # an alias for a site that is gone falls back to matching
+    AliasTable(path).learn("Georgetown", 9999)
+    assert SiteMatcher(SITES, AliasTable(path)).match("Georgetown") == SITES[1]
+
+
+def test_unusable_alias_file(tmp_path):
+    path = tmp_path / "aliases.json"
+    path.write_text("not json")
+    assert len(AliasTable(path)) == 0
+
+
+def test_parse_uses_matcher():
+    rec = scanparams.parse_file(DATA / "complete.txt", SITES)
+    assert rec.db_values() == scanparams.parse_file(DATA / "complete.txt", matcher(SITES)).db_values()
+    # plain lists share a matcher
+    assert matcher(list(SITES)) is matcher(SITES)
+
+
+@pytest.mark.benchmark
+def test_lookup_speed(baseline):
+    rng = random.Random(15)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(400)]
+    recs = [(i, 1000 + i, " ".join(rng.sample(words, 3)) + " Medical Center") for i in range(500)]
+    m = SiteMatcher(recs)
+    names = [r[2][:-2] for r in rng.sample(recs, 200)]
+
+    def lookups():
+        for name in names:
+            m.best(name)
+
+    stats = bench.measure(lookups, repeat=20)
+    assert m.match(names[0] + "er") is not None
+    # every site is a Medical Center; those trigrams mustn't make each lookup a pass over all of them
+    assert stats.median / len(names) < 1  # milliseconds per lookup
+    assert len(m.candidates("Medical Center")) == 3
+    bench.check("SiteMatcher 200 lookups (500 sites)", stats, baseline)
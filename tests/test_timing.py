@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Timing spans, and their log."""
+import json
+import sys
+import types
+
+import pytest
+
+from ispy2_mri import timing
+from tests import bench
+from tests.conftest import DATA
+
+
+@pytest.fixture
+def spans(tmp_path):
+    "the spans logged during the test, as a function returning them"
+    path = tmp_path / "timing.jsonl"
+    timing.enable(path)
+    yield lambda: [json.loads(line) for line in path.read_text().splitlines()]
+    timing.disable()
+
+
+def test_off(tmp_path):
+    assert not timing.enabled()
+    with timing.span("x", a=1) as s:
+        s.add(rows=2)
+    assert s is timing.span("y")
+
+
+def test_spans(spans):
+    with timing.span("outer", path="a.txt") as s:
+        with timing.span("inner"):
+            pass
+        s.add(rows=3)
+    with pytest.raises(ValueError), timing.span("failed"):
+        raise ValueError
+    inner, outer, failed = spans()
+    assert inner["span"] == "inner" and outer["span"] == "outer"
+    assert outer["path"] == "a.txt" and outer["rows"] == 3 and outer["ok"]
+    assert outer["ms"] >= inner["ms"] >= 0 and outer["thread"] == "MainThread"
+    assert not failed["ok"]
+
+
+def test_read_file(form, spans):
+    form.readFile(DATA / "complete.txt")
+    [s] = spans()
+    assert s["span"] == "readFile" and s["path"].endswith("complete.txt")
+
+
+class FakeCursor:
+    "just enough of a pyodbc cursor for OdbcBackend"
+    description = (("id",),)
+    rowcount = 1
+
+    def __init__(self):
+        self.rows = []
+
+    def execute(self, sql, *params):
+        if "sites" in sql:
+            self.rows = [types.SimpleNamespace(id=1, site=1001, name="UCSF")]
+        elif "rb_insert_ispy2" in sql:
+            self.rows = [types.SimpleNamespace(ispy2_tbl_id=7)]
+        return self
+
+    def nextset(self):
+        pass
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+
+def test_odbc_spans(monkeypatch, spans):
+    conn = types.SimpleNamespace(cursor=FakeCursor, commit=lambda: None, rollback=lambda: None)
+    fake = types.SimpleNamespace(connect=lambda dsn: conn)
+    monkeypatch.setitem(sys.modules, "pyodbc", fake)
+    monkeypatch.delitem(sys.modules, "ispy2_mri.odbc", raising=False)
+    from ispy2_mri.odbc import OdbcBackend
+
+    backend = OdbcBackend("breastdb-test")
+    assert backend.select_sites() == [(1, 1001, "UCSF")]
+    assert backend.insert_exam(iter(("12341", None)), "1, 2") == 7
+    assert backend.update_ispy2(iter(("12341", 7))) == 7
+    backend.commit()
+    logged = spans()
+    assert [s["span"] for s in logged] == ["pyodbc.connect", "select_ispy2_sites", "rb_insert_ispy2",
+                                           "insert_ispy2_deviation", "update_ispy2", "commit"]
+    assert logged[0]["dsn"] == "breastdb-test" and logged[1]["rows"] == 1
+    assert logged[2]["ispy2_id"] == "12341" and logged[3]["id"] == 7 and logged[4]["id"] == 7
+
+
+@pytest.mark.benchmark
+def test_overhead_when_off(baseline):
+    def spans():
+        for _ in range(10000):
+            with timing.span("x", id=1):
+                pass
+
+    stats = bench.measure(spans, repeat=50)
+    bench.check("10k timing spans, off", stats, baseline)
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Checking values against what the database columns take, one exam and many at once."""
+from datetime import date
+from decimal import Decimal
+import io
+import random
+
+import pytest
+
+from ispy2_mri import validation
+from ispy2_mri.scanparams import DB_COLUMNS, parse_file
+from tests import bench
+from tests.conftest import DATA, SITES, make_db
+
+
+def complete() -> dict:
+    return dict(zip(DB_COLUMNS, parse_file(DATA / "complete.txt", SITES).db_values()))
+
+
+def test_check():
+    assert validation.check(complete()) == []
+    assert validation.check(dict(zip(DB_COLUMNS, parse_file(DATA / "sparse.txt", SITES).db_values()))) == []
+    values = dict(complete(), fov1=50, pe_threshold="6", scan_duration=1234.5, comments="x" * 1001,
+                  site="UCSF", report_received_code="mdy", visit_number="")
+    problems = {p.column: p for p in validation.check(values)}
+    assert sorted(problems) == ["comments", "fov1", "pe_threshold", "report_received_code", "scan_duration", "site"]
+    assert str(problems["fov1"]) == "fov1: 50 is not a whole number from 22 to 48"
+    assert problems["comments"].message == "is 1001 characters; at most 1000 fit"
+    # the server rounds to 2 places, so this is 1000.00, too big for numeric(5, 2)
+    assert validation.check(dict(complete(), scan_duration=999.996))[0].column == "scan_duration"
+    assert validation.check(dict(complete(), scan_duration=Decimal("999.99"), pe_threshold=" 89 ", fov2=22.0)) == []
+    # only the codes we write are checked against the date; the web form wrote others
+    assert validation.check(dict(complete(), mri_code="dmy")) == []
+    assert validation.check(dict(complete(), mri_code="uk"))[0].message == \
+        "'uk' doesn't match mri_date; 'mdy' goes with a date, 'uk' without one"
+
+
+def random_values(rnd) -> dict:
+    "an exam with some values that pass and some that don't"
+    values = complete()
+    pick = rnd.choice
+    values.update(
+        pe_threshold=pick(["", None, "7", "89", "90", "6", "12.5", "abc", 45]),
+        fov1=pick([None, 22, 48, 21, 49, "30", "3O"]),
+        scan_duration=pick([None, 1.5, 999.99, 1000, "2.5", "x", Decimal("12.34")]),
+        ispy2_id=pick(["12341", "12345678901", "", None]),
+        breast=pick(["L", "R", "", "LR"]),
+        report_returned_date=pick([None, date(2023, 1, 1)]),
+        report_returned_code=pick(["uk", "mdy", "", None, "dmy"]),
+        site=pick([1001, None, "", "site"]),
+    )
+    return values
+
+
+def test_columns_match_check():
+    pytest.importorskip("numpy")
+    rnd = random.Random(3)
+    exams = [random_values(rnd) for _ in range(500)]
+    report, columns = validation.check_rows([tuple(v[col] for col in DB_COLUMNS) for v in exams])
+    expected = [(i, p.column, p.message) for i, v in enumerate(exams) for p in validation.check(v)]
+    assert sorted((p.row, p.column, p.message) for p in report.problems(columns)) == sorted(expected)
+    assert report.rows() == sorted({i for i, _, _ in expected})
+    assert report.n == 500 and sum(report.counts().values()) == len(expected)
+    assert report.summary()[0] == f"500 exams checked, {len(report.rows())} with problems."
+
+    report, _ = validation.check_rows([])
+    assert report.n == 0 and not report
+
+
+def test_validate():
+    pytest.importorskip("numpy")
+    backend = make_db(5)
+    backend.conn.execute("UPDATE ispy2 SET fov1 = 60, pe_threshold = 95 WHERE id = 3")
+    out = io.StringIO()
+    # several batches, with an exam's deviation rows split between them
+    assert validation.validate(backend, arraysize=2, out=out) == {"pe_threshold": 1, "fov1": 1}
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("7 exams checked")
+    assert lines[1:] == ["pe_threshold: 1", "  id=3: 95 is not a whole number from 7 to 89",
+                         "fov1: 1", "  id=3: 60 is not a whole number from 22 to 48"]
+
+
+def test_form(form, monkeypatch):
+    warnings = []
+    monkeypatch.setattr("ispy2_mri.ispy2_gui.QMessageBox.warning", lambda *args: warnings.append(args[2]))
+    form.readFile(DATA / "complete.txt")
+    assert form.is_sane()
+    form.fov.fromdb([50, 32])
+    assert not form.write()
+    assert warnings == ["Errors in fov (fov1: 50 is not a whole number from 22 to 48)"]
+
+
+@pytest.mark.benchmark
+def test_speed(baseline):
+    pytest.importorskip("numpy")
+    rnd = random.Random(5)
+    rows = [tuple(v[col] for col in DB_COLUMNS) for v in (random_values(rnd) for _ in range(20000))]
+    stats = bench.measure(lambda: validation.check_rows(rows), repeat=5, warmup=1)
+    # milliseconds
+    assert stats.median < 1000
+    bench.check("check_rows (20k exams)", stats, baseline)
@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""Running calls off the GUI thread."""
+
+
+def fail():
+    raise RuntimeError("lost")
+
+
+def test_done_before_signals(qapp):
+    "a slot may start the next call as soon as it hears of the last"
+    from ispy2_mri import workers
+
+    seen = []
+    for fn in (lambda: 1, fail):
+        w = workers.Worker(fn)
+        w.signals.result.connect(lambda r, w=w: seen.append(("result", w.done)))
+        w.signals.error.connect(lambda e, w=w: seen.append(("error", w.done)))
+        # in this thread, so the slots are called at once
+        w.run()
+    assert seen == [("result", True), ("error", True)]
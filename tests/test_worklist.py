@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2023-present Ross Boylan <ross.boylan@ucsf.edu>
+#
+# SPDX-License-Identifier: MIT
+
+"""The pane listing the inbox."""
+import shutil
+import threading
+
+from tests.conftest import DATA
+
+
+def settle(qapp):
+    "let the workers finish and their signals arrive"
+    from PySide6.QtCore import QThreadPool
+
+    for _ in range(4):
+        QThreadPool.globalInstance().waitForDone()
+        qapp.processEvents()
+
+
+def test_scan(qapp, tmp_path, monkeypatch):
+    from PySide6.QtCore import Qt
+
+    from ispy2_mri.worklist import Worklist
+
+    threads = []
+    listing = Worklist._list
+
+    def spy(inbox):
+        threads.append(threading.current_thread())
+        return listing(inbox)
+
+    monkeypatch.setattr(Worklist, "_list", staticmethod(spy))
+    shutil.copy(DATA / "complete.txt", tmp_path)
+    w = Worklist(tmp_path)
+    settle(qapp)
+    assert [w.list.item(i).text() for i in range(w.list.count())] == ["12341 | 10/01/2023 | UCSF\n    complete.txt"]
+    # the GUI thread only compares what the worker found
+    assert threads and threading.main_thread() not in threads
+
+    shutil.copy(DATA / "sparse.txt", tmp_path)
+    (tmp_path / "complete.txt").unlink()
+    w.scan()
+    w.scan()  # while the first is still listing
+    settle(qapp)
+    assert [w.list.item(i).data(Qt.UserRole).name for i in range(w.list.count())] == ["sparse.txt"]
+
+    # a listing of the old inbox, finishing after the inbox changed, is ignored
+    other = tmp_path / "other"
+    other.mkdir()
+    w.setInbox(other)
+    w._listed((tmp_path, {tmp_path / "sparse.txt"}))
+    settle(qapp)
+    assert w.list.count() == 0
+    w.deleteLater()